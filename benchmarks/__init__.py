@@ -0,0 +1,5 @@
+"""Performance benchmarks.
+
+These are not part of the test suite. Run them from the project root,
+e.g. ``python -m benchmarks.load``
+"""
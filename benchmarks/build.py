@@ -0,0 +1,40 @@
+"""Building wide selection sets: chained API versus builder"""
+from quiz import SELECTOR as _
+from quiz import Field, SelectionSet, SelectionSetBuilder
+
+from .common import report, timed
+
+
+def chained(names):
+    selection_set = _
+    for name in names:
+        selection_set = getattr(selection_set, name)(arg=1)
+    return selection_set
+
+
+def with_builder(names):
+    builder = SelectionSetBuilder()
+    for name in names:
+        getattr(builder, name)(arg=1)
+    return SelectionSet(*builder)
+
+
+def from_fields(names):
+    return SelectionSet(*(Field(name, {'arg': 1}) for name in names))
+
+
+def main():
+    for width in [100, 1000, 5000]:
+        names = ['field{}'.format(i) for i in range(width)]
+        assert chained(names) == with_builder(names) == from_fields(names)
+        print('{} fields:'.format(width))
+        baseline = timed(lambda: chained(names), number=3)
+        report('  chained', baseline)
+        report('  builder', timed(lambda: with_builder(names), number=3),
+               baseline)
+        report('  SelectionSet(*fields)',
+               timed(lambda: from_fields(names), number=3), baseline)
+
+
+if __name__ == '__main__':
+    main()
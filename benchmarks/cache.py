@@ -0,0 +1,47 @@
+"""Loading a schema from an API, with and without a ``SchemaCache``.
+
+The API is simulated in memory (see the ``ondemand`` benchmark),
+so only the work on the client side is measured."""
+import shutil
+import tempfile
+
+import quiz
+
+from .common import raw_github_schema, report, timed
+from .ondemand import InMemoryAPI
+
+URL = 'https://my.url/graphql'
+
+
+def main():
+    api = InMemoryAPI(raw_github_schema())
+    directory = tempfile.mkdtemp()
+    try:
+        baseline = timed(lambda: quiz.Schema.from_url(URL, client=api),
+                         number=3)
+        report('no cache', baseline)
+
+        quiz.Schema.from_url(URL, client=api,
+                             cache=quiz.SchemaCache(directory))
+        report('stored result, new process', timed(
+            lambda: quiz.Schema.from_url(URL, client=api,
+                                         cache=quiz.SchemaCache(directory)),
+            number=3), baseline)
+
+        cache = quiz.SchemaCache(directory)
+        quiz.Schema.from_url(URL, client=api, cache=cache)
+        report('stored result, same process', timed(
+            lambda: quiz.Schema.from_url(URL, client=api, cache=cache),
+            number=100), baseline)
+
+        expired = quiz.SchemaCache(directory, ttl=0)
+        quiz.Schema.from_url(URL, client=api, cache=expired)
+        report('expired, schema unchanged', timed(
+            lambda: quiz.Schema.from_url(URL, client=api, cache=expired),
+            number=3), baseline)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
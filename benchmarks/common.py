@@ -0,0 +1,32 @@
+"""Shared helpers for the benchmarks"""
+import json
+import timeit
+from os.path import dirname, join
+
+import quiz
+
+SCHEMA_PATH = join(dirname(__file__), '..', 'tests', 'example_schema.json')
+
+
+def raw_github_schema():
+    with open(SCHEMA_PATH) as rfile:
+        return json.load(rfile)
+
+
+def github_schema():
+    return quiz.Schema.from_raw(raw_github_schema(), module='github')
+
+
+def timed(func, number=10, repeat=3):
+    """best time per call, in seconds"""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+_UNITS = {'ms': 1e3, 'us': 1e6}
+
+
+def report(name, seconds, baseline=None, unit='ms'):
+    line = '{:<40} {:>10.3f} {}'.format(name, seconds * _UNITS[unit], unit)
+    if baseline is not None:
+        line += '   ({:.1f}x)'.format(baseline / seconds)
+    print(line)
@@ -0,0 +1,107 @@
+"""Creating schema classes from an introspection result:
+the original namedtuple pipeline versus the single-pass loader"""
+from collections import defaultdict
+from functools import partial
+from itertools import chain
+
+import quiz
+from quiz import schema as s
+from quiz import types
+from quiz.utils import FrozenDict, merge
+
+from .common import raw_github_schema, report, timed
+
+
+def _legacy_add_fields(obj, classes):
+    for f in obj.__raw__.fields:
+        setattr(obj, f.name, types.FieldDefinition(
+            name=f.name,
+            desc=f.desc,
+            args=FrozenDict({
+                i.name: types.InputValue(
+                    name=i.name,
+                    desc=i.desc,
+                    type=s.resolve_typeref(i.type, classes),
+                )
+                for i in f.args
+            }),
+            is_deprecated=f.is_deprecated,
+            deprecation_reason=f.deprecation_reason,
+            type=s.resolve_typeref(f.type, classes),
+        ))
+    del obj.__raw__
+
+
+def legacy_classes(raw_schema):
+    """The original implementation: deserialize into ``Type``, ``Field``,
+    ``InputValue`` and ``TypeRef`` namedtuples, then create classes"""
+    by_kind = defaultdict(list)
+    for tp in map(s._cast_type, map(s._deserialize_type,
+                                    raw_schema['types'])):
+        by_kind[tp.__class__].append(tp)
+    scalars = dict(types.BUILTIN_SCALARS)
+    scalars.update(
+        (tp.name,
+         type(str(tp.name), (types.GenericScalar, ), {'__doc__': tp.desc}))
+        for tp in by_kind[s.Scalar]
+        if tp.name not in scalars
+    )
+    interfaces = s._namedict(map(partial(s.interface_as_type, module=None),
+                                 by_kind[s.Interface]))
+    enums = s._namedict(map(partial(s.enum_as_type, module=None),
+                            by_kind[s.Enum]))
+    objs = s._namedict(map(partial(s.object_as_type, interfaces=interfaces,
+                                   module=None), by_kind[s.Object]))
+    unions = s._namedict(map(partial(s.union_as_type, objs=objs),
+                             by_kind[s.Union]))
+    input_objects = s._namedict(map(s.inputobject_as_type,
+                                    by_kind[s.InputObject]))
+    classes = merge(scalars, interfaces, enums, objs, unions, input_objects)
+    for obj in chain(objs.values(), interfaces.values()):
+        _legacy_add_fields(obj, classes)
+    for obj in chain(objs.values(), interfaces.values()):
+        types._field_table(obj)
+    return classes
+
+
+def _renamed(raw, suffix, builtins):
+    # rename all types, so several copies of a schema can be combined
+    if isinstance(raw, list):
+        return [_renamed(r, suffix, builtins) for r in raw]
+    elif isinstance(raw, dict):
+        return {
+            key: (value + suffix
+                  if key == 'name' and 'kind' in raw and value
+                  and value not in builtins
+                  else _renamed(value, suffix, builtins))
+            for key, value in raw.items()
+        }
+    return raw
+
+
+def scaled_schema(raw_schema, copies):
+    """A schema the given number of times as large"""
+    builtins = set(types.BUILTIN_SCALARS)
+    return dict(raw_schema, types=raw_schema['types'] + [
+        tp
+        for i in range(1, copies)
+        for tp in _renamed(raw_schema['types'], str(i), builtins)
+        if tp['name'] not in builtins
+    ])
+
+
+def main():
+    for copies in [1, 4]:
+        raw = scaled_schema(raw_github_schema(), copies)
+        print('{} types:'.format(len(raw['types'])))
+        baseline = timed(lambda: legacy_classes(raw), number=3)
+        report('  namedtuple pipeline', baseline)
+        report('  single-pass', timed(
+            lambda: s._create_classes(raw, module=None, scalars=()),
+            number=3), baseline)
+        report('  Schema.from_raw', timed(
+            lambda: quiz.Schema.from_raw(raw), number=3), baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+"""Validating large list arguments, e.g. ``nodes(ids: [ID!]!)``"""
+import quiz
+from quiz import SELECTOR as _
+
+from .common import github_schema, report, timed
+
+
+def legacy_isinstance(value, type_):
+    """The original ``List`` instance check: an isinstance() per item,
+    through the custom ``__instancecheck__`` hooks"""
+    return (isinstance(value, list)
+            and all(isinstance(i, type_.__arg__) for i in value))
+
+
+def main():
+    schema = github_schema()
+    type_ = schema.query_type.nodes.args['ids'].type
+    for size in [10000, 100000, 1000000]:
+        ids = [u'MDQ6VXNlcjE{}'.format(i) for i in range(size)]
+        number = max(1, 100000 // size)
+        print('{} ids:'.format(size))
+        baseline = timed(lambda: legacy_isinstance(ids, type_), number=number)
+        report('  per-item isinstance()', baseline)
+        report('  isinstance()',
+               timed(lambda: isinstance(ids, type_), number=number), baseline)
+        report('  validate()',
+               timed(lambda: quiz.validate(schema.query_type,
+                                           _.nodes(ids=ids)[_.id]),
+                     number=number),
+               baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Loading a large response: ``load`` vs ``compile_loader``"""
+from quiz import SELECTOR as _
+from quiz import compile_loader, load
+
+from .common import github_schema, report, timed
+
+schema = github_schema()
+
+selection = schema.query[
+    _
+    .repository(owner='octocat', name='hello-world')[
+        _
+        .name
+        .issues(first=100)[
+            _
+            .totalCount
+            .nodes[
+                _
+                .title
+                .number
+                .closed
+                .author[
+                    _
+                    .login
+                    .avatarUrl
+                ]
+                .labels(first=10)[
+                    _
+                    .nodes[
+                        _
+                        .name
+                        .color
+                    ]
+                ]
+            ]
+        ]
+    ]
+].selections
+
+
+def make_response(num_issues):
+    return {
+        'repository': {
+            'name': 'hello-world',
+            'issues': {
+                'totalCount': num_issues,
+                'nodes': [
+                    {
+                        'title': 'issue #{}'.format(i),
+                        'number': i,
+                        'closed': bool(i % 2),
+                        'author': {
+                            'login': 'user{}'.format(i),
+                            'avatarUrl': 'https://example.com/a.png',
+                        },
+                        'labels': {
+                            'nodes': [
+                                {'name': 'label{}'.format(j),
+                                 'color': 'ff0000'}
+                                for j in range(10)
+                            ]
+                        },
+                    }
+                    for i in range(num_issues)
+                ],
+            },
+        },
+    }
+
+
+def main():
+    for num_issues in (100, 1000, 5000):
+        response = make_response(num_issues)
+        print('{} issues ({} nodes):'.format(num_issues, num_issues * 12))
+        baseline = timed(lambda: load(schema.Query, selection, response),
+                         number=3)
+        report('  load', baseline)
+        loader = compile_loader(schema.Query, selection)
+        report('  compile_loader (precompiled)',
+               timed(lambda: loader(response), number=3), baseline)
+        report('  compile_loader (incl. compiling)',
+               timed(lambda: compile_loader(schema.Query, selection)(
+                   response), number=3), baseline)
+
+
+if __name__ == '__main__':
+    main()
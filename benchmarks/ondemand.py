@@ -0,0 +1,84 @@
+"""A short-lived job using a small part of a large API:
+full introspection versus retrieving types on demand.
+
+The API is simulated in memory, so only the work on the client side
+and the size of the responses are measured."""
+import json
+import re
+
+import snug
+
+import quiz
+from quiz import SELECTOR as _
+
+from .common import raw_github_schema, report, timed
+
+
+class InMemoryAPI:
+    """answers introspection queries from a raw schema"""
+
+    def __init__(self, raw_schema):
+        self.raw_schema = raw_schema
+        self.types = {conf['name']: conf for conf in raw_schema['types']}
+        self.received = 0
+        self.requests = 0
+
+    def send(self, req):
+        query = json.loads(req.content.decode('ascii'))['query']
+        if '__type(' in query:
+            data = {alias: self.types[name] for alias, name in
+                    re.findall(r'(\w+): __type\(name: "(\w+)"\)', query)}
+        elif 'FullType' in query:
+            data = {'__schema': self.raw_schema}
+        else:
+            data = {'__schema': dict(
+                self.raw_schema,
+                types=[{'name': name} for name in self.types])}
+        content = json.dumps({'data': data}).encode()
+        self.received += len(content)
+        self.requests += 1
+        return snug.Response(200, content)
+
+
+snug.send.register(InMemoryAPI, InMemoryAPI.send)
+
+
+def job(create, raw_schema):
+    api = InMemoryAPI(raw_schema)
+    schema = create(api)
+    query = schema.query[
+        _
+        .repository(owner='octocat', name='hello-world')[
+            _
+            .issues(first=10)[
+                _.nodes[_.number]
+            ]
+        ]
+    ]
+    quiz.load(schema.Query, query.selections, {
+        'repository': {'issues': {'nodes': [{'number': 4}]}}})
+    return api
+
+
+def main():
+    raw = raw_github_schema()
+    jobs = [
+        ('from_url', lambda api: quiz.Schema.from_url(
+            'https://my.url/graphql', client=api)),
+        ('from_url (lazy)', lambda api: quiz.Schema.from_url(
+            'https://my.url/graphql', client=api, lazy=True)),
+        ('from_url_on_demand', lambda api: quiz.Schema.from_url_on_demand(
+            'https://my.url/graphql', client=api)),
+    ]
+    baseline = None
+    for name, create in jobs:
+        seconds = timed(lambda: job(create, raw), number=3)
+        baseline = baseline or seconds
+        report(name, seconds, baseline)
+        api = job(create, raw)
+        print('  {} requests, {} kB received'.format(
+            api.requests, api.received // 1000))
+
+
+if __name__ == '__main__':
+    main()
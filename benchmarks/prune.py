@@ -0,0 +1,53 @@
+"""A worker using a small part of a large schema:
+loading the entire schema, versus a schema pruned to the worker's queries."""
+import json
+import tracemalloc
+
+import quiz
+from quiz import SELECTOR as _
+
+from .common import raw_github_schema, report, timed
+
+
+def allocated(func):
+    """memory allocated by the result of a call, in kB"""
+    tracemalloc.start()
+    result = func()  # noqa: F841
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size // 1000
+
+
+def main():
+    raw = raw_github_schema()
+    schema = quiz.Schema.from_raw(raw)
+    manifest = [
+        schema.query[
+            _
+            .repository(owner='octocat', name='hello-world')[
+                _
+                .name
+                .issues(first=10)[
+                    _.nodes[_.number.title.state]
+                ]
+            ]
+        ],
+        schema.query[_.viewer[_.login.name]],
+    ]
+    pruned = schema.pruned(queries=manifest).raw
+    print('{} of {} types, {} of {} kB JSON'.format(
+        len(pruned['types']), len(raw['types']),
+        len(json.dumps(pruned)) // 1000, len(json.dumps(raw)) // 1000))
+
+    baseline = timed(lambda: quiz.Schema.from_raw(raw), number=5)
+    report('from_raw', baseline)
+    report('from_raw (pruned)', timed(
+        lambda: quiz.Schema.from_raw(pruned), number=5), baseline)
+    print('  {} kB vs {} kB allocated'.format(
+        allocated(lambda: quiz.Schema.from_raw(json.loads(json.dumps(raw)))),
+        allocated(lambda: quiz.Schema.from_raw(
+            json.loads(json.dumps(pruned))))))
+
+
+if __name__ == '__main__':
+    main()
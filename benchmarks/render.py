@@ -0,0 +1,59 @@
+"""Rendering deep and wide selection sets to GraphQL"""
+from quiz import Field, InlineFragment, SelectionSet, argument_as_gql, gql
+from quiz.build import INDENT, RENDER_CACHE
+from quiz.compat import PY3
+
+from .common import report, timed
+
+if PY3:
+    from textwrap import indent
+else:
+    # the shim the original renderer used on python 2
+    def indent(text, pad):
+        return '\n'.join(map(pad.__add__, text.splitlines()))
+
+
+def legacy_gql(obj):
+    """The original renderer, which re-indents nested text at each level"""
+    if isinstance(obj, SelectionSet):
+        return '{{\n{}\n}}'.format(
+            '\n'.join(indent(legacy_gql(f), INDENT) for f in obj)
+        ) if obj.__selections__ else ''
+    elif isinstance(obj, Field):
+        arguments = '({})'.format(', '.join(
+            '{}: {}'.format(k, argument_as_gql(v))
+            for k, v in obj.kwargs.items()
+        )) if obj.kwargs else ''
+        selection_set = (' ' + legacy_gql(obj.selection_set)
+                         if obj.selection_set else '')
+        alias = obj.alias + ': ' if obj.alias else ''
+        return alias + obj.name + arguments + selection_set
+    else:
+        assert isinstance(obj, InlineFragment)
+        return '... on {} {}'.format(obj.on.__name__,
+                                     legacy_gql(obj.selection_set))
+
+
+def make_selection_set(depth, width):
+    leaves = [Field('field{}'.format(i), {'arg': i}) for i in range(width)]
+    selection_set = SelectionSet(*leaves)
+    for level in range(depth):
+        selection_set = SelectionSet(*leaves + [
+            Field('nested{}'.format(level), selection_set=selection_set)])
+    return selection_set
+
+
+def main():
+    RENDER_CACHE.resize(0)
+    for depth, width in [(2, 1000), (10, 100), (20, 50), (50, 10)]:
+        selection_set = make_selection_set(depth, width)
+        assert gql(selection_set) == legacy_gql(selection_set)
+        print('depth {}, width {} ({} fields):'.format(
+            depth, width, (depth + 1) * (width + 1)))
+        baseline = timed(lambda: legacy_gql(selection_set))
+        report('  nested indent (legacy)', baseline)
+        report('  single pass', timed(lambda: gql(selection_set)), baseline)
+
+
+if __name__ == '__main__':
+    main()
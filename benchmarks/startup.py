@@ -0,0 +1,54 @@
+"""Loading the GitHub schema: from JSON (eager or lazy),
+a snapshot, or a generated module"""
+import os
+import shutil
+import sys
+import tempfile
+
+import quiz
+
+from .common import SCHEMA_PATH, report, timed
+
+MODULE_NAME = 'benchmark_github_schema'
+
+
+def from_snapshot(path):
+    with open(path, 'rb') as rfile:
+        return quiz.Schema.from_snapshot(rfile.read())
+
+
+def from_module():
+    # import the (compiled and cached) module anew each time
+    sys.modules.pop(MODULE_NAME, None)
+    return quiz.Schema.from_module(MODULE_NAME)
+
+
+def main():
+    tmpdir = tempfile.mkdtemp()
+    sys.path.insert(0, tmpdir)
+    sys.dont_write_bytecode = False
+    try:
+        schema = quiz.Schema.from_path(SCHEMA_PATH)
+        snapshot_path = os.path.join(tmpdir, 'schema.snapshot')
+        with open(snapshot_path, 'wb') as wfile:
+            wfile.write(schema.to_snapshot())
+        schema.to_module(os.path.join(tmpdir, MODULE_NAME + '.py'))
+        from_module()  # the first import compiles the module
+        print('JSON: {} kB, snapshot: {} kB'.format(
+            os.path.getsize(SCHEMA_PATH) // 1000,
+            os.path.getsize(snapshot_path) // 1000))
+        baseline = timed(lambda: quiz.Schema.from_path(SCHEMA_PATH))
+        report('Schema.from_path', baseline)
+        report('Schema.from_path (lazy)',
+               timed(lambda: quiz.Schema.from_path(SCHEMA_PATH, lazy=True)),
+               baseline)
+        report('Schema.from_snapshot',
+               timed(lambda: from_snapshot(snapshot_path)), baseline)
+        report('Schema.from_module', timed(from_module), baseline)
+    finally:
+        sys.path.remove(tmpdir)
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
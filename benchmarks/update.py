@@ -0,0 +1,54 @@
+"""Following a small change to a schema:
+creating the schema again, versus updating it incrementally."""
+import copy
+
+import quiz
+
+from .common import raw_github_schema, report, timed
+
+
+def changed(raw_schema, name, change):
+    raw = copy.deepcopy(raw_schema)
+    change(next(conf for conf in raw['types'] if conf['name'] == name))
+    return raw
+
+
+def add_field(conf):
+    conf['fields'].append(dict(conf['fields'][0], name='foo'))
+
+
+def add_enum_value(conf):
+    conf['enumValues'].append(dict(conf['enumValues'][0], name='FOO'))
+
+
+def main():
+    raw = raw_github_schema()
+    # types referring to a changed type (transitively) get new classes.
+    # Repository is referred to by many types, IssueOrderField only by
+    # an input object.
+    for description, new in [
+            ('field added to Repository',
+             changed(raw, 'Repository', add_field)),
+            ('value added to IssueOrderField',
+             changed(raw, 'IssueOrderField', add_enum_value))]:
+        schema = quiz.Schema.from_raw(raw)
+        print('{} ({} of {} classes created):'.format(
+            description,
+            sum(cls is not schema.classes.get(name) for name, cls
+                in schema.updated(new).classes.items()),
+            len(schema.classes)))
+        baseline = timed(lambda: quiz.Schema.from_raw(new), number=5)
+        report('  from_raw', baseline)
+
+        # each update applies or reverts the change
+        state = [schema, new, raw]
+
+        def toggle():
+            schema, target, other = state
+            state[:] = [schema.updated(target), other, target]
+
+        report('  updated', timed(toggle, number=5), baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Micro-benchmarks of ``ValueObject``: slots versus a wrapped namedtuple"""
+from collections import namedtuple
+from operator import attrgetter
+
+from quiz.utils import ValueObject
+
+from .common import report, timed
+
+
+class LegacyField(object):
+    """The original implementation: a namedtuple wrapped in ``_values``,
+    with a property for each field"""
+    __slots__ = '_values'
+    _ntuple = namedtuple('_LegacyField',
+                         ['name', 'kwargs', 'selection_set', 'alias'])
+    _ntuple.__new__.__defaults__ = ((), (), None)
+
+    def __init__(self, *args, **kwargs):
+        self._values = self._ntuple(*args, **kwargs)
+
+    name = property(attrgetter('_values.name'))
+    alias = property(attrgetter('_values.alias'))
+
+    def replace(self, **kwargs):
+        new = type(self).__new__(type(self))
+        new._values = self._values._replace(**kwargs)
+        return new
+
+    def __eq__(self, other):
+        if type(self) is type(other):
+            return self._values == other._values
+        return NotImplemented
+
+    __hash__ = property(attrgetter('_values.__hash__'))
+
+
+class Field(ValueObject):
+    __fields__ = [
+        ('name', str, 'Field name'),
+        ('kwargs', tuple, 'Given arguments'),
+        ('selection_set', tuple, 'Selection of subfields'),
+        ('alias', str, 'Field alias'),
+    ]
+    __defaults__ = ((), (), None)
+
+
+def run(cls):
+    instance = cls('foo', alias='bar')
+    # equal, but not identical, so equality is actually compared
+    other = cls('foo', alias='bar')
+    return {
+        'construction': timed(lambda: cls('foo', alias='bar'), number=100000),
+        'attribute access': timed(lambda: instance.name, number=100000),
+        'equality': timed(lambda: instance == other, number=100000),
+        # the common case for interned selections
+        'equality (identical)': timed(lambda: instance == instance,
+                                      number=100000),
+        # not cached in the legacy version
+        'hash': timed(lambda: hash(instance), number=100000),
+        'replace': timed(lambda: instance.replace(alias='qux'),
+                         number=100000),
+    }
+
+
+def main():
+    legacy, current = run(LegacyField), run(Field)
+    for name in sorted(legacy):
+        print(name + ':')
+        report('  namedtuple (legacy)', legacy[name], unit='us')
+        report('  slots', current[name], legacy[name], unit='us')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,31 +2,58 @@
 import enum
 import re
 import typing as t
-from operator import attrgetter, methodcaller
+from collections import OrderedDict
+from functools import wraps
+from operator import methodcaller
 
-from .compat import indent, singledispatch
-from .utils import FrozenDict, ValueObject, compose, init_last
+import six
+
+from .compat import singledispatch
+from .utils import (Empty, FrozenDict, LRUCache, ValueObject, compose,
+                    identity, init_last)
 
 __all__ = [
     # building graphQL documents
     'SelectionSet',
+    'SelectionSetBuilder',
     'Selection',
     'Field',
     'InlineFragment',
+    'FragmentDefinition',
+    'FragmentSpread',
     'Raw',
     'Query',
+    'Variable',
     'SELECTOR',
+    'merge_queries',
+    'interned',
+    'INTERNED',
 
     # render
     'gql',
+    'gql_compact',
     'escape',
     'argument_as_gql',
+    'type_as_gql',
+    'RENDER_CACHE',
 ]
 
 INDENT = "  "
 
 gql = methodcaller("__gql__")
 
+RENDER_CACHE = LRUCache(maxsize=4096)
+"""Cache of rendered GraphQL text, keyed by (sub)selection.
+Use its :meth:`~quiz.utils.LRUCache.resize` or
+:meth:`~quiz.utils.LRUCache.info` methods to configure or inspect it."""
+
+
+def _cached_render(render):
+    @wraps(render)
+    def __gql__(self):
+        return RENDER_CACHE.get_or_compute(self, render, self)
+    return __gql__
+
 
 class SelectionSet(t.Iterable['Selection'], t.Sized):
     """Sequence of selections
@@ -45,10 +72,11 @@ class SelectionSet(t.Iterable['Selection'], t.Sized):
     # The attribute needs to have a dunder name to prevent
     # conflicts with GraphQL field names.
     # This is also why we can't just subclass `tuple`.
-    __slots__ = '__selections__'
+    __slots__ = '__selections__', '__hash'
 
     def __init__(self, *selections):
         self.__selections__ = selections
+        self.__hash = None
 
     # TODO: check if actually faster
     # faster, internal, alternative to __init__
@@ -56,6 +84,7 @@ class SelectionSet(t.Iterable['Selection'], t.Sized):
     def _make(cls, selections):
         instance = cls.__new__(cls)
         instance.__selections__ = tuple(selections)
+        instance.__hash = None
         return instance
 
     def __getattr__(self, fieldname):
@@ -89,6 +118,9 @@ class SelectionSet(t.Iterable['Selection'], t.Sized):
           bing
         }
         """
+        # special methods (e.g. ``__deepcopy__``) are not fields
+        if fieldname.startswith('__') and fieldname.endswith('__'):
+            raise AttributeError(fieldname)
         return SelectionSet._make(self.__selections__ + (Field(fieldname), ))
 
     def __getitem__(self, selections):
@@ -255,21 +287,27 @@ class SelectionSet(t.Iterable['Selection'], t.Sized):
         """The selection set as raw graphQL"""
         return self.__gql__()
 
+    @_cached_render
     def __gql__(self):
-        return '{{\n{}\n}}'.format(
-            '\n'.join(indent(gql(f), INDENT) for f in self)
-        ) if self.__selections__ else ''
+        return _render(self)
 
     def __eq__(self, other):
         if isinstance(other, type(self)):
-            return other.__selections__ == self.__selections__
+            return other is self or (
+                other.__selections__ == self.__selections__)
         return NotImplemented
 
     def __ne__(self, other):
         equality = self.__eq__(other)
         return NotImplemented if equality is NotImplemented else not equality
 
-    __hash__ = property(attrgetter('__selections__.__hash__'))
+    def __hash__(self):
+        if self.__hash is None:
+            self.__hash = hash(self.__selections__)
+        return self.__hash
+
+    def __reduce__(self):
+        return SelectionSet, self.__selections__
 
 
 class _AliasForNextField(object):
@@ -290,6 +328,124 @@ SELECTOR = SelectionSet()
 """An empty, extendable :class:`SelectionSet`"""
 
 
+# special methods, the builder's own (private) attributes,
+# and the attributes IPython uses for displaying objects
+_NOT_A_BUILDER_FIELD = re.compile(
+    r'__.*__$|_SelectionSetBuilder__|_repr_.*_$|_ipython_')
+
+
+class SelectionSetBuilder(object):
+    """Mutable counterpart of :class:`SelectionSet`,
+    for building large selection sets in linear time.
+
+    It supports the same chaining API, but modifies itself in place
+    instead of copying all selections at each step.
+    Create the (immutable) selection set with ``SelectionSet(*builder)``.
+
+    Parameters
+    ----------
+    *selections: Selection
+        Initial selections
+
+    Example
+    -------
+
+    >>> builder = SelectionSetBuilder()
+    >>> for name in ['foo', 'bar', 'qux']:
+    ...     getattr(builder, name)
+    >>> builder('my_alias').bla(a=4)[_.baz]
+    >>> str(SelectionSet(*builder))
+    {
+      foo
+      bar
+      qux
+      my_alias: bla(a: 4) {
+        baz
+      }
+    }
+
+    Note
+    ----
+    Each step returns the builder itself.
+    Its state is thus shared by all expressions built from it.
+
+    Note
+    ----
+    Special attributes (e.g. ``__deepcopy__``), and those IPython looks up
+    to display objects (e.g. ``_repr_html_``) are not added as fields.
+    Inspecting the builder thus does not modify it.
+    Other names starting with an underscore (e.g. ``_id``) are fields.
+    """
+    # Fields are stored as mutable [name, kwargs, selection_set, alias]
+    # lists, and only created when iterating.
+    __slots__ = '__selections', '__alias'
+
+    def __init__(self, *selections):
+        self.__selections = list(selections)
+        self.__alias = None
+
+    def __getattr__(self, fieldname):
+        if _NOT_A_BUILDER_FIELD.match(fieldname):
+            raise AttributeError(fieldname)
+        self.__selections.append(
+            [fieldname, FrozenDict.EMPTY, SELECTOR, self.__alias])
+        self.__alias = None
+        return self
+
+    def __getitem__(self, selections):
+        """Add a sub-selection to the last field.
+        This may be a :class:`SelectionSet` or another builder.
+
+        Raises
+        ------
+        utils.Empty
+            In case the builder is empty
+        """
+        if isinstance(selections, SelectionSetBuilder):
+            selections = SelectionSet(*selections)
+        assert isinstance(selections, SelectionSet)
+        assert len(selections.__selections__) >= 1
+        self.__set_last(2, selection_set=selections)
+        return self
+
+    def __call__(*args, **kwargs):
+        """Add arguments to the last field,
+        or an alias to the next field. See :meth:`SelectionSet.__call__`.
+
+        Raises
+        ------
+        utils.Empty
+            In case field arguments are given, but the builder is empty
+        """
+        if len(args) == 2:
+            self, self.__alias = args
+        else:
+            self, = args
+            self.__set_last(1, kwargs=FrozenDict(kwargs))
+        return self
+
+    def __set_last(self, index, **kwargs):
+        try:
+            target = self.__selections[-1]
+        except IndexError:
+            raise Empty
+        if isinstance(target, list):
+            target[index], = kwargs.values()
+        else:
+            self.__selections[-1] = target.replace(**kwargs)
+
+    def __iter__(self):
+        for selection in self.__selections:
+            yield Field(*selection) if isinstance(
+                selection, list) else selection
+
+    def __len__(self):
+        return len(self.__selections)
+
+    def __repr__(self):
+        return '<SelectionSetBuilder> {}'.format(gql(SelectionSet(*self)))
+
+
 class Raw(ValueObject):
     __fields__ = [
         ('content', str, 'The raw GraphQL content')
@@ -310,18 +466,9 @@ class Field(ValueObject):
     ]
     __defaults__ = (FrozenDict.EMPTY, SelectionSet(), None)
 
+    @_cached_render
     def __gql__(self):
-        arguments = '({})'.format(
-            ', '.join(
-                "{}: {}".format(k, argument_as_gql(v))
-                for k, v in self.kwargs.items()
-            )
-        ) if self.kwargs else ''
-        selection_set = (
-            ' ' + gql(self.selection_set)
-            if self.selection_set else '')
-        alias = self.alias + ': ' if self.alias else ''
-        return alias + self.name + arguments + selection_set
+        return _render(self)
 
 
 class InlineFragment(ValueObject):
@@ -331,30 +478,472 @@ class InlineFragment(ValueObject):
     ]
     # in the future: directives
 
+    @_cached_render
     def __gql__(self):
-        return '... on {} {}'.format(
-            self.on.__name__,
-            gql(self.selection_set)
-        )
+        return _render(self)
+
+
+class FragmentDefinition(ValueObject):
+    """A named fragment. Use :class:`FragmentSpread` to include it
+    in a selection set."""
+    __fields__ = [
+        ('name', str, 'Name of the fragment'),
+        ('on', type, 'Type of the fragment'),
+        ('selection_set', SelectionSet, 'Subfields of the fragment'),
+    ]
+
+    @_cached_render
+    def __gql__(self):
+        return _render(self)
+
+    def __str__(self):
+        return self.__gql__()
+
+
+class FragmentSpread(ValueObject):
+    """Inclusion of a named fragment in a selection set.
+    Its definition is rendered along with the query containing it."""
+    __fields__ = [
+        ('fragment', FragmentDefinition, 'The fragment to include'),
+    ]
+
+    def __gql__(self):
+        return '...' + self.fragment.name
 
 
 class Query(ValueObject):
     __fields__ = [
         ('cls', type, 'The query class'),
-        ('selections', SelectionSet, 'Fields selection')
+        ('selections', SelectionSet, 'Fields selection'),
+        ('variable_defs', FrozenDict[str, type],
+         'Types of the variables in the query, by name'),
     ]
+    __defaults__ = (FrozenDict.EMPTY, )
     # in the future:
     # - name (optional)
-    # - variable_defs (optional)
     # - directives (optional)
 
+    @_cached_render
     def __gql__(self):
-        return 'query ' + gql(self.selections)
+        return _render(self)
 
     def __str__(self):
         return self.__gql__()
 
 
+class Variable(ValueObject):
+    """A reference to a variable, for use as an argument value.
+    Its value is given when executing the query.
+
+    Example
+    -------
+
+    >>> _ = SelectionSet()
+    >>> str(_.repository(owner=Variable('owner'), name='quiz')[_.createdAt])
+    {
+      repository(owner: $owner, name: "quiz") {
+        createdAt
+      }
+    }
+    """
+    __fields__ = [
+        ('name', str, 'The variable name'),
+    ]
+
+    def __gql_dump__(self):
+        return '$' + self.name
+
+
+INTERNED = LRUCache(maxsize=65536)
+"""Table of canonical instances, used by :func:`interned`"""
+
+
+def interned(node):
+    """Get the canonical instance of a (nested) selection.
+    Structurally equal selections are thus shared,
+    so they take up memory only once,
+    and comparing them is an identity check in most cases.
+
+    Parameters
+    ----------
+    node: SelectionSet or Selection or Query
+        The object to intern. Its children are interned as well.
+
+    Returns
+    -------
+    SelectionSet or Selection or Query
+        An object equal to ``node``.
+        Nodes which can't be hashed are returned as-is.
+
+    Example
+    -------
+
+    >>> interned(_.foo[_.bar]) is interned(_.foo[_.bar])
+    True
+    """
+    try:
+        hash(node)
+    except TypeError:
+        return node
+    return INTERNED.get_or_compute(node, _intern_children, node)
+
+
+def _intern_children(node):
+    if isinstance(node, SelectionSet):
+        return SelectionSet._make(map(interned, node))
+    elif isinstance(node, Field):
+        return node.replace(kwargs=_interned_kwargs(node.kwargs),
+                            selection_set=interned(node.selection_set))
+    elif isinstance(node, (InlineFragment, FragmentDefinition)):
+        return node.replace(selection_set=interned(node.selection_set))
+    elif isinstance(node, FragmentSpread):
+        return FragmentSpread(interned(node.fragment))
+    elif isinstance(node, Query):
+        return node.replace(selections=interned(node.selections))
+    return node
+
+
+def _interned_kwargs(kwargs):
+    # type: (FrozenDict) -> FrozenDict
+    if not kwargs:
+        return FrozenDict.EMPTY
+    return INTERNED.get_or_compute(kwargs, identity, kwargs)
+
+
+def _merged_prefix(index):
+    # type: (int) -> str
+    return 'q{}_'.format(index)
+
+
+def merge_queries(queries):
+    """Merge several queries into one, so they can be executed
+    in a single request.
+    The root fields of each query are aliased with a prefix
+    (``q0_``, ``q1_``, ...) unique to the query.
+    Variables and named fragments are prefixed likewise,
+    so that they cannot conflict between queries.
+
+    Parameters
+    ----------
+    queries: ~typing.Sequence[Query]
+        The queries to merge. They must all be on the same type.
+
+    Returns
+    -------
+    Query
+        The merged query
+
+    Raises
+    ------
+    ValueError
+        If there are no queries, or if they are on different types
+    TypeError
+        If a query has a root selection other than a field.
+        Only field selections can be merged.
+
+    Example
+    -------
+
+    >>> str(merge_queries([
+    ...     schema.query[_.repository(owner='octocat', name='foo')[_.url]],
+    ...     schema.query[_.repository(owner='octocat', name='bar')[_.url]],
+    ... ]))
+    query {
+      q0_repository: repository(owner: "octocat", name: "foo") {
+        url
+      }
+      q1_repository: repository(owner: "octocat", name: "bar") {
+        url
+      }
+    }
+    """
+    if not queries:
+        raise ValueError('no queries to merge')
+    cls = queries[0].cls
+    if any(query.cls is not cls for query in queries):
+        raise ValueError('queries must all be on the same type')
+    selections = []
+    variable_defs = {}
+    for index, query in enumerate(queries):
+        prefix = _merged_prefix(index)
+        renamed = (_renamed(prefix, query.selections)
+                   if query.variable_defs or _fragments_of(query.selections)
+                   else query.selections)
+        for selection in renamed:
+            if not isinstance(selection, Field):
+                raise TypeError(
+                    'only field selections can be merged, '
+                    'not {!r}'.format(selection))
+            selections.append(selection.replace(
+                alias=prefix + (selection.alias or selection.name)))
+        variable_defs.update(
+            (prefix + name, type_)
+            for name, type_ in six.iteritems(query.variable_defs))
+    return Query(cls, SelectionSet._make(selections),
+                 FrozenDict(variable_defs))
+
+
+def _renamed(prefix, selection_set):
+    # type: (str, SelectionSet) -> SelectionSet
+    # prefix all variables and fragment names in a selection set
+    return SelectionSet._make([_renamed_selection(prefix, s)
+                               for s in selection_set])
+
+
+def _renamed_selection(prefix, selection):
+    if isinstance(selection, Field):
+        return selection.replace(
+            kwargs=FrozenDict(
+                (name, Variable(prefix + value.name)
+                 if isinstance(value, Variable) else value)
+                for name, value in six.iteritems(selection.kwargs)),
+            selection_set=_renamed(prefix, selection.selection_set))
+    elif isinstance(selection, InlineFragment):
+        return selection.replace(
+            selection_set=_renamed(prefix, selection.selection_set))
+    elif isinstance(selection, FragmentSpread):
+        fragment = selection.fragment
+        return FragmentSpread(fragment.replace(
+            name=prefix + fragment.name,
+            selection_set=_renamed(prefix, fragment.selection_set)))
+    return selection
+
+
+# Rendering walks the tree once, writing into a single buffer.
+# Each writer receives the indentation depth of the line it starts on.
+def _render(node):
+    # type: (object) -> str
+    buffer = []
+    _write(node, 0, buffer.append)
+    return ''.join(buffer)
+
+
+def _write(node, depth, write):
+    _WRITERS.get(type(node), _write_other)(node, depth, write)
+
+
+def _write_other(node, depth, write):
+    _write_text(gql(node), depth, write)
+
+
+# the start of each line with non-whitespace content (except the first)
+_INDENTABLE = re.compile(r'\n(?=[^\S\n]*\S)')
+
+
+def _write_text(text, depth, write):
+    # write pre-rendered text, indenting all but the first line
+    write(_INDENTABLE.sub('\n' + INDENT * depth, text) if depth else text)
+
+
+def _write_cached(node, depth, write):
+    # Nested nodes are cached as well. They are stored unindented,
+    # and indented once written.
+    _write_text(RENDER_CACHE.get_or_compute(node, _render, node),
+                depth, write)
+
+
+def _write_selection_set(selection_set, depth, write):
+    if not selection_set.__selections__:
+        return
+    write('{\n')
+    pad = INDENT * (depth + 1)
+    for selection in selection_set.__selections__:
+        write(pad)
+        _write(selection, depth + 1, write)
+        write('\n')
+    write(INDENT * depth + '}')
+
+
+def _write_field(field, depth, write):
+    if field.alias:
+        write(field.alias + ': ')
+    write(field.name)
+    if field.kwargs:
+        write('({})'.format(', '.join(
+            "{}: {}".format(k, argument_as_gql(v))
+            for k, v in field.kwargs.items()
+        )))
+    if field.selection_set:
+        write(' ')
+        _write_cached(field.selection_set, depth, write)
+
+
+def _write_inline_fragment(fragment, depth, write):
+    write('... on {} '.format(fragment.on.__name__))
+    _write_cached(fragment.selection_set, depth, write)
+
+
+def _write_fragment_definition(fragment, depth, write):
+    write('fragment {} on {} '.format(fragment.name, fragment.on.__name__))
+    _write_cached(fragment.selection_set, depth, write)
+
+
+def _write_fragment_spread(spread, depth, write):
+    write('...' + spread.fragment.name)
+
+
+def _write_query(query, depth, write):
+    write('query ')
+    if query.variable_defs:
+        write('({}) '.format(', '.join(
+            '${}: {}'.format(name, type_as_gql(type_))
+            for name, type_ in query.variable_defs.items()
+        )))
+    _write_cached(query.selections, depth, write)
+    for fragment in _fragments_of(query.selections):
+        write('\n\n')
+        _write_fragment_definition(fragment, depth, write)
+
+
+_WRITERS = {
+    SelectionSet: _write_selection_set,
+    Field: _write_field,
+    InlineFragment: _write_inline_fragment,
+    FragmentDefinition: _write_fragment_definition,
+    FragmentSpread: _write_fragment_spread,
+    Query: _write_query,
+}
+
+
+def _fragments_of(selection_set):
+    # type: (SelectionSet) -> t.List[FragmentDefinition]
+    """The fragments spread in a selection set, including nested ones,
+    in order of appearance"""
+    found = OrderedDict()
+    _collect_fragments(selection_set, found)
+    return list(found.values())
+
+
+def _collect_fragments(selection_set, found):
+    for selection in selection_set:
+        if isinstance(selection, FragmentSpread):
+            fragment = selection.fragment
+            if fragment.name not in found:
+                found[fragment.name] = fragment
+                _collect_fragments(fragment.selection_set, found)
+        elif isinstance(selection, (Field, InlineFragment)):
+            _collect_fragments(selection.selection_set, found)
+
+
+def gql_compact(obj):
+    """Render an object as compact GraphQL, without indentation
+    and with minimal separators. Useful for sending over the network.
+
+    Parameters
+    ----------
+    obj: SelectionSet or Selection or Query
+        The object to render
+
+    Returns
+    -------
+    str
+        The rendered GraphQL
+
+    Example
+    -------
+
+    >>> _ = SelectionSet()
+    >>> gql_compact(_.foo.bar(a=4, b='x')[_.qux].bing)
+    {foo bar(a:4 b:"x"){qux}bing}
+    """
+    return RENDER_CACHE.get_or_compute((gql_compact, obj),
+                                       _render_compact, obj)
+
+
+def _render_compact(node):
+    # type: (object) -> str
+    buffer = []
+    _write_compact(node, buffer.append)
+    return ''.join(buffer)
+
+
+def _write_compact(node, write):
+    _COMPACT_WRITERS.get(type(node), _write_compact_other)(node, write)
+
+
+def _write_compact_other(node, write):
+    write(gql(node))
+
+
+def _write_compact_cached(node, write):
+    # nested nodes are cached as well (see ``_write_cached``)
+    write(RENDER_CACHE.get_or_compute((gql_compact, node),
+                                      _render_compact, node))
+
+
+def _ends_with_name(selection):
+    # whether a separator is needed before a selection starting with a name
+    return type(selection) is not InlineFragment and not (
+        type(selection) is Field
+        and (selection.kwargs or selection.selection_set))
+
+
+_SPREADS = (InlineFragment, FragmentSpread)
+
+
+def _write_compact_selection_set(selection_set, write):
+    if not selection_set.__selections__:
+        return
+    write('{')
+    previous = None
+    for selection in selection_set.__selections__:
+        if (previous is not None and _ends_with_name(previous)
+                and type(selection) not in _SPREADS):
+            write(' ')
+        _write_compact(selection, write)
+        previous = selection
+    write('}')
+
+
+def _write_compact_field(field, write):
+    if field.alias:
+        write(field.alias + ':')
+    write(field.name)
+    if field.kwargs:
+        write('({})'.format(' '.join(
+            "{}:{}".format(k, argument_as_gql(v))
+            for k, v in field.kwargs.items()
+        )))
+    if field.selection_set:
+        _write_compact_cached(field.selection_set, write)
+
+
+def _write_compact_inline_fragment(fragment, write):
+    write('...on ' + fragment.on.__name__)
+    _write_compact_cached(fragment.selection_set, write)
+
+
+def _write_compact_fragment_definition(fragment, write):
+    write('fragment {} on {}'.format(fragment.name, fragment.on.__name__))
+    _write_compact_cached(fragment.selection_set, write)
+
+
+def _write_compact_fragment_spread(spread, write):
+    write('...' + spread.fragment.name)
+
+
+def _write_compact_query(query, write):
+    write('query')
+    if query.variable_defs:
+        write('({})'.format(' '.join(
+            '${}:{}'.format(name, type_as_gql(type_))
+            for name, type_ in query.variable_defs.items()
+        )))
+    _write_compact_cached(query.selections, write)
+    for fragment in _fragments_of(query.selections):
+        _write_compact_fragment_definition(fragment, write)
+
+
+_COMPACT_WRITERS = {
+    SelectionSet: _write_compact_selection_set,
+    Field: _write_compact_field,
+    InlineFragment: _write_compact_inline_fragment,
+    FragmentDefinition: _write_compact_fragment_definition,
+    FragmentSpread: _write_compact_fragment_spread,
+    Query: _write_compact_query,
+}
+
+
 _ESCAPE_PATTERNS = {
     '\b': r'\b',
     '\f': r'\f',
@@ -411,5 +1000,37 @@ def _enum_to_gql(obj):
     return obj.value
 
 
+_BUILTIN_TYPE_NAMES = {
+    str: 'String',
+    six.text_type: 'String',
+    int: 'Int',
+    float: 'Float',
+    bool: 'Boolean',
+}
+
+
+def type_as_gql(type_):
+    # type: (type) -> str
+    """Render a type as a GraphQL type reference
+
+    Parameters
+    ----------
+    type_: type
+        The type to render, e.g. ``int`` or ``Nullable[List[MyObject]]``
+
+    Returns
+    -------
+    str
+        The GraphQL type reference, e.g. ``Int!`` or ``[MyObject!]``
+    """
+    try:
+        # consistent with other dunder methods, we look it up on the class
+        renderer = type(type_).__gql_type__
+    except AttributeError:
+        return _BUILTIN_TYPE_NAMES.get(type_, type_.__name__) + '!'
+    else:
+        return renderer(type_)
+
+
 Selection = t.Union[Field, InlineFragment]
 """Field or inline fragment"""
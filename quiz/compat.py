@@ -9,14 +9,12 @@ PY2 = not PY3
 
 if PY3:
     from functools import singledispatch
-    from textwrap import indent
+    from os import replace
     map = map
 else:  # pragma: no cover
     from singledispatch import singledispatch  # noqa
-
-    def indent(text, pad):
-        return '\n'.join(map(pad.__add__, text.splitlines()))
-
+    # not atomic on windows, but python 2 has no alternative
+    from os import rename as replace  # noqa
     from itertools import imap as map
 
 
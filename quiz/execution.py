@@ -1,18 +1,25 @@
 """Components for executing GraphQL operations"""
+import enum
+import hashlib
 import json
 import typing as t
 from functools import partial
 
+import six
 import snug
-from gentools import irelay, py2_compatible, return_
+from gentools import irelay, py2_compatible, return_, sendreturn
 
-from .build import Query
-from .types import load
-from .utils import JSON, ValueObject
+from .build import Query, _merged_prefix, gql_compact, merge_queries
+from .types import _PRIMITIVE_TYPES, _cached_loader, validate_variables
+from .utils import JSON, FrozenDict, LRUCache, ValueObject
 
 __all__ = [
     'execute',
     'execute_async',
+    'execute_merged',
+    'execute_merged_async',
+    'execute_batch',
+    'execute_batch_async',
     'executor',
     'async_executor',
 
@@ -26,41 +33,277 @@ Executable = t.Union[str, Query]
 """Anything which can be executed as a GraphQL operation"""
 
 
+def _value_as_json(value):
+    # type: (object) -> JSON
+    if value is None or isinstance(value, _PRIMITIVE_TYPES):
+        return value
+    elif isinstance(value, (list, tuple)):
+        return list(map(_value_as_json, value))
+    elif isinstance(value, enum.Enum):
+        return value.value
+    else:
+        # consistent with other dunder methods, we look it up on the class
+        return type(value).__gql_dump__(value)
+
+
+def _operation(query_str, variables):
+    # type: (str, t.Mapping[str, object]) -> t.Dict[str, JSON]
+    operation = {'query': query_str}
+    if variables:
+        operation['variables'] = {
+            name: _value_as_json(value)
+            for name, value in six.iteritems(variables)
+        }
+    return operation
+
+
 @py2_compatible
-def _exec(executable):
-    # type: (Executable) -> t.Generator
-    if isinstance(executable, str):
-        return_((yield executable))
+def _exec(executable, variables):
+    # type: (Executable, t.Mapping[str, object]) -> t.Generator
+    if isinstance(executable, six.string_types):
+        return_((yield _operation(executable, variables)))
     elif isinstance(executable, Query):
-        return_(load(
-            executable.cls,
-            executable.selections,
-            (yield str(executable))
-        ))
+        validate_variables(executable.variable_defs, variables)
+        loader = _cached_loader(executable.cls, executable.selections)
+        return_(loader((
+            yield _operation(gql_compact(executable), variables))))
     else:
         raise NotImplementedError('not executable: ' + repr(executable))
 
 
+def _merged_variables(queries, variables):
+    # type: (t.Sequence[Query], t.Sequence[t.Mapping[str, object]]) -> dict
+    if len(variables) > len(queries):
+        raise ValueError('more variable mappings than queries')
+    variables = list(variables) + [FrozenDict.EMPTY] * (
+        len(queries) - len(variables))
+    merged = {}
+    for index, (query, values) in enumerate(zip(queries, variables)):
+        validate_variables(query.variable_defs, values)
+        prefix = _merged_prefix(index)
+        merged.update((prefix + name, value)
+                      for name, value in six.iteritems(values))
+    return merged
+
+
 @py2_compatible
-def middleware(url, query_str):
-    # type: (str, str) -> snug.Query[t.Dict[str, JSON]]
-    request = snug.Request(
+def _exec_merged(queries, variables):
+    # type: (t.Sequence[Query], t.Sequence[t.Mapping]) -> t.Generator
+    merged = merge_queries(queries)
+    operation = _operation(gql_compact(merged),
+                           _merged_variables(queries, variables))
+    try:
+        data = yield operation
+    except ErrorResponse as e:
+        data, errors = e.data or {}, e.errors
+    else:
+        errors = []
+    return_([_split_result(index, query, data, errors)
+             for index, query in enumerate(queries)])
+
+
+def _split_result(index, query, data, errors):
+    # type: (int, Query, t.Dict[str, JSON], t.List[JSON]) -> object
+    prefix = _merged_prefix(index)
+    keys = {prefix + (field.alias or field.name): field.alias or field.name
+            for field in query.selections}
+    own_data = {key: data[alias] for alias, key in six.iteritems(keys)
+                if alias in data}
+    # errors without path concern the entire request
+    own_errors = [
+        _unprefixed_error(error, keys) for error in errors
+        if not error.get('path') or error['path'][0] in keys
+    ]
+    if len(own_data) < len(keys) and not own_errors:
+        # the data may be missing due to errors in other queries
+        own_errors = errors
+    if own_errors:
+        return ErrorResponse(data=own_data, errors=own_errors)
+    return _cached_loader(query.cls, query.selections)(own_data)
+
+
+def _unprefixed_error(error, keys):
+    # type: (t.Dict[str, JSON], t.Dict[str, str]) -> t.Dict[str, JSON]
+    if not error.get('path'):
+        return error
+    error = dict(error)
+    error['path'] = [keys[error['path'][0]]] + error['path'][1:]
+    return error
+
+
+def _request(url, payload):
+    # type: (str, JSON) -> snug.Request
+    return snug.Request(
         'POST',
         url,
-        content=json.dumps({'query': query_str}).encode('ascii'),
+        content=json.dumps(payload).encode('ascii'),
         headers={'Content-Type': 'application/json'}
     )
-    response = yield request
+
+
+def _parse(response, request):
+    # type: (snug.Response, snug.Request) -> JSON
     if response.status_code >= 400:
         raise HTTPError(response, request)
-    content = json.loads(response.content.decode('utf-8'))
+    return json.loads(response.content.decode('utf-8'))
+
+
+def _data(content):
+    # type: (t.Dict[str, JSON]) -> t.Dict[str, JSON]
     if 'errors' in content:
         content.setdefault('data', {})
         raise ErrorResponse(**content)
-    return_(content['data'])
+    return content['data']
 
 
-def execute(obj, url, **kwargs):
+@py2_compatible
+def middleware(url, operation):
+    # type: (str, t.Dict[str, JSON]) -> snug.Query[t.Dict[str, JSON]]
+    request = _request(url, operation)
+    return_(_data(_parse((yield request), request)))
+
+
+_HASHES = LRUCache(maxsize=1024)
+
+# errors indicating the full query text should be sent.
+# The latter occurs if the server does not support persisted queries.
+_PERSISTED_QUERY_ERRORS = {
+    'PersistedQueryNotFound',
+    'PersistedQueryNotSupported',
+    'PERSISTED_QUERY_NOT_FOUND',
+    'PERSISTED_QUERY_NOT_SUPPORTED',
+}
+
+
+def _sha256(query_str):
+    # type: (str) -> str
+    digest = _HASHES.get(query_str)
+    if digest is None:
+        digest = hashlib.sha256(query_str.encode('utf-8')).hexdigest()
+        _HASHES.put(query_str, digest)
+    return digest
+
+
+def _needs_query_text(content):
+    # type: (t.Dict[str, JSON]) -> bool
+    return any(
+        error.get('message') in _PERSISTED_QUERY_ERRORS
+        or (error.get('extensions') or {}).get('code')
+        in _PERSISTED_QUERY_ERRORS
+        for error in content.get('errors') or ()
+    )
+
+
+def _persisted(operation):
+    # type: (t.Dict[str, JSON]) -> t.Tuple[t.Dict[str, JSON], str]
+    # split an operation into its hashed version and the query text
+    operation = dict(operation)
+    query_str = operation.pop('query')
+    operation['extensions'] = {'persistedQuery': {
+        'version': 1,
+        'sha256Hash': _sha256(query_str),
+    }}
+    return operation, query_str
+
+
+@py2_compatible
+def persisted_middleware(url, operation):
+    # type: (str, t.Dict[str, JSON]) -> snug.Query[t.Dict[str, JSON]]
+    """Like :func:`middleware`, but only sends the hash of the query text,
+    according to the "automatic persisted queries" protocol.
+    Only if the server does not know the hash, the full text is sent."""
+    operation, query_str = _persisted(operation)
+    request = _request(url, operation)
+    content = _parse((yield request), request)
+    if _needs_query_text(content):
+        operation['query'] = query_str
+        request = _request(url, operation)
+        content = _parse((yield request), request)
+    return_(_data(content))
+
+
+def _middleware(persisted):
+    return persisted_middleware if persisted else middleware
+
+
+def _batch_contents(content):
+    # type: (JSON) -> t.List[t.Dict[str, JSON]]
+    # errors concerning the batch as a whole are returned as a single object
+    if not isinstance(content, list):
+        raise ErrorResponse(data=content.get('data') or {},
+                            errors=content.get('errors') or [])
+    return content
+
+
+@py2_compatible
+def batch_middleware(url, operations):
+    # type: (str, t.List[t.Dict[str, JSON]]) -> snug.Query[t.List[JSON]]
+    """Send several operations in one request, as a JSON array.
+    The response content of each operation is returned."""
+    request = _request(url, operations)
+    return_(_batch_contents(_parse((yield request), request)))
+
+
+@py2_compatible
+def persisted_batch_middleware(url, operations):
+    # type: (str, t.List[t.Dict[str, JSON]]) -> snug.Query[t.List[JSON]]
+    """Like :func:`batch_middleware`, but with "automatic persisted queries".
+    Only operations unknown to the server are sent again,
+    with their full query text."""
+    operations, query_strs = zip(*map(_persisted, operations))
+    request = _request(url, operations)
+    contents = _batch_contents(_parse((yield request), request))
+    unknown = [i for i, content in enumerate(contents)
+               if _needs_query_text(content)]
+    if unknown:
+        request = _request(url, [dict(operations[i], query=query_strs[i])
+                                 for i in unknown])
+        for i, content in zip(unknown, _batch_contents(
+                _parse((yield request), request))):
+            contents[i] = content
+    return_(contents)
+
+
+def _batch_middleware(persisted):
+    return persisted_batch_middleware if persisted else batch_middleware
+
+
+@py2_compatible
+def _exec_batch(executables, variables, chunk_size):
+    # type: (t.Sequence[Executable], t.Sequence[t.Mapping], int) -> t.Any
+    if not executables:
+        raise ValueError('no operations to execute')
+    if len(variables) > len(executables):
+        raise ValueError('more variable mappings than executables')
+    if chunk_size < 1:
+        raise ValueError('chunk size must be positive')
+    variables = list(variables) + [FrozenDict.EMPTY] * (
+        len(executables) - len(variables))
+    # each operation is handled by its own (single-request) generator,
+    # so that the results are loaded as with a regular execution.
+    # They are all started first, so no request is sent if one is invalid.
+    execs = list(map(_exec, executables, variables))
+    operations = [next(e) for e in execs]
+    results = []
+    for start in range(0, len(execs), chunk_size):
+        chunk = execs[start:start + chunk_size]
+        contents = yield operations[start:start + chunk_size]
+        if len(contents) != len(chunk):
+            raise ErrorResponse(data={}, errors=[{
+                'message': 'expected {} results in batch response, got {}'
+                .format(len(chunk), len(contents))}])
+        for exec_, content in zip(chunk, contents):
+            try:
+                data = _data(content)
+            except ErrorResponse as e:
+                results.append(e)
+            else:
+                results.append(sendreturn(exec_, data))
+    return_(results)
+
+
+def execute(obj, url, variables=FrozenDict.EMPTY, persisted=False,
+            **kwargs):
     """Execute a GraphQL executable
 
     Parameters
@@ -70,6 +313,12 @@ def execute(obj, url, **kwargs):
         This may be a raw string or a query
     url: str
         The URL of the target endpoint
+    variables: ~typing.Mapping[str, object]
+        Values of the variables used in the query
+    persisted: bool
+        Whether to use "automatic persisted queries":
+        send only a hash of the query, falling back to the full text
+        if the server doesn't know it yet.
     **kwargs
          ``auth`` and/or ``client``, passed to :func:`snug.query.execute`.
 
@@ -84,8 +333,105 @@ def execute(obj, url, **kwargs):
         If errors are present in the response
     HTTPError
         If the response has a non 2xx response code
+    ~quiz.types.ValidationError
+        If the variables are not valid for the query
     """
-    snug_query = irelay(_exec(obj), partial(middleware, url))
+    snug_query = irelay(_exec(obj, variables),
+                        partial(_middleware(persisted), url))
+    return snug.execute(snug_query, **kwargs)
+
+
+def execute_merged(queries, url, variables=(), persisted=False, **kwargs):
+    """Execute several queries in a single request,
+    by merging them with :func:`~quiz.build.merge_queries`.
+
+    Parameters
+    ----------
+    queries: ~typing.Sequence[~quiz.build.Query]
+        The queries to execute. They must all be on the same type.
+    url: str
+        The URL of the target endpoint
+    variables: ~typing.Sequence[~typing.Mapping[str, object]]
+        Values of the variables for each query, in the same order.
+        May be shorter than ``queries``
+        if the remaining queries have no variables.
+    persisted: bool
+        Whether to use "automatic persisted queries".
+        See :func:`execute`.
+    **kwargs
+         ``auth`` and/or ``client``, passed to :func:`snug.query.execute`.
+
+    Returns
+    -------
+    ~typing.List
+        The loaded result of each query, in order.
+        If a query failed, its result is an :class:`ErrorResponse`
+        containing only the errors and data of that query.
+
+    Raises
+    ------
+    HTTPError
+        If the response has a non 2xx response code
+    ~quiz.types.ValidationError
+        If the variables are not valid for the queries
+
+    Example
+    -------
+
+    >>> repo, user = execute_merged([
+    ...     schema.query[_.repository(owner='octocat', name='foo')[_.url]],
+    ...     schema.query[_.user(login='octocat')[_.name]],
+    ... ], url='https://api.github.com/graphql', auth=token_auth)
+    """
+    snug_query = irelay(_exec_merged(queries, variables),
+                        partial(_middleware(persisted), url))
+    return snug.execute(snug_query, **kwargs)
+
+
+def execute_batch(executables, url, variables=(), persisted=False,
+                  chunk_size=50, **kwargs):
+    """Execute several GraphQL executables in as few requests as possible,
+    by sending them as a JSON array. The server must support this.
+
+    Parameters
+    ----------
+    executables: ~typing.Sequence[Executable]
+        The objects to execute
+    url: str
+        The URL of the target endpoint
+    variables: ~typing.Sequence[~typing.Mapping[str, object]]
+        Values of the variables for each executable, in the same order.
+        May be shorter than ``executables``
+        if the remaining ones have no variables.
+    persisted: bool
+        Whether to use "automatic persisted queries".
+        See :func:`execute`.
+    chunk_size: int
+        The maximum number of operations per request.
+        Larger batches are sent in several requests.
+    **kwargs
+         ``auth`` and/or ``client``, passed to :func:`snug.query.execute`.
+
+    Returns
+    -------
+    ~typing.List
+        The result of each executable, in order.
+        If an operation failed, its result is an :class:`ErrorResponse`.
+
+    Raises
+    ------
+    ErrorResponse
+        If the server rejects the batch as a whole,
+        or does not return a result for each operation
+    HTTPError
+        If the response has a non 2xx response code
+    ~quiz.types.ValidationError
+        If the variables are not valid for the queries
+    ValueError
+        If there are no executables
+    """
+    snug_query = irelay(_exec_batch(executables, variables, chunk_size),
+                        partial(_batch_middleware(persisted), url))
     return snug.execute(snug_query, **kwargs)
 
 
@@ -96,7 +442,8 @@ def executor(**kwargs):
     Parameters
     ----------
     **kwargs
-       ``url``, ``auth``, and/or ``client``, passed to :func:`execute`
+       ``url``, ``auth``, ``client``, ``variables``, and/or ``persisted``,
+       passed to :func:`execute`
 
     Returns
     -------
@@ -119,7 +466,8 @@ def executor(**kwargs):
     return partial(execute, **kwargs)
 
 
-def execute_async(obj, url, **kwargs):
+def execute_async(obj, url, variables=FrozenDict.EMPTY, persisted=False,
+                  **kwargs):
     """Execute a GraphQL executable asynchronously
 
     Parameters
@@ -129,6 +477,11 @@ def execute_async(obj, url, **kwargs):
         This may be a raw string or a query
     url: str
         The URL of the target endpoint
+    variables: ~typing.Mapping[str, object]
+        Values of the variables used in the query
+    persisted: bool
+        Whether to use "automatic persisted queries".
+        See :func:`execute`.
     **kwargs
          ``auth`` and/or ``client``,
          passed to :func:`snug.query.execute_async`.
@@ -144,8 +497,91 @@ def execute_async(obj, url, **kwargs):
         If errors are present in the response
     HTTPError
         If the response has a non 2xx response code
+    ~quiz.types.ValidationError
+        If the variables are not valid for the query
+    """
+    snug_query = irelay(_exec(obj, variables),
+                        partial(_middleware(persisted), url))
+    return snug.execute_async(snug_query, **kwargs)
+
+
+def execute_merged_async(queries, url, variables=(), persisted=False,
+                         **kwargs):
+    """Execute several queries asynchronously, in a single request.
+    See :func:`execute_merged`.
+
+    Parameters
+    ----------
+    queries: ~typing.Sequence[~quiz.build.Query]
+        The queries to execute. They must all be on the same type.
+    url: str
+        The URL of the target endpoint
+    variables: ~typing.Sequence[~typing.Mapping[str, object]]
+        Values of the variables for each query, in the same order
+    persisted: bool
+        Whether to use "automatic persisted queries".
+        See :func:`execute`.
+    **kwargs
+         ``auth`` and/or ``client``,
+         passed to :func:`snug.query.execute_async`.
+
+    Returns
+    -------
+    ~typing.List
+        The loaded result of each query, in order.
+        If a query failed, its result is an :class:`ErrorResponse`.
+
+    Raises
+    ------
+    HTTPError
+        If the response has a non 2xx response code
+    ~quiz.types.ValidationError
+        If the variables are not valid for the queries
+    """
+    snug_query = irelay(_exec_merged(queries, variables),
+                        partial(_middleware(persisted), url))
+    return snug.execute_async(snug_query, **kwargs)
+
+
+def execute_batch_async(executables, url, variables=(), persisted=False,
+                        chunk_size=50, **kwargs):
+    """Execute several GraphQL executables asynchronously,
+    in as few requests as possible. See :func:`execute_batch`.
+
+    Parameters
+    ----------
+    executables: ~typing.Sequence[Executable]
+        The objects to execute
+    url: str
+        The URL of the target endpoint
+    variables: ~typing.Sequence[~typing.Mapping[str, object]]
+        Values of the variables for each executable, in the same order
+    persisted: bool
+        Whether to use "automatic persisted queries".
+        See :func:`execute`.
+    chunk_size: int
+        The maximum number of operations per request
+    **kwargs
+         ``auth`` and/or ``client``,
+         passed to :func:`snug.query.execute_async`.
+
+    Returns
+    -------
+    ~typing.List
+        The result of each executable, in order.
+        If an operation failed, its result is an :class:`ErrorResponse`.
+
+    Raises
+    ------
+    ErrorResponse
+        If the server rejects the batch as a whole
+    HTTPError
+        If the response has a non 2xx response code
+    ~quiz.types.ValidationError
+        If the variables are not valid for the queries
     """
-    snug_query = irelay(_exec(obj), partial(middleware, url))
+    snug_query = irelay(_exec_batch(executables, variables, chunk_size),
+                        partial(_batch_middleware(persisted), url))
     return snug.execute_async(snug_query, **kwargs)
 
 
@@ -156,7 +592,8 @@ def async_executor(**kwargs):
     Parameters
     ----------
     **kwargs
-       ``url``, ``auth``, and/or ``client``, passed to :func:`execute_async`
+       ``url``, ``auth``, ``client``, ``variables``, and/or ``persisted``,
+       passed to :func:`execute_async`
 
     Returns
     -------
@@ -1,24 +1,45 @@
 """Functionality relating to the raw GraphQL schema"""
 import enum
+import hashlib
+import importlib
+import io
 import json
+import keyword
+import marshal
+import os
+import re
 import sys
+import tempfile
+import threading
+import time
 import typing as t
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 from functools import partial
 from itertools import chain
 
 import six
+import snug
+from gentools import py2_compatible, return_
 
 from . import types
-from .build import Query
-from .compat import fspath, map
-from .execution import execute
-from .types import validate
-from .utils import JSON, FrozenDict, ValueObject, merge
+from .__about__ import __version__
+from .build import InlineFragment, Query, SelectionSet, interned
+from .compat import fspath, map, replace
+from .execution import _data, _parse, _request, execute
+from .types import validate, variable_defs
+from .utils import JSON, FrozenDict, LRUCache, ValueObject
 
 __all__ = [
     'Schema',
     'INTROSPECTION_QUERY',
+    'introspection_query',
+    'SnapshotError',
+    'schema_digest',
+    'SchemaCache',
+    'schema_diff',
+    'SchemaDiff',
+    'TypeDiff',
+    'prune_schema',
 ]
 
 RawSchema = t.Dict[str, JSON]
@@ -29,6 +50,13 @@ def _namedict(classes):
     return {c.__name__: c for c in classes}
 
 
+# Helpers creating classes from deserialized types (see ``_load_types``).
+# Schemas are created directly from the raw introspection result instead
+# (see ``_class_from_raw``). Of these helpers, only ``enum_as_type`` and
+# ``inputobject_as_type`` are still used (for snapshots).
+# The others are legacy: kept for backwards compatibility only.
+
+
 def object_as_type(typ, interfaces, module):
     # type: (Object, t.Mapping[str, types.Interface], str) -> type
     # we don't add the fields yet -- these types may not exist yet.
@@ -78,31 +106,6 @@ def inputobject_as_type(typ):
     return type(str(typ.name), (types.InputObject, ), {"__doc__": typ.desc})
 
 
-def _add_fields(obj, classes):
-    for f in obj.__raw__.fields:
-        setattr(
-            obj,
-            f.name,
-            types.FieldDefinition(
-                name=f.name,
-                desc=f.desc,
-                args=FrozenDict({
-                    i.name: types.InputValue(
-                        name=i.name,
-                        desc=i.desc,
-                        type=resolve_typeref(i.type, classes),
-                    )
-                    for i in f.args
-                }),
-                is_deprecated=f.is_deprecated,
-                deprecation_reason=f.deprecation_reason,
-                type=resolve_typeref(f.type, classes),
-            ),
-        )
-    del obj.__raw__
-    return obj
-
-
 def resolve_typeref(ref, classes):
     # type: (TypeRef, ClassDict) -> type
     if ref.kind is Kind.NON_NULL:
@@ -118,6 +121,259 @@ def _resolve_typeref_required(ref, classes):
     return classes[ref.name]
 
 
+def _resolve_raw_typeref(ref, classes):
+    # type: (t.Dict[str, JSON], ClassDict) -> type
+    # like resolve_typeref(), directly from the raw introspection result
+    if ref['kind'] == 'NON_NULL':
+        return _resolve_raw_required(ref['ofType'], classes)
+    return types.Nullable[_resolve_raw_required(ref, classes)]
+
+
+def _resolve_raw_required(ref, classes):
+    if ref['kind'] == 'LIST':
+        return types.List[_resolve_raw_typeref(ref['ofType'], classes)]
+    return classes[ref['name']]
+
+
+def _class_from_raw(conf, classes, module):
+    # type: (t.Dict[str, JSON], ClassDict, t.Optional[str]) -> type
+    # Create a class directly from the raw introspection result.
+    # Fields are added later with _add_raw_fields -- the classes they
+    # refer to may not exist yet.
+    kind, name = conf['kind'], str(conf['name'])
+    desc = conf.get('description')
+    if kind == 'OBJECT':
+        return type(
+            name,
+            tuple(classes[i['name']] for i in conf['interfaces'])
+            + (types.Object, ),
+            {'__doc__': desc, '__module__': module})
+    elif kind == 'INTERFACE':
+        return types.Interface(name, (types.Namespace, ),
+                               {'__doc__': desc, '__module__': module})
+    elif kind == 'SCALAR':
+        return type(name, (types.GenericScalar, ), {'__doc__': desc})
+    elif kind == 'ENUM':
+        values = conf['enumValues']
+        assert len(values) > 0
+        cls = types.Enum(name, [(v['name'], v['name']) for v in values],
+                         module=module)
+        cls.__doc__ = desc
+        for member, value in zip(cls.__members__.values(), values):
+            member.__doc__ = value.get('description')
+        return cls
+    elif kind == 'UNION':
+        members = conf['possibleTypes']
+        assert len(members) >= 1, 'Encountered a Union with zero types'
+        return type(name, (types.Union, ), {
+            '__doc__': desc,
+            '__args__': tuple(classes[o['name']] for o in members),
+        })
+    elif kind == 'INPUT_OBJECT':
+        return type(name, (types.InputObject, ), {'__doc__': desc})
+    else:
+        raise NotImplementedError(kind)
+
+
+def _add_raw_fields(cls, fields, classes):
+    # type: (type, t.List[t.Dict[str, JSON]], ClassDict) -> None
+    for field in _raw_field_definitions(fields, classes):
+        setattr(cls, field.name, field)
+
+
+def _raw_field_definitions(fields, classes):
+    # type: (t.List[t.Dict[str, JSON]], ClassDict)
+    # -> t.Iterator[types.FieldDefinition]
+    for f in fields:
+        yield types.FieldDefinition(
+            name=f['name'],
+            desc=f.get('description'),
+            args=FrozenDict({
+                i['name']: types.InputValue(
+                    name=i['name'],
+                    desc=i.get('description'),
+                    type=_resolve_raw_typeref(i['type'], classes),
+                )
+                for i in f['args']
+            }),
+            is_deprecated=f.get('isDeprecated', False),
+            deprecation_reason=f.get('deprecationReason'),
+            type=_resolve_raw_typeref(f['type'], classes),
+        )
+
+
+# classes may only refer to those of kinds earlier in this order
+_CREATION_ORDER = ['SCALAR', 'INTERFACE', 'ENUM', 'OBJECT', 'UNION',
+                   'INPUT_OBJECT']
+
+
+def _create_classes(raw_schema, module, scalars):
+    # type: (RawSchema, t.Optional[str], t.Iterable[type]) -> ClassDict
+    by_kind = defaultdict(list)
+    for conf in raw_schema['types']:
+        by_kind[conf['kind']].append(conf)
+
+    classes = _namedict(scalars)
+    classes.update(types.BUILTIN_SCALARS)
+    for kind in _CREATION_ORDER:
+        for conf in by_kind.pop(kind, ()):
+            if conf['name'] not in classes:
+                classes[conf['name']] = _class_from_raw(conf, classes, module)
+    for kind in by_kind:
+        raise NotImplementedError(kind)
+
+    # we can only add fields after all classes have been created.
+    with_fields = [(classes[conf['name']], conf['fields'])
+                   for conf in raw_schema['types']
+                   if conf['kind'] in ('OBJECT', 'INTERFACE')]
+    for cls, fields in with_fields:
+        _add_raw_fields(cls, fields, classes)
+    # prepare validation now that all fields are known
+    for cls, _ in with_fields:
+        types._field_table(cls)
+    return classes
+
+
+class _LazyClasses(t.Mapping[str, type]):
+    # The classes of a schema, created only when first needed.
+    # Fields are added when a class is retrieved from this mapping,
+    # or when needed for validation or loading (see ``HasFields``).
+
+    def __init__(self, raw_schema, module, scalars):
+        self._module = module
+        self._raw = {conf['name']: conf for conf in raw_schema['types']}
+        self._created = _namedict(scalars)
+        self._created.update(types.BUILTIN_SCALARS)
+        self._names = list(OrderedDict.fromkeys(
+            chain(self._created, self._raw)))
+        self._lock = threading.RLock()
+
+    def __getitem__(self, name):
+        cls = self._class(name)
+        if isinstance(cls, types.HasFields):
+            types._add_pending_fields(cls)
+        return cls
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def _class(self, name):
+        # type: (str) -> type
+        # retrieve or create a class, without adding its fields yet
+        try:
+            return self._created[name]
+        except KeyError:
+            pass
+        with self._lock:
+            # another thread may have created it in the meantime
+            cls = self._created.get(name) or self._create(
+                self._raw_type(name))
+            self._created[name] = cls
+            return cls
+
+    def _raw_type(self, name):
+        # type: (str) -> t.Dict[str, JSON]
+        return self._raw[name]
+
+    def _create(self, conf):
+        # type: (t.Dict[str, JSON]) -> type
+        cls = _class_from_raw(conf, _Shells(self), self._module)
+        if conf['kind'] in ('OBJECT', 'INTERFACE'):
+            type.__setattr__(cls, '__pending_fields__',
+                             partial(self._add_fields, fields=conf['fields']))
+        return cls
+
+    def _add_fields(self, cls, fields):
+        # type: (type, t.List[t.Dict[str, JSON]]) -> None
+        _add_raw_fields(cls, fields, _Shells(self))
+
+
+class _RemoteClasses(_LazyClasses):
+    # Lazily created classes, of which the raw types are only retrieved
+    # from the API once needed. Types needed at the same time
+    # (e.g. the types of an object's fields) are retrieved in batches.
+
+    def __init__(self, names, fetch, batch_size, module, scalars):
+        super(_RemoteClasses, self).__init__({'types': []}, module, scalars)
+        self._names = list(OrderedDict.fromkeys(chain(self._created, names)))
+        self._available = set(names)
+        self._fetch = fetch
+        self._batch_size = batch_size
+        self.retrieved = []  # type: t.List[t.Dict[str, JSON]]
+
+    def _raw_type(self, name):
+        self._retrieve([name])
+        return self._raw[name]
+
+    def _add_fields(self, cls, fields):
+        self._retrieve(_named_type(ref) for ref in chain.from_iterable(
+            chain([f['type']], (arg['type'] for arg in f['args']))
+            for f in fields
+        ))
+        super(_RemoteClasses, self)._add_fields(cls, fields)
+
+    def _missing(self, names):
+        # type: (t.Iterable[str]) -> t.List[str]
+        return sorted(
+            set(names).intersection(self._available)
+            .difference(self._raw, self._created))
+
+    def _retrieve(self, names):
+        # type: (t.Iterable[str]) -> None
+        # Retrieve raw types not yet known, including the types
+        # needed to create their classes: interfaces and union members.
+        with self._lock:
+            missing = self._missing(names)
+            while missing:
+                batch = list(chain.from_iterable(
+                    self._fetch(missing[i:i + self._batch_size])
+                    for i in range(0, len(missing), self._batch_size)
+                ))
+                self._raw.update((conf['name'], conf) for conf in batch)
+                self.retrieved.extend(batch)
+                missing = self._missing(
+                    ref['name'] for conf in batch
+                    for ref in chain(
+                        conf['interfaces'] or (),
+                        conf['possibleTypes'] if conf['kind'] == 'UNION'
+                        else ()))
+
+
+def _named_type(ref):
+    # type: (t.Dict[str, JSON]) -> str
+    # the name of the type a (possibly wrapped) type reference points to
+    while ref.get('ofType'):
+        ref = ref['ofType']
+    return ref['name']
+
+
+def _fetch_types(names, run, fragments):
+    # type: (t.List[str], t.Callable[[str], JSON], str) -> t.List[JSON]
+    # retrieve raw types by name, in a single query using aliases
+    selections = ''.join(
+        '  t{}: __type(name: {}) {{\n    ...FullType\n  }}\n'.format(
+            index, json.dumps(name))
+        for index, name in enumerate(names)
+    )
+    result = run('{\n' + selections + '}\n\n' + fragments)
+    return [result['t{}'.format(index)] for index in range(len(names))]
+
+
+class _Shells(object):
+    # lookup of lazily created classes, without adding their fields.
+    # Used to refer to other classes without creating these in turn.
+    __slots__ = '_classes'
+
+    def __init__(self, classes):
+        self._classes = classes
+
+    def __getitem__(self, name):
+        return self._classes._class(name)
+
+
 class _QueryCreator(object):
 
     def __init__(self, schema):
@@ -125,7 +381,33 @@ class _QueryCreator(object):
 
     def __getitem__(self, selection_set):
         cls = self.schema.query_type
-        return Query(cls, selections=validate(cls, selection_set))
+        return interned(Query(
+            cls, selections=validate(cls, selection_set),
+            variable_defs=variable_defs(cls, selection_set)))
+
+
+class _JSONText(object):
+    # A JSON document, only decoded when first needed
+
+    def __init__(self, text):
+        self.text = text
+        self._decoded = None
+
+    def decoded(self):
+        # type: () -> JSON
+        if self._decoded is None:
+            self._decoded = json.loads(self.text)
+        return self._decoded
+
+    def __eq__(self, other):
+        if isinstance(other, _JSONText):
+            other = other.decoded()
+        return self.decoded() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
 
 
 class Schema(ValueObject):
@@ -145,6 +427,13 @@ class Schema(ValueObject):
         ('raw', RawSchema, 'The raw schema (JSON). To be deprecated'),
     ]
 
+    @property
+    def raw(self):
+        """The raw schema (JSON). To be deprecated"""
+        # the raw schema of a generated module is decoded when first needed
+        raw = self._raw
+        return raw.decoded() if isinstance(raw, _JSONText) else raw
+
     def __getattr__(self, name):
         try:
             return self.classes[name]
@@ -195,7 +484,7 @@ class Schema(ValueObject):
         return _QueryCreator(self)
 
     @classmethod
-    def from_path(cls, path, module=None, scalars=()):
+    def from_path(cls, path, module=None, scalars=(), lazy=False):
         """Create a :class:`Schema` from a JSON at a path
 
         Parameters
@@ -208,6 +497,9 @@ class Schema(ValueObject):
             :class:`~quiz.types.Scalar` classes to use in the schema.
             Scalars in the schema, but not in this sequence, will be defined as
             :class:`~quiz.types.GenericScalar` subclasses.
+        lazy: bool
+            Whether to create classes only once they are used.
+            See :meth:`from_raw`.
 
         Returns
         -------
@@ -221,7 +513,7 @@ class Schema(ValueObject):
         """
         with open(fspath(path)) as rfile:
             return cls.from_raw(json.load(rfile), module=module,
-                                scalars=scalars)
+                                scalars=scalars, lazy=lazy)
 
     def to_path(self, path):
         """Dump the schema as JSON to a path
@@ -235,7 +527,7 @@ class Schema(ValueObject):
             json.dump(self.raw, wfile)
 
     @classmethod
-    def from_raw(cls, raw_schema, module=None, scalars=()):
+    def from_raw(cls, raw_schema, module=None, scalars=(), lazy=False):
         """Create a :class:`Schema` from a raw JSON schema
 
         Parameters
@@ -249,72 +541,82 @@ class Schema(ValueObject):
             :class:`~quiz.types.Scalar` classes to use in the schema.
             Scalars in the schema, but not in this sequence, will be defined as
             :class:`~quiz.types.GenericScalar` subclasses.
+        lazy: bool
+            Whether to create classes only once they are used,
+            instead of all at once.
 
         Returns
         -------
         Schema
             The schema constructed from raw data
         """
-        by_kind = defaultdict(list)
-        for tp in _load_types(raw_schema):
-            by_kind[tp.__class__].append(tp)
-
-        scalars_by_name = _namedict(scalars)
-        scalars_by_name.update(types.BUILTIN_SCALARS)
-        scalars_by_name.update(
-            (tp.name,
-             type(str(tp.name), (types.GenericScalar, ), {'__doc__': tp.desc}))
-            for tp in by_kind[Scalar]
-            if tp.name not in scalars_by_name
-        )
+        classes = (_LazyClasses(raw_schema, module=module, scalars=scalars)
+                   if lazy else
+                   _create_classes(raw_schema, module=module, scalars=scalars))
+        return _schema_from_classes(cls, classes, raw_schema, module)
+
+    def updated(self, raw_schema):
+        """Create a schema from a new raw schema,
+        creating classes only for changed types.
+
+        Changed types get new classes, as do the types referring to these
+        (i.e. by fields, interfaces, or union members), transitively.
+        The classes of other types are shared with this schema.
+        Cached validation results and loaders remain in use only
+        for these shared classes: i.e. for selection sets on parts
+        of the schema unaffected by the changes.
+        Note that the query type usually refers to the changed types.
+        Cached results for entire queries are then not reused.
+
+        This schema itself is not modified, and remains usable.
 
-        interfaces = _namedict(map(
-            partial(interface_as_type, module=module),
-            by_kind[Interface]
-        ))
-        enums = _namedict(map(
-            partial(enum_as_type, module=module),
-            by_kind[Enum]
-        ))
-        objs = _namedict(map(
-            partial(object_as_type, interfaces=interfaces,
-                    module=module),
-            by_kind[Object],
-        ))
-        unions = _namedict(map(
-            partial(union_as_type, objs=objs),
-            by_kind[Union]
-        ))
-        input_objects = _namedict(map(
-            inputobject_as_type,
-            by_kind[InputObject]
-        ))
+        Parameters
+        ----------
+        raw_schema: ~typing.Dict[str, JSON]
+            The new raw schema
 
-        classes = merge(
-            scalars_by_name, interfaces, enums, objs, unions, input_objects
-        )
+        Returns
+        -------
+        Schema
+            The updated schema. All its classes are created,
+            also if this schema is lazy.
+        """
+        classes = _updated_classes(self.classes, self.raw, raw_schema,
+                                   self.module)
+        return _schema_from_classes(type(self), classes, raw_schema,
+                                    self.module)
 
-        # we can only add fields after all classes have been created.
-        for obj in chain(objs.values(), interfaces.values()):
-            _add_fields(obj, classes)
-
-        return cls(
-            classes,
-            query_type=classes[raw_schema['queryType']['name']],
-            mutation_type=(
-                raw_schema['mutationType']
-                and classes[raw_schema['mutationType']['name']]
-                ),
-            subscription_type=(
-                raw_schema['subscriptionType']
-                and classes[raw_schema['subscriptionType']['name']]
-            ),
-            module=module,
-            raw=raw_schema,
-        )
+    def pruned(self, roots=(), queries=()):
+        """Create a schema with only the types and fields
+        reachable from the given types and queries.
+        See :func:`prune_schema`.
+
+        Parameters
+        ----------
+        roots: ~typing.Iterable[str or type]
+            Types (or their names) to keep entirely
+        queries: ~typing.Iterable[~quiz.build.Query]
+            Queries to keep the selected fields of
+
+        Returns
+        -------
+        Schema
+            The pruned schema. Its :attr:`raw` schema is pruned as well,
+            and may be stored with :meth:`to_path`.
+        """
+        raw_schema = prune_schema(self.raw, roots=roots, queries=queries)
+        scalars = [
+            self.classes[conf['name']] for conf in raw_schema['types']
+            if conf['kind'] == 'SCALAR'
+            and conf['name'] not in types.BUILTIN_SCALARS
+            and _is_predefined(self.classes[conf['name']])
+        ]
+        return type(self).from_raw(raw_schema, module=self.module,
+                                   scalars=scalars)
 
     @classmethod
-    def from_url(cls, url, scalars=(), module=None, **kwargs):
+    def from_url(cls, url, scalars=(), module=None, lazy=False,
+                 introspection=None, cache=None, **kwargs):
         """Build a GraphQL schema by introspecting an API
 
         Parameters
@@ -328,8 +630,17 @@ class Schema(ValueObject):
 
         module: ~typing.Optional[str], optional
             The module name to set on the generated classes
+        lazy: bool
+            Whether to create classes only once they are used.
+            See :meth:`from_raw`.
+        introspection: ~typing.Optional[str]
+            The query to retrieve the raw schema with.
+            Defaults to :data:`INTROSPECTION_QUERY`.
+            See :func:`introspection_query` for smaller alternatives.
+        cache: ~typing.Optional[SchemaCache]
+            A cache of introspection results to use
         **kwargs
-            ``auth`` or ``client``, passed to :func:`~quiz.execution.execute`.
+            ``auth`` or ``client``, passed to :func:`snug.query.execute`.
 
         Returns
         -------
@@ -340,11 +651,1038 @@ class Schema(ValueObject):
         ------
         ~quiz.types.ErrorResponse
             If there are errors in the response data
+        ~quiz.execution.HTTPError
+            If the response has a non 2xx response code
+        """
+        result = _introspect(cls, url, scalars, module, lazy, introspection,
+                             cache)
+        return (result if isinstance(result, Schema)
+                else snug.execute(result, **kwargs))
+
+    @classmethod
+    def from_url_async(cls, url, scalars=(), module=None, lazy=False,
+                       introspection=None, cache=None, **kwargs):
+        """Build a GraphQL schema by introspecting an API, asynchronously.
+
+        Parameters
+        ----------
+        url: str
+            URL of the target GraphQL API
+        scalars: ~typing.Iterable[~typing.Type[Scalar]]
+            :class:`~quiz.types.Scalar` classes to use in the schema.
+            See :meth:`from_url`.
+        module: ~typing.Optional[str], optional
+            The module name to set on the generated classes
+        lazy: bool
+            Whether to create classes only once they are used.
+            See :meth:`from_raw`.
+        introspection: ~typing.Optional[str]
+            The query to retrieve the raw schema with.
+            Defaults to :data:`INTROSPECTION_QUERY`.
+        cache: ~typing.Optional[SchemaCache]
+            A cache of introspection results to use
+        **kwargs
+            ``auth`` or ``client``,
+            passed to :func:`snug.query.execute_async`.
+
+        Returns
+        -------
+        ~typing.Awaitable[Schema]
+            The generated schema
+
+        Raises
+        ------
+        ~quiz.types.ErrorResponse
+            If there are errors in the response data
+        ~quiz.execution.HTTPError
+            If the response has a non 2xx response code
+        """
+        result = _introspect(cls, url, scalars, module, lazy, introspection,
+                             cache)
+        return (_Completed(result) if isinstance(result, Schema)
+                else snug.execute_async(result, **kwargs))
+
+    @classmethod
+    def from_url_on_demand(cls, url, scalars=(), module=None,
+                           descriptions=True, deprecated=True,
+                           default_values=True, batch_size=100, **kwargs):
+        """Build a GraphQL schema from an API,
+        retrieving types only once they are used.
+
+        Initially, only the names of the types are retrieved.
+        Types are retrieved with ``__type`` queries when first needed,
+        in batches when several are needed at once
+        (e.g. the types of an object's fields).
+        This is useful for short-lived scripts,
+        which use only a small part of a large schema.
+
+        Classes are created lazily, as with ``lazy=True``
+        (see :meth:`from_raw`).
+        The :attr:`raw` schema contains only the types retrieved so far.
+
+        Parameters
+        ----------
+        url: str
+            URL of the target GraphQL API
+        scalars: ~typing.Iterable[~typing.Type[Scalar]]
+            :class:`~quiz.types.Scalar` classes to use in the schema.
+            Scalars in the schema, but not in this sequence, will be defined as
+            :class:`~quiz.types.GenericScalar` subclasses.
+        module: ~typing.Optional[str], optional
+            The module name to set on the generated classes
+        descriptions: bool
+            Whether to retrieve descriptions.
+            See :func:`introspection_query`.
+        deprecated: bool
+            Whether to retrieve deprecated fields and enum values.
+            See :func:`introspection_query`.
+        default_values: bool
+            Whether to retrieve the default values of arguments.
+            See :func:`introspection_query`.
+        batch_size: int
+            The maximum number of types to retrieve in one query
+        **kwargs
+            ``auth`` or ``client``, passed to :func:`~quiz.execution.execute`.
+
+        Returns
+        -------
+        Schema
+            The schema
+
+        Raises
+        ------
+        ~quiz.types.ErrorResponse
+            If there are errors in the response data
+        """
+        run = partial(execute, url=url, **kwargs)
+        directory = run(_DIRECTORY_QUERY)['__schema']
+        classes = _RemoteClasses(
+            [conf['name'] for conf in directory['types']],
+            fetch=partial(_fetch_types, run=run, fragments=(
+                _introspection_fragments(descriptions, deprecated,
+                                         default_values))),
+            batch_size=batch_size,
+            module=module,
+            scalars=scalars,
+        )
+        roots = [directory['queryType'], directory['mutationType'],
+                 directory['subscriptionType']]
+        classes._retrieve(root['name'] for root in roots if root)
+        raw_schema = {
+            'queryType': directory['queryType'],
+            'mutationType': directory['mutationType'],
+            'subscriptionType': directory['subscriptionType'],
+            'types': classes.retrieved,
+        }
+        # fields of the root types are only retrieved once used
+        return _schema_from_classes(cls, classes, raw_schema, module,
+                                    roots=_Shells(classes))
+
+    def to_snapshot(self):
+        """Dump the schema to a compact binary snapshot.
+
+        Loading a snapshot with :meth:`from_snapshot` is faster
+        than creating a schema from raw JSON.
+        The raw schema is only decoded once needed.
+        Snapshots are only valid for the same versions of quiz and python.
+
+        Returns
+        -------
+        bytes
+            The snapshot, containing the :func:`schema_digest`
+            of the raw schema.
+        """
+        payload = marshal.dumps(_snapshot_payload(self.raw))
+        return _SNAPSHOT_MAGIC + marshal.dumps((
+            _snapshot_stamp(),
+            schema_digest(self.raw),
+            hashlib.sha256(payload).hexdigest(),
+            payload,
+        ))
+
+    @classmethod
+    def from_snapshot(cls, data, module=None, scalars=(), digest=None):
+        """Create a :class:`Schema` from a snapshot
+
+        Parameters
+        ----------
+        data: bytes
+            The snapshot, created with :meth:`to_snapshot`
+        module: ~typing.Optional[str], optional
+            The name of the module to use when creating classes
+        scalars: ~typing.Iterable[~typing.Type[Scalar]]
+            :class:`~quiz.types.Scalar` classes to use in the schema.
+            Scalars in the schema, but not in this sequence, will be defined as
+            :class:`~quiz.types.GenericScalar` subclasses.
+        digest: ~typing.Optional[str]
+            If given, the :func:`schema_digest` the snapshot must have.
+
+        Returns
+        -------
+        Schema
+            The schema constructed from the snapshot
+
+        Raises
+        ------
+        SnapshotError
+            If the snapshot is invalid, corrupted, created by another
+            version of quiz or python, or doesn't have the given digest.
+        """
+        if not data.startswith(_SNAPSHOT_MAGIC):
+            raise SnapshotError('not a schema snapshot')
+        try:
+            stamp, stored_digest, checksum, payload = marshal.loads(
+                data[len(_SNAPSHOT_MAGIC):])
+        except (ValueError, EOFError, TypeError):
+            raise SnapshotError('corrupted snapshot')
+        if stamp != _snapshot_stamp():
+            raise SnapshotError('snapshot of another version: {}'.format(
+                stamp))
+        if hashlib.sha256(payload).hexdigest() != checksum:
+            raise SnapshotError('corrupted snapshot')
+        if digest is not None and digest != stored_digest:
+            raise SnapshotError('snapshot of another schema')
+        return _schema_from_snapshot(cls, marshal.loads(payload),
+                                     module=module, scalars=scalars)
+
+    def to_module(self, path):
+        """Write the schema as a python module to a path.
+
+        The module defines all the schema's classes,
+        which can then be loaded again with :meth:`from_module`.
+        Once python has compiled and cached the module,
+        this is much faster than creating the schema from raw JSON.
+
+        Parameters
+        ----------
+        path: str or ~os.PathLike
+            The path of the ``.py`` file to write
+
+        Note
+        ----
+        Custom scalars must be importable from their module.
         """
-        result = execute(INTROSPECTION_QUERY, url=url, **kwargs)
-        return cls.from_raw(result['__schema'], scalars=scalars, module=module)
+        with io.open(fspath(path), 'w', encoding='utf-8') as wfile:
+            wfile.write(six.text_type(_module_source(self)))
+
+    @classmethod
+    def from_module(cls, name):
+        """Load a :class:`Schema` from a module
+        written with :meth:`to_module`
+
+        Parameters
+        ----------
+        name: str
+            The name of the module
+
+        Returns
+        -------
+        Schema
+            The schema, with the classes defined in the module
+
+        Raises
+        ------
+        ImportError
+            If the module cannot be imported
+        """
+        module = importlib.import_module(name)
+        return cls(module=name, raw=_JSONText(module.__raw__),
+                   **module.__schema__)
+
+
+class SnapshotError(Exception):
+    """Indicates a schema snapshot cannot be loaded"""
+
+
+def schema_digest(raw_schema):
+    # type: (RawSchema) -> str
+    """A digest of a raw schema, identifying its contents
+
+    Parameters
+    ----------
+    raw_schema: ~typing.Dict[str, JSON]
+        The raw GraphQL schema
+
+    Returns
+    -------
+    str
+        The SHA-256 hex digest of the schema in canonical JSON form
+    """
+    return hashlib.sha256(json.dumps(
+        raw_schema, sort_keys=True, separators=(',', ':')
+    ).encode('utf-8')).hexdigest()
+
+
+class TypeDiff(ValueObject):
+    """Changes to a type between two raw schemas.
+    Its members are its fields, input fields, or enum values."""
+    __fields__ = [
+        ('added', t.FrozenSet[str], 'Names of added members'),
+        ('removed', t.FrozenSet[str], 'Names of removed members'),
+        ('changed', t.FrozenSet[str], 'Names of changed members'),
+        ('properties', t.FrozenSet[str],
+         'Other changed properties, e.g. ``description`` or ``interfaces``'),
+    ]
+
+
+class SchemaDiff(ValueObject):
+    """Changes between two raw schemas. See :func:`schema_diff`."""
+    __fields__ = [
+        ('added', t.FrozenSet[str], 'Names of added types'),
+        ('removed', t.FrozenSet[str], 'Names of removed types'),
+        ('changed', t.Mapping[str, TypeDiff],
+         'Changes to types in both schemas, by name'),
+    ]
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    __nonzero__ = __bool__
+
+
+_MEMBER_KEYS = ('fields', 'inputFields', 'enumValues')
+
+
+def _members(conf):
+    # type: (t.Dict[str, JSON]) -> t.Dict[str, t.Dict[str, JSON]]
+    return {member['name']: member
+            for key in _MEMBER_KEYS for member in conf.get(key) or ()}
+
+
+def _type_diff(old, new):
+    # type: (t.Dict[str, JSON], t.Dict[str, JSON]) -> TypeDiff
+    old_members, new_members = _members(old), _members(new)
+    return TypeDiff(
+        added=frozenset(new_members).difference(old_members),
+        removed=frozenset(old_members).difference(new_members),
+        changed=frozenset(
+            name for name, member in new_members.items()
+            if name in old_members and old_members[name] != member),
+        properties=frozenset(
+            key for key in set(old).union(new)
+            if key not in _MEMBER_KEYS and old.get(key) != new.get(key)),
+    )
+
+
+def schema_diff(old, new):
+    # type: (RawSchema, RawSchema) -> SchemaDiff
+    """Compare two raw schemas
+
+    Parameters
+    ----------
+    old: ~typing.Dict[str, JSON]
+        The original raw schema
+    new: ~typing.Dict[str, JSON]
+        The new raw schema
+
+    Returns
+    -------
+    SchemaDiff
+        The added, removed, and changed types
+    """
+    old_types = {conf['name']: conf for conf in old['types']}
+    new_types = {conf['name']: conf for conf in new['types']}
+    return SchemaDiff(
+        added=frozenset(new_types).difference(old_types),
+        removed=frozenset(old_types).difference(new_types),
+        changed=FrozenDict(
+            (name, _type_diff(conf, new_types[name]))
+            for name, conf in old_types.items()
+            if name in new_types and conf != new_types[name]
+        ),
+    )
+
+
+def _is_predefined(cls):
+    # type: (type) -> bool
+    # builtin scalars and scalars given by the user are not generated
+    return issubclass(cls, tuple(types.BUILTIN_SCALARS.values())) or (
+        issubclass(cls, types.Scalar)
+        and not issubclass(cls, types.GenericScalar))
+
+
+def _refers_to(conf, names):
+    # type: (t.Dict[str, JSON], t.AbstractSet[str]) -> bool
+    # whether the class of a type refers to any of the given types,
+    # by its fields, interfaces, or union members.
+    # (classes of input objects do not refer to other types)
+    return conf['kind'] != 'INPUT_OBJECT' and not names.isdisjoint(
+        _references(conf))
+
+
+def _updated_classes(classes, old_raw, new_raw, module):
+    # type: (ClassDict, RawSchema, RawSchema, str) -> ClassDict
+    # Create the classes of a new raw schema, reusing the classes of
+    # unchanged types. Changed types get new classes, as do the types
+    # referring to these. The given classes are not modified.
+    diff = schema_diff(old_raw, new_raw)
+    new_types = OrderedDict((conf['name'], conf) for conf in new_raw['types'])
+    predefined = {name for name, cls in classes.items()
+                  if _is_predefined(cls)}
+    created = (diff.added | set(diff.changed)) - predefined
+    referring = created
+    while referring:
+        referring = {
+            name for name, conf in new_types.items()
+            if name not in created and _refers_to(conf, referring)
+        } - predefined
+        created |= referring
+
+    new_classes = _LazyClasses({'types': [new_types[name]
+                                          for name in created]},
+                               module=module, scalars=())
+    new_classes._created.update(
+        (name, cls) for name, cls in classes.items()
+        if name not in created
+        and (name in predefined or name not in diff.removed))
+    return OrderedDict(
+        (name, new_classes[name]) for name in
+        OrderedDict.fromkeys(chain(new_classes._created, new_types)))
+
+
+def _references(conf):
+    # type: (t.Dict[str, JSON]) -> t.Iterator[str]
+    # names of the types needed for a type with all its members
+    for member in chain(conf.get('fields') or (),
+                        conf.get('inputFields') or ()):
+        yield _named_type(member['type'])
+        for arg in member.get('args', ()):
+            yield _named_type(arg['type'])
+    for ref in chain(conf['interfaces'] or (),
+                     conf['possibleTypes'] if conf['kind'] == 'UNION'
+                     else ()):
+        yield ref['name']
+
+
+class _Reachable(object):
+    # The types and fields reachable in a raw schema, collected
+    # from root types and queries.
+    # ``kept`` maps names of reachable types to the names of their fields
+    # to keep, or ``None`` to keep all members.
+
+    def __init__(self, raw_schema):
+        self._types = {conf['name']: conf for conf in raw_schema['types']}
+        self._complete = set()  # type: t.Set[str]
+        self._walked = set()  # type: t.Set[t.Tuple[str, SelectionSet]]
+        self.kept = {}  # type: t.Dict[str, t.Optional[t.Set[str]]]
+
+    def add_type(self, name):
+        # type: (str) -> None
+        # keep a type with all its members, and the types they refer to
+        pending = [name]
+        while pending:
+            name = pending.pop()
+            if name not in self._complete:
+                self._complete.add(name)
+                self.kept[name] = None
+                pending.extend(_references(self._types[name]))
+
+    def add_shell(self, name):
+        # type: (str) -> None
+        # keep a type, but none of its fields (yet).
+        # Only the types needed to create its class are kept as well.
+        if name in self.kept:
+            return
+        conf = self._types[name]
+        if conf['kind'] in ('OBJECT', 'INTERFACE'):
+            self.kept[name] = set()
+            for ref in conf['interfaces'] or ():
+                self.add_shell(ref['name'])
+        elif conf['kind'] == 'UNION':
+            self.kept[name] = None
+            for ref in conf['possibleTypes']:
+                self.add_shell(ref['name'])
+        else:
+            self.add_type(name)
+
+    def add_selections(self, name, selection_set):
+        # type: (str, SelectionSet) -> None
+        # keep the fields selected on a (kept) type,
+        # and the types needed for their arguments and results
+        if (name, selection_set) in self._walked:
+            return
+        self._walked.add((name, selection_set))
+        fields = {f['name']: f for f in self._types[name]['fields'] or ()}
+        for selection in types._fields(selection_set):
+            if isinstance(selection, InlineFragment):
+                target = selection.on.__name__
+            else:
+                field = fields[selection.name]
+                if self.kept[name] is not None:
+                    self.kept[name].add(selection.name)
+                for arg in field['args']:
+                    self.add_type(_named_type(arg['type']))
+                target = _named_type(field['type'])
+            self.add_shell(target)
+            self.add_selections(target, selection.selection_set)
+
+
+def _pruned_type(conf, fields, kept):
+    # type: (t.Dict[str, JSON], t.Optional[t.Set[str]], t.Container[str])
+    # -> t.Dict[str, JSON]
+    pruned = dict(conf)
+    if fields is not None:
+        pruned['fields'] = [f for f in conf['fields'] if f['name'] in fields]
+    if conf['kind'] == 'INTERFACE' and conf.get('possibleTypes'):
+        pruned['possibleTypes'] = [ref for ref in conf['possibleTypes']
+                                   if ref['name'] in kept]
+    return pruned
+
+
+def prune_schema(raw_schema, roots=(), queries=()):
+    # type: (RawSchema, t.Iterable[t.Union[str, type]], t.Iterable[Query])
+    # -> RawSchema
+    """Prune a raw schema to the types and fields reachable
+    from the given types and queries
+
+    Parameters
+    ----------
+    raw_schema: ~typing.Dict[str, JSON]
+        The raw schema
+    roots: ~typing.Iterable[str or type]
+        Types (or their names) to keep entirely,
+        including all types reachable from their fields
+    queries: ~typing.Iterable[~quiz.build.Query]
+        Queries (e.g. a manifest of all queries of an application)
+        to keep the selected fields of
+
+    Returns
+    -------
+    ~typing.Dict[str, JSON]
+        The pruned raw schema.
+        Of the types only reachable through ``queries``,
+        only the selected fields are kept.
+        The query type is always kept, possibly without fields.
+    """
+    reachable = _Reachable(raw_schema)
+    reachable.add_shell(raw_schema['queryType']['name'])
+    for directive in raw_schema.get('directives') or ():
+        for arg in directive['args']:
+            reachable.add_type(_named_type(arg['type']))
+    for root in roots:
+        reachable.add_type(root if isinstance(root, six.string_types)
+                           else root.__name__)
+    for query in queries:
+        reachable.add_shell(query.cls.__name__)
+        reachable.add_selections(query.cls.__name__, query.selections)
+
+    kept = reachable.kept
+    pruned = dict(raw_schema, types=[
+        _pruned_type(conf, kept[conf['name']], kept)
+        for conf in raw_schema['types'] if conf['name'] in kept
+    ])
+    for key in ('mutationType', 'subscriptionType'):
+        if raw_schema[key] and raw_schema[key]['name'] not in kept:
+            pruned[key] = None
+    return pruned
+
+
+def _introspection_request(url, query_str, etag=None):
+    # type: (str, str, t.Optional[str]) -> snug.Request
+    request = _request(url, {'query': query_str})
+    return request.with_headers({'If-None-Match': etag}) if etag else request
+
+
+def _introspect(cls, url, scalars, module, lazy, introspection, cache):
+    # type: (...) -> t.Union[Schema, snug.Query[Schema]]
+    # a cached schema, or a query to retrieve it
+    query_str = introspection or INTROSPECTION_QUERY
+    scalars = tuple(scalars)
+
+    def build(raw_schema, previous=None):
+        # type: (RawSchema, t.Optional[Schema]) -> Schema
+        # lazy schemas are created anew, this is faster than updating
+        return (cls.from_raw(raw_schema, module=module, scalars=scalars,
+                             lazy=lazy)
+                if previous is None or lazy
+                else previous.updated(raw_schema))
+
+    if cache is None:
+        return _introspect_uncached(url, query_str, build)
+    return cache._introspect(url, query_str, build,
+                             options=(cls, module, scalars, lazy))
+
+
+@py2_compatible
+def _introspect_uncached(url, query_str, build):
+    # type: (str, str, t.Callable) -> snug.Query[Schema]
+    request = _introspection_request(url, query_str)
+    return_(build(_data(_parse((yield request), request))['__schema']))
+
+
+class _CacheEntry(ValueObject):
+    __fields__ = [
+        ('etag', t.Optional[str], 'The ETag of the response, if any'),
+        ('digest', str, 'The schema digest of the raw schema'),
+        ('checked', float, 'When the raw schema was last known to be valid'),
+        ('raw', RawSchema, 'The raw schema'),
+    ]
+
+
+class SchemaCache(object):
+    """A cache of introspection results, stored on disk and keyed by URL.
+    Several processes may share the same directory.
+
+    A stored result is used without contacting the API
+    for ``ttl`` seconds after it was retrieved or last revalidated.
+    After that, the API is queried again.
+    The stored ``ETag`` is sent along (as ``If-None-Match``),
+    so the server may reply that the schema is not modified.
+    Otherwise, the new result is compared with the stored result by
+    its :func:`schema_digest`.
+
+    Classes are only created again if the schema actually changed:
+    as long as the result is unchanged, loading it
+    (with the same options) returns the same :class:`Schema`.
+
+    Parameters
+    ----------
+    directory: str or ~os.PathLike
+        The directory to store results in. Created if it does not exist.
+    ttl: float
+        The number of seconds a result is used without revalidating it
+
+    Example
+    -------
+
+    >>> cache = SchemaCache('/path/to/cache/dir', ttl=600)
+    >>> schema = Schema.from_url('https://api.github.com/graphql',
+    ...                          cache=cache, auth=auth)
+    """
+    def __init__(self, directory, ttl=300):
+        self.directory = fspath(directory)
+        self.ttl = ttl
+        self._entries = {}  # type: t.Dict[str, _CacheEntry]
+        self._schemas = LRUCache(maxsize=16)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def _path(self, name):
+        # type: (str) -> str
+        return os.path.join(self.directory, name + '.json')
+
+    def _is_fresh(self, entry):
+        # type: (_CacheEntry) -> bool
+        return time.time() - entry.checked < self.ttl
+
+    def _lookup(self, key):
+        # type: (str) -> t.Optional[_CacheEntry]
+        entry = self._entries.get(key)
+        if entry is None or not self._is_fresh(entry):
+            # another process may have stored a newer result
+            entry = self._read(key, entry) or entry
+            self._entries[key] = entry
+        return entry
+
+    def _read(self, key, current):
+        # type: (str, t.Optional[_CacheEntry]) -> t.Optional[_CacheEntry]
+        # A stored result consists of a small file with metadata,
+        # and the raw schema, stored by its digest.
+        # The raw schema is only read if it is not already known.
+        try:
+            with open(self._path(key)) as rfile:
+                meta = json.load(rfile)
+            if current is not None and current.digest == meta['digest']:
+                return current.replace(**meta)
+            with open(self._path('schema-' + meta['digest'])) as rfile:
+                return _CacheEntry(raw=json.load(rfile), **meta)
+        except (EnvironmentError, ValueError, TypeError, KeyError):
+            return None
+
+    def _store(self, key, entry, previous):
+        # type: (str, _CacheEntry, t.Optional[_CacheEntry]) -> None
+        self._entries[key] = entry
+        if previous is None or previous.digest != entry.digest:
+            self._write('schema-' + entry.digest, entry.raw)
+        self._write(key, {'etag': entry.etag, 'digest': entry.digest,
+                          'checked': entry.checked})
+        if previous is not None and previous.digest != entry.digest:
+            try:
+                os.remove(self._path('schema-' + previous.digest))
+            except EnvironmentError:
+                pass  # already removed, e.g. by another process
+
+    def _write(self, name, content):
+        # type: (str, JSON) -> None
+        # write to a temporary file first, so readers never
+        # see a partially written file.
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        # json.dumps is much faster than json.dump, which has no C version
+        with os.fdopen(fd, 'w') as wfile:
+            wfile.write(json.dumps(content))
+        replace(tmp_path, self._path(name))
+
+    def _updated(self, entry, response, request):
+        # type: (...) -> _CacheEntry
+        now = time.time()
+        if entry is not None and response.status_code == 304:
+            return entry.replace(checked=now)
+        raw = _data(_parse(response, request))['__schema']
+        digest = schema_digest(raw)
+        etag = response.headers.get('ETag')
+        if entry is not None and entry.digest == digest:
+            return entry.replace(checked=now, etag=etag)
+        return _CacheEntry(etag=etag, digest=digest, checked=now, raw=raw)
+
+    def _schema(self, key, entry, build, options):
+        # type: (str, _CacheEntry, t.Callable, tuple) -> Schema
+        # The schema of a result. Once the result changes,
+        # the previous schema is passed to ``build`` to be updated.
+        digest, schema = self._schemas.get((key, ) + options, (None, None))
+        if digest != entry.digest:
+            schema = build(entry.raw, schema)
+            self._schemas.put((key, ) + options, (entry.digest, schema))
+        return schema
+
+    def _introspect(self, url, query_str, build, options):
+        # type: (...) -> t.Union[Schema, snug.Query[Schema]]
+        # a fresh schema from the cache, or a query to revalidate it
+        key = hashlib.sha256(
+            json.dumps([url, query_str]).encode('utf-8')).hexdigest()
+        entry = self._lookup(key)
+        if entry is not None and self._is_fresh(entry):
+            return self._schema(key, entry, build, options)
+        return self._revalidate(key, entry, url, query_str, build, options)
+
+    @py2_compatible
+    def _revalidate(self, key, entry, url, query_str, build, options):
+        # type: (...) -> snug.Query[Schema]
+        request = _introspection_request(url, query_str,
+                                         entry and entry.etag)
+        updated = self._updated(entry, (yield request), request)
+        self._store(key, updated, previous=entry)
+        return_(self._schema(key, updated, build, options))
+
+
+class _Completed(object):
+    # An awaitable with a known result, used to return
+    # cached results from async functions without any I/O.
+    # Awaiting it immediately stops with the result.
+    __slots__ = '_result'
+
+    def __init__(self, result):
+        self._result = result
+
+    def __await__(self):
+        return self
+
+    __iter__ = __await__
+
+    def __next__(self):
+        raise StopIteration(self._result)
+
+    next = __next__
+
+
+_SNAPSHOT_MAGIC = b'quiz-schema-snapshot\n'
+# increase when changing the snapshot payload
+_SNAPSHOT_FORMAT = 2
+
+
+def _snapshot_stamp():
+    # marshal output is only guaranteed to be readable
+    # by the same python version
+    return (_SNAPSHOT_FORMAT, __version__, tuple(sys.version_info[:2]))
+
+
+# In the snapshot, type references are indices into a table.
+# Each distinct type (e.g. ``[String]!``) thus only needs to be
+# resolved once. Its entries are:
+#   ('T', name)   a named type
+#   ('L', index)  a list of the type at another index
+#   ('N', index)  a nullable type at another index
+# Entries only refer to earlier entries.
+def _ref_index(entry, table):
+    return table.setdefault(entry, len(table))
+
+
+def _encode_typeref(ref, table):
+    # type: (TypeRef, t.Dict[tuple, int]) -> int
+    if ref.kind is Kind.NON_NULL:
+        return _encode_required(ref.of_type, table)
+    return _ref_index(('N', _encode_required(ref, table)), table)
+
+
+def _encode_required(ref, table):
+    # type: (TypeRef, t.Dict[tuple, int]) -> int
+    if ref.kind is Kind.LIST:
+        return _ref_index(('L', _encode_typeref(ref.of_type, table)), table)
+    return _ref_index(('T', ref.name), table)
 
-    # TODO: from_url_async
+
+def _encode_fields(fields, table):
+    return [
+        (f.name, f.desc, _encode_typeref(f.type, table), f.is_deprecated,
+         f.deprecation_reason,
+         [(i.name, i.desc, _encode_typeref(i.type, table)) for i in f.args])
+        for f in fields
+    ]
+
+
+def _snapshot_payload(raw_schema):
+    # type: (RawSchema) -> tuple
+    by_kind = defaultdict(list)
+    for tp in _load_types(raw_schema):
+        by_kind[tp.__class__].append(tp)
+    table = OrderedDict()
+    return (
+        [(tp.name, tp.desc) for tp in by_kind[Scalar]],
+        [(tp.name, tp.desc, _encode_fields(tp.fields, table))
+         for tp in by_kind[Interface]],
+        [(tp.name, tp.desc, [(v.name, v.desc) for v in tp.values])
+         for tp in by_kind[Enum]],
+        [(tp.name, tp.desc, [i.name for i in tp.interfaces],
+          _encode_fields(tp.fields, table))
+         for tp in by_kind[Object]],
+        [(tp.name, tp.desc, [o.name for o in tp.types])
+         for tp in by_kind[Union]],
+        [(tp.name, tp.desc) for tp in by_kind[InputObject]],
+        list(table),
+        tuple(raw_schema[key] and raw_schema[key]['name'] for key in (
+            'queryType', 'mutationType', 'subscriptionType')),
+        # the raw schema is only decoded when needed (see ``_JSONText``)
+        json.dumps(raw_schema, separators=(',', ':')),
+    )
+
+
+def _add_snapshot_fields(obj, fields, refs):
+    # The class is new: it has no field table (or cached validation
+    # results) to invalidate yet. Thus, HasFields.__setattr__ is bypassed.
+    for name, desc, type_, is_deprecated, reason, args in fields:
+        type.__setattr__(obj, name, types.FieldDefinition(
+            name=name,
+            desc=desc,
+            args=FrozenDict({
+                arg_name: types.InputValue(
+                    name=arg_name, desc=arg_desc, type=refs[arg_type])
+                for arg_name, arg_desc, arg_type in args
+            }),
+            is_deprecated=is_deprecated,
+            deprecation_reason=reason,
+            type=refs[type_],
+        ))
+
+
+def _schema_from_snapshot(cls, payload, module, scalars):
+    (scalar_types, interface_types, enum_types, object_types, union_types,
+     input_types, ref_table, roots, raw_text) = payload
+
+    classes = _namedict(scalars)
+    classes.update(types.BUILTIN_SCALARS)
+    classes.update(
+        (name, type(str(name), (types.GenericScalar, ), {'__doc__': desc}))
+        for name, desc in scalar_types
+        if name not in classes
+    )
+    interfaces = {
+        name: types.Interface(str(name), (types.Namespace, ),
+                              {'__doc__': desc, '__module__': module})
+        for name, desc, _ in interface_types
+    }
+    classes.update(interfaces)
+    classes.update(
+        (name, enum_as_type(Enum(name, desc, [
+            EnumValue(value, value_desc, False, None)
+            for value, value_desc in values
+        ]), module=module))
+        for name, desc, values in enum_types
+    )
+    objs = {
+        name: type(str(name),
+                   tuple(interfaces[i] for i in bases) + (types.Object, ),
+                   {'__doc__': desc, '__module__': module})
+        for name, desc, bases, _ in object_types
+    }
+    classes.update(objs)
+    classes.update(
+        (name, type(str(name), (types.Union, ), {
+            '__doc__': desc, '__args__': tuple(objs[o] for o in members)}))
+        for name, desc, members in union_types
+    )
+    classes.update(
+        (name, inputobject_as_type(InputObject(name, desc, None)))
+        for name, desc in input_types
+    )
+
+    refs = []
+    for kind, arg in ref_table:
+        refs.append(
+            classes[arg] if kind == 'T'
+            else types.List[refs[arg]] if kind == 'L'
+            else types.Nullable[refs[arg]]
+        )
+
+    for name, _, fields in interface_types:
+        _add_snapshot_fields(interfaces[name], fields, refs)
+    for name, _, _, fields in object_types:
+        _add_snapshot_fields(objs[name], fields, refs)
+
+    query, mutation, subscription = roots
+    return cls(
+        classes,
+        query_type=classes[query],
+        mutation_type=mutation and classes[mutation],
+        subscription_type=subscription and classes[subscription],
+        module=module,
+        raw=_JSONText(raw_text),
+    )
+
+
+def _schema_from_classes(cls, classes, raw_schema, module, roots=None):
+    # type: (...) -> Schema
+    # roots: the lookup of the root types. Defaults to ``classes``.
+    roots = classes if roots is None else roots
+    return cls(
+        classes,
+        query_type=roots[raw_schema['queryType']['name']],
+        mutation_type=(
+            raw_schema['mutationType']
+            and roots[raw_schema['mutationType']['name']]
+        ),
+        subscription_type=(
+            raw_schema['subscriptionType']
+            and roots[raw_schema['subscriptionType']['name']]
+        ),
+        module=module,
+        raw=raw_schema,
+    )
+
+
+_MODULE_HEADER = """\
+# -*- coding: utf-8 -*-
+\"\"\"GraphQL schema classes, generated by quiz {}.
+
+Load with ``quiz.Schema.from_module(__name__)``. Do not edit.
+\"\"\"
+import six as _six
+
+import quiz as _quiz
+from quiz.types import FieldDefinition as _Field
+from quiz.types import InputValue as _InputValue
+from quiz.types import List as _List
+from quiz.types import Nullable as _Nullable
+from quiz.utils import FrozenDict as _FrozenDict
+"""
+
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+# keywords of python 2 and 3
+_KEYWORDS = frozenset(keyword.kwlist) | {
+    'async', 'await', 'exec', 'False', 'nonlocal', 'None', 'print', 'True'}
+
+
+def _type_source(type_, names):
+    # type: (type, t.Dict[type, str]) -> str
+    if issubclass(type_, types.Nullable):
+        return '_Nullable[{}]'.format(_type_source(type_.__arg__, names))
+    elif issubclass(type_, types.List):
+        return '_List[{}]'.format(_type_source(type_.__arg__, names))
+    return names[type_]
+
+
+def _field_source(cls_name, field, names):
+    # type: (str, types.FieldDefinition, t.Dict[type, str]) -> str
+    definition = '\n'.join([
+        '_Field(',
+        '    name={!r},'.format(field.name),
+        '    desc={!r},'.format(field.desc),
+        '    type={},'.format(_type_source(field.type, names)),
+        '    args=_FrozenDict({',
+    ] + [
+        '        {!r}: _InputValue(name={!r}, desc={!r}, type={}),'.format(
+            arg.name, arg.name, arg.desc, _type_source(arg.type, names))
+        for arg in field.args.values()
+    ] + [
+        '    }),',
+        '    is_deprecated={!r},'.format(field.is_deprecated),
+        '    deprecation_reason={!r},'.format(field.deprecation_reason),
+        ')',
+    ])
+    if _IDENTIFIER.match(field.name) and field.name not in _KEYWORDS:
+        return '{}.{} = {}\n'.format(cls_name, field.name, definition)
+    return 'setattr({}, {!r}, {})\n'.format(
+        cls_name, field.name, definition)
+
+
+def _class_source(name, cls, names):
+    # type: (str, type, t.Dict[type, str]) -> str
+    if issubclass(cls, types.Object):
+        bases = [names[b] for b in cls.__bases__ if b is not types.Object]
+        return 'class {}({}):\n    __doc__ = {!r}\n'.format(
+            name, ', '.join(bases + ['_quiz.Object']), cls.__doc__)
+    elif isinstance(cls, types.Interface):
+        return ('@_six.add_metaclass(_quiz.Interface)\n'
+                'class {}(_quiz.types.Namespace):\n'
+                '    __doc__ = {!r}\n').format(name, cls.__doc__)
+    elif issubclass(cls, types.Enum):
+        return ''.join(
+            ['{} = _quiz.Enum({!r}, [\n'.format(name, name)]
+            + ['    ({!r}, {!r}),\n'.format(m.name, m.value) for m in cls]
+            + ['], module=__name__)\n',
+               '{}.__doc__ = {!r}\n'.format(name, cls.__doc__)]
+            + ['{}[{!r}].__doc__ = {!r}\n'.format(name, m.name, m.__doc__)
+               for m in cls])
+    elif issubclass(cls, types.Union):
+        return ('class {}(_quiz.Union):\n'
+                '    __doc__ = {!r}\n'
+                '    __args__ = ({}, )\n').format(
+                    name, cls.__doc__,
+                    ', '.join(names[a] for a in cls.__args__))
+    elif issubclass(cls, types.InputObject):
+        return 'class {}(_quiz.types.InputObject):\n    __doc__ = {!r}\n'\
+            .format(name, cls.__doc__)
+    elif issubclass(cls, types.GenericScalar):
+        return 'class {}(_quiz.GenericScalar):\n    __doc__ = {!r}\n'.format(
+            name, cls.__doc__)
+    # custom scalars
+    return 'from {} import {} as {}\n'.format(cls.__module__, cls.__name__,
+                                              name)
+
+
+def _module_source(schema):
+    # type: (Schema) -> str
+    names = {cls: name for name, cls in schema.classes.items()}
+    names.update((cls, cls.__name__)
+                 for name, cls in types.BUILTIN_SCALARS.items()
+                 if schema.classes.get(name) is cls)
+    defined = sorted(
+        (name, cls) for name, cls in schema.classes.items()
+        if names[cls] == name
+    )
+    # definitions may only refer to those of an earlier kind
+    kinds = [
+        lambda c: not isinstance(c, types.HasFields) and not issubclass(
+            c, (types.Enum, types.Union, types.InputObject)),
+        lambda c: (isinstance(c, types.Interface)
+                   and not issubclass(c, types.Object)),
+        lambda c: issubclass(c, (types.Object, types.Enum,
+                                 types.InputObject)),
+        lambda c: issubclass(c, types.Union),
+    ]
+    return '\n\n'.join(
+        [_MODULE_HEADER.format(__version__)]
+        + [_class_source(name, cls, names)
+           for is_kind in kinds
+           for name, cls in defined
+           if is_kind(cls)]
+        + [_field_source(name, field, names)
+           for name, cls in defined
+           if isinstance(cls, types.HasFields)
+           for _, field in sorted(vars(cls).items())
+           if isinstance(field, types.FieldDefinition)]
+        + [''.join(
+            ['__schema__ = dict(\n    classes={\n']
+            + ['        {!r}: {},\n'.format(name, names[cls])
+               for name, cls in sorted(schema.classes.items())]
+            + ['    },\n']
+            + ['    {}={},\n'.format(attr, cls and names[cls])
+               for attr, cls in [
+                   ('query_type', schema.query_type),
+                   ('mutation_type', schema.mutation_type),
+                   ('subscription_type', schema.subscription_type)]]
+            + [')\n']),
+           '__raw__ = {!r}\n'.format(json.dumps(
+               schema.raw, sort_keys=True, separators=(',', ':')))]
+    )
 
 
 def _load_types(raw_schema):
@@ -352,7 +1690,7 @@ def _load_types(raw_schema):
     return map(_cast_type, map(_deserialize_type, raw_schema['types']))
 
 
-INTROSPECTION_QUERY = """
+_INTROSPECTION_SELECTION = """
 {
   __schema {
     queryType { name }
@@ -364,63 +1702,109 @@ INTROSPECTION_QUERY = """
   }
 }
 
-fragment FullType on __Type {
+"""
+
+_DIRECTORY_QUERY = """
+{
+  __schema {
+    queryType { name }
+    mutationType { name }
+    subscriptionType { name }
+    types { name }
+  }
+}
+"""
+
+_FRAGMENTS_TEMPLATE = """\
+fragment FullType on __Type {{
   kind
-  name
-  description
-  fields(includeDeprecated: true) {
-    name
-    description
-    args {
+  name{description}
+  fields(includeDeprecated: {deprecated}) {{
+    name{member_description}
+    args {{
       ...InputValue
-    }
-    type {
+    }}
+    type {{
       ...TypeRef
-    }
-    isDeprecated
-    deprecationReason
-  }
-  inputFields {
+    }}{deprecation}
+  }}
+  inputFields {{
     ...InputValue
-  }
-  interfaces {
+  }}
+  interfaces {{
     ...TypeRef
-  }
-  enumValues(includeDeprecated: true) {
-    name
-    description
-    isDeprecated
-    deprecationReason
-  }
-  possibleTypes {
+  }}
+  enumValues(includeDeprecated: {deprecated}) {{
+    name{member_description}{deprecation}
+  }}
+  possibleTypes {{
     ...TypeRef
-  }
-}
+  }}
+}}
 
-fragment InputValue on __InputValue {
-  name
-  description
-  type { ...TypeRef }
-  defaultValue
-}
+fragment InputValue on __InputValue {{
+  name{description}
+  type {{ ...TypeRef }}{default_value}
+}}
 
-fragment TypeRef on __Type {
+fragment TypeRef on __Type {{
   kind
   name
-  ofType {
+  ofType {{
     kind
     name
-    ofType {
+    ofType {{
       kind
       name
-      ofType {
+      ofType {{
         kind
         name
-      }
-    }
-  }
-}
+      }}
+    }}
+  }}
+}}
 """
+
+
+def introspection_query(descriptions=True, deprecated=True,
+                        default_values=True):
+    """Create a query to retrieve the raw schema.
+    Leaving out information reduces the size of the result,
+    while still allowing to create a :class:`Schema` from it.
+
+    Parameters
+    ----------
+    descriptions: bool
+        Whether to retrieve descriptions of types, fields, and enum values.
+        Without them, the schema's classes have no docstrings.
+    deprecated: bool
+        Whether to retrieve deprecated fields and enum values.
+    default_values: bool
+        Whether to retrieve the default values of arguments.
+
+    Returns
+    -------
+    str
+        The introspection query
+    """
+    return _INTROSPECTION_SELECTION + _introspection_fragments(
+        descriptions, deprecated, default_values)
+
+
+def _introspection_fragments(descriptions, deprecated, default_values):
+    # type: (bool, bool, bool) -> str
+    # the ``FullType`` fragment and the fragments it depends on
+    return _FRAGMENTS_TEMPLATE.format(
+        description='\n  description' if descriptions else '',
+        member_description='\n    description' if descriptions else '',
+        deprecated='true' if deprecated else 'false',
+        deprecation=('\n    isDeprecated\n    deprecationReason'
+                     if deprecated else ''),
+        default_value='\n  defaultValue' if default_values else '',
+    )
+
+
+INTROSPECTION_QUERY = introspection_query()
 """Query to retrieve the raw schema"""
 
 
@@ -475,9 +1859,9 @@ EnumValue = t.NamedTuple('EnumValue', [
 def make_inputvalue(conf):
     return InputValue(
         name=conf["name"],
-        desc=conf["description"],
+        desc=conf.get("description"),
         type=make_typeref(conf["type"]),
-        default=conf["defaultValue"],
+        default=conf.get("defaultValue"),
     )
 
 
@@ -494,18 +1878,18 @@ def make_field(conf):
         name=conf["name"],
         type=make_typeref(conf["type"]),
         args=list(map(make_inputvalue, conf["args"])),
-        desc=conf["description"],
-        is_deprecated=conf["isDeprecated"],
-        deprecation_reason=conf["deprecationReason"],
+        desc=conf.get("description"),
+        is_deprecated=conf.get("isDeprecated", False),
+        deprecation_reason=conf.get("deprecationReason"),
     )
 
 
 def make_enumval(conf):
     return EnumValue(
         name=conf["name"],
-        desc=conf["description"],
-        is_deprecated=conf["isDeprecated"],
-        deprecation_reason=conf["deprecationReason"],
+        desc=conf.get("description"),
+        is_deprecated=conf.get("isDeprecated", False),
+        deprecation_reason=conf.get("deprecationReason"),
     )
 
 
@@ -514,7 +1898,7 @@ def _deserialize_type(conf):
     return Type(
         name=conf["name"],
         kind=Kind(conf["kind"]),
-        desc=conf["description"],
+        desc=conf.get("description"),
         fields=conf["fields"] and list(map(make_field, conf["fields"])),
         input_fields=conf["inputFields"]
         and list(map(make_inputvalue, conf["inputFields"])),
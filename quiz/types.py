@@ -1,12 +1,17 @@
 """Components for typed GraphQL interactions"""
 import enum
+import threading
 import typing as t
-from itertools import starmap
+from functools import partial
+from itertools import count, starmap
+from weakref import WeakValueDictionary
 
 import six
 
-from .build import Field, InlineFragment, SelectionSet
-from .utils import JSON, FrozenDict, ValueObject
+from .build import (Field, FragmentDefinition, FragmentSpread, InlineFragment,
+                    SelectionSet, Variable, _fragments_of, gql_compact,
+                    type_as_gql)
+from .utils import JSON, FrozenDict, LRUCache, ValueObject
 
 __all__ = [
     # types
@@ -25,6 +30,9 @@ __all__ = [
 
     # validation
     'validate',
+    'VALIDATION_CACHE',
+    'variable_defs',
+    'validate_variables',
     'ValidationError',
     'SelectionError',
     'NoSuchField',
@@ -32,9 +40,15 @@ __all__ = [
     'SelectionsNotSupported',
     'InvalidArgumentType',
     'MissingArgument',
+    'InvalidFragmentType',
+    'ConflictingVariableTypes',
 
     'NoValueForField',
     'load',
+    'compile_loader',
+
+    # optimization
+    'extract_fragments',
 ]
 
 
@@ -45,6 +59,7 @@ InputValue = t.NamedTuple('InputValue', [
 ])
 
 _PRIMITIVE_TYPES = (int, float, bool, six.text_type)
+_NoneType = type(None)
 
 
 class HasFields(type):
@@ -54,6 +69,52 @@ class HasFields(type):
         # type: (SelectionSet) -> InlineFragment
         return InlineFragment(self, validate(self, selection_set))
 
+    # field tables (see ``_field_table``) may become outdated
+    # when fields are added or removed, also those of base classes.
+    def __setattr__(self, name, value):
+        super(HasFields, self).__setattr__(name, value)
+        _fields_changed(self)
+
+    def __delattr__(self, name):
+        super(HasFields, self).__delattr__(name)
+        _fields_changed(self)
+
+    # fields of lazily created classes are added when first needed
+    def __getattr__(self, name):
+        if _add_pending_fields(self):
+            return getattr(self, name)
+        raise AttributeError(name)
+
+
+_PENDING_FIELDS_LOCK = threading.RLock()
+
+
+def _add_pending_fields(cls):
+    # type: (HasFields) -> bool
+    # Add the fields of a lazily created class, if not yet done.
+    # Returns whether the class had pending fields.
+    if '__pending_fields__' not in cls.__dict__:
+        return False
+    with _PENDING_FIELDS_LOCK:
+        try:
+            add_fields = cls.__dict__['__pending_fields__']
+        except KeyError:  # added in another thread in the meantime
+            return True
+        if add_fields is None:  # already being added in this thread
+            return False
+        type.__setattr__(cls, '__pending_fields__', None)
+        try:
+            add_fields(cls)
+        except Exception:
+            # remove any fields added so far, to retry on the next access
+            for name, value in list(vars(cls).items()):
+                if isinstance(value, FieldDefinition):
+                    delattr(cls, name)
+            type.__setattr__(cls, '__pending_fields__', add_fields)
+            raise
+        type.__delattr__(cls, '__pending_fields__')
+        return True
+
 
 class Namespace(object):
 
@@ -127,16 +188,26 @@ class FieldDefinition(ValueObject):
         return ': {.__name__}\n    {}'.format(self.type, self.desc)
 
 
+def _parametrized(cache, base, arg):
+    # parametrized types are interned, so they can be compared
+    # (and used as cache keys) by identity
+    try:
+        return cache[arg]
+    except KeyError:
+        return cache.setdefault(arg, type(
+            base.__name_format__.format(arg), (base, ), {'__arg__': arg}))
+
+
 class ListMeta(type):
 
     def __getitem__(self, arg):
-        return type('[{.__name__}]'.format(arg), (List, ), {
-            '__arg__': arg
-        })
+        return _parametrized(_LISTS, List, arg)
 
     def __instancecheck__(self, instance):
-        return (isinstance(instance, list)
-                and all(isinstance(i, self.__arg__) for i in instance))
+        return _list_checker(self.__arg__)(instance)
+
+    def __gql_type__(self):
+        return '[{}]!'.format(type_as_gql(self.__arg__))
 
 
 # Q: why not typing.List?
@@ -144,18 +215,23 @@ class ListMeta(type):
 @six.add_metaclass(ListMeta)
 class List(object):
     __arg__ = object
+    __name_format__ = '[{.__name__}]'
+
+
+_LISTS = WeakValueDictionary()  # type: t.MutableMapping[type, type]
 
 
 class NullableMeta(type):
 
     def __getitem__(self, arg):
-        return type('{.__name__} or None'.format(arg), (Nullable, ), {
-            '__arg__': arg
-        })
+        return _parametrized(_NULLABLES, Nullable, arg)
 
     def __instancecheck__(self, instance):
         return instance is None or isinstance(instance, self.__arg__)
 
+    def __gql_type__(self):
+        return type_as_gql(self.__arg__).rstrip('!')
+
 
 # Q: why not typing.Optional?
 # A: it is not easily distinguished from Union,
@@ -163,6 +239,10 @@ class NullableMeta(type):
 @six.add_metaclass(NullableMeta)
 class Nullable(object):
     __arg__ = object
+    __name_format__ = '{.__name__} or None'
+
+
+_NULLABLES = WeakValueDictionary()  # type: t.MutableMapping[type, type]
 
 
 class UnionMeta(type):
@@ -235,27 +315,183 @@ def _validate_args(schema, actual):
     return actual
 
 
-def _validate_field(schema, actual):
-    # type (Optional[FieldDefinition], Field) -> Field
+def _type_checker(type_):
+    # type: (type) -> t.Callable[[object], bool]
+    # equivalent to isinstance(), without the overhead
+    # of the custom __instancecheck__ hooks at each level
+    if issubclass(type_, Nullable):
+        check_arg = _type_checker(type_.__arg__)
+        return lambda value: value is None or check_arg(value)
+    elif issubclass(type_, List):
+        return _list_checker(type_.__arg__)
+    elif issubclass(type_, GenericScalar):
+        return lambda value: isinstance(value, _PRIMITIVE_TYPES)
+    return lambda value: isinstance(value, type_)
+
+
+def _class_checker(type_):
+    # type: (type) -> t.Optional[t.Callable[[type], bool]]
+    # a check on the class of values, equivalent to isinstance().
+    # Only possible if no custom __instancecheck__ is involved.
+    if issubclass(type_, Nullable):
+        check_arg = _class_checker(type_.__arg__)
+        return check_arg and (
+            lambda cls: cls is _NoneType or check_arg(cls))
+    elif issubclass(type_, GenericScalar):
+        return lambda cls: issubclass(cls, _PRIMITIVE_TYPES)
+    elif type(type_).__instancecheck__ is type.__instancecheck__:
+        return lambda cls: issubclass(cls, type_)
+    return None
+
+
+def _list_checker(item_type):
+    # type: (type) -> t.Callable[[object], bool]
+    check_class = _class_checker(item_type)
+    if check_class is None:
+        check_item = _type_checker(item_type)
+        return lambda value: isinstance(value, list) and all(
+            map(check_item, value))
+    # large lists (e.g. of IDs) typically have few distinct item classes,
+    # which can be collected without calling back into python code.
+    return lambda value: isinstance(value, list) and all(
+        map(check_class, set(map(type, value))))
+
+
+_FieldEntry = t.NamedTuple('_FieldEntry', [
+    ('definition', 'FieldDefinition'),
+    # the type of subselections, or None if not supported
+    ('target', t.Optional[type]),
+    # (name, required?, type checker), in order of definition
+    ('args', t.Tuple[t.Tuple[str, bool, t.Callable[[object], bool]], ...]),
+    ('arg_names', t.FrozenSet[str]),
+])
+
+_FIELDS_VERSIONS = count(1)
+
+
+def _fields_changed(cls):
+    # type: (HasFields) -> None
+    # Give the class, and its subclasses (which inherit its fields),
+    # a new fields version. Their field tables and cached validation
+    # results are thus outdated. Those of other classes remain valid.
+    version = next(_FIELDS_VERSIONS)
+    pending = [cls]
+    while pending:
+        klass = pending.pop()
+        type.__setattr__(klass, '__fields_version__', version)
+        pending.extend(type.__subclasses__(klass))
+
+
+def _fields_version(cls):
+    # type: (HasFields) -> int
+    return cls.__dict__.get('__fields_version__', 0)
+
+
+def _field_entry(definition):
+    # type: (FieldDefinition) -> _FieldEntry
+    target = _unwrap_list_or_nullable(definition.type)
+    return _FieldEntry(
+        definition,
+        target if isinstance(target, HasFields) else None,
+        tuple((arg.name,
+               not issubclass(arg.type, Nullable),
+               _type_checker(arg.type))
+              for arg in definition.args.values()),
+        frozenset(definition.args),
+    )
+
+
+def _field_table(cls):
+    # type: (type) -> t.Dict[str, _FieldEntry]
+    # The fields of a class (by attribute name), prepared for validation.
+    # Computed once, unless fields are (re)defined afterwards.
+    try:
+        version, table = cls.__dict__['__field_table__']
+    except KeyError:
+        pass
+    else:
+        if version == _fields_version(cls):
+            return table
+    for klass in cls.__mro__:
+        if isinstance(klass, HasFields):
+            _add_pending_fields(klass)
+    # read before the fields: a concurrent change makes the table outdated
+    version = _fields_version(cls)
+    table = {
+        name: _field_entry(value)
+        for klass in reversed(cls.__mro__)
+        if isinstance(klass, HasFields)
+        for name, value in vars(klass).items()
+        if isinstance(value, FieldDefinition)
+    }
+    # bypass HasFields.__setattr__, this doesn't change the fields
+    type.__setattr__(cls, '__field_table__', (version, table))
+    return table
+
+
+def _validate_field(entry, actual):
+    # type (Optional[_FieldEntry], Field) -> _Versions
+    # returns the fields versions of the classes involved (see _validate)
     # raises:
     # - NoSuchField
     # - SelectionsNotSupported
     # - NoSuchArgument
     # - RequredArgument
     # - InvalidArgumentType
-    if schema is None:
+    if entry is None:
         raise NoSuchField()
-    _validate_args(schema.args, actual.kwargs)
+    kwargs = actual.kwargs
+    if kwargs:
+        for name in kwargs:
+            if name not in entry.arg_names:
+                raise NoSuchArgument(name)
+    for name, required, check in entry.args:
+        try:
+            value = kwargs[name]
+        except KeyError:
+            if required:
+                raise MissingArgument(name)
+            continue  # arguments of nullable type may be omitted
+        # the values of variables are only known at execution
+        if not (check(value) or isinstance(value, Variable)):
+            raise InvalidArgumentType(name, value)
     if actual.selection_set:
-        type_ = _unwrap_list_or_nullable(schema.type)
-        if not isinstance(type_, HasFields):
+        if entry.target is None:
             raise SelectionsNotSupported()
-        validate(type_, actual.selection_set)
-    return actual
+        return _validate(entry.target, actual.selection_set)
+    return ()
+
+
+def _validate_spread(cls, fragment):
+    # type (HasFields, FragmentDefinition) -> _Versions
+    # raises:
+    # - InvalidFragmentType
+    # - SelectionError
+    # The fragment must apply to (some of) the objects of the class:
+    # it is on the class itself, an interface of it,
+    # or (if the class is an interface) an object implementing it.
+    if not (issubclass(cls, fragment.on) or issubclass(fragment.on, cls)):
+        raise InvalidFragmentType(fragment.on)
+    return _validate(fragment.on, fragment.selection_set)
+
+
+def _path(selection):
+    # type: (t.Union[Field, FragmentSpread]) -> str
+    if isinstance(selection, FragmentSpread):
+        return '...' + selection.fragment.name
+    return selection.name
+
+
+VALIDATION_CACHE = LRUCache(maxsize=2048)
+"""The ``(type, selection set)`` pairs which were found valid.
+Nested selection sets are cached as well.
+Use its :meth:`~quiz.utils.LRUCache.info` method to see its hit rate,
+or :meth:`~quiz.utils.LRUCache.resize` it to zero to disable it."""
 
 
 def validate(cls, selection_set):
-    """Validate a selection set against a type
+    """Validate a selection set against a type.
+    Valid results are stored in :data:`VALIDATION_CACHE`.
 
     Parameters
     ----------
@@ -274,12 +510,137 @@ def validate(cls, selection_set):
     SelectionError
         If the selection set is not valid
     """
-    for field in selection_set:
+    _validate(cls, selection_set)
+    return selection_set
+
+
+# the fields versions of classes, as (class, version) pairs
+_Versions = t.Tuple[t.Tuple[type, int], ...]
+
+
+def _validate(cls, selection_set):
+    # type: (HasFields, SelectionSet) -> _Versions
+    # Validate a selection set, returning the fields versions
+    # of all classes involved. Cached results are only used
+    # as long as the fields of these classes are unchanged.
+    key = (cls, selection_set)
+    versions = VALIDATION_CACHE.get_or_compute(
+        key, _validate_uncached, cls, selection_set)
+    if not all(_fields_version(klass) == version
+               for klass, version in versions):
+        versions = _validate_uncached(cls, selection_set)
+        VALIDATION_CACHE.put(key, versions)
+    return versions
+
+
+def _validate_uncached(cls, selection_set):
+    # type: (HasFields, SelectionSet) -> _Versions
+    fields = _field_table(cls)
+    versions = {cls: _fields_version(cls)}
+    for selection in selection_set:
         try:
-            _validate_field(getattr(cls, field.name, None), field)
+            if isinstance(selection, FragmentSpread):
+                versions.update(_validate_spread(cls, selection.fragment))
+            else:
+                versions.update(_validate_field(fields.get(selection.name),
+                                                selection))
         except ValidationError as e:
-            raise SelectionError(cls, field.name, e)
-    return selection_set
+            raise SelectionError(cls, _path(selection), e)
+    return tuple(versions.items())
+
+
+def _collect_variables(cls, selection_set, found):
+    # type: (type, SelectionSet, t.Dict[str, type]) -> None
+    for selection in selection_set:
+        if isinstance(selection, InlineFragment):
+            _collect_variables(selection.on, selection.selection_set, found)
+            continue
+        elif isinstance(selection, FragmentSpread):
+            _collect_variables(selection.fragment.on,
+                               selection.fragment.selection_set, found)
+            continue
+        schema = getattr(cls, selection.name)
+        for name, value in selection.kwargs.items():
+            if isinstance(value, Variable):
+                type_ = schema.args[name].type
+                known = found.setdefault(value.name, type_)
+                # parametrized types are interned: identity suffices
+                if known is not type_:
+                    try:
+                        found[value.name] = _stricter_type(known, type_)
+                    except ValueError:
+                        raise SelectionError(
+                            cls, selection.name,
+                            ConflictingVariableTypes(value.name, known, type_))
+        if selection.selection_set:
+            try:
+                _collect_variables(_unwrap_list_or_nullable(schema.type),
+                                   selection.selection_set, found)
+            except ValidationError as e:
+                raise SelectionError(cls, selection.name, e)
+
+
+def _stricter_type(a, b):
+    # type: (type, type) -> type
+    # a non-null variable may be used where a nullable one is allowed
+    if issubclass(a, Nullable) and a.__arg__ is b:
+        return b
+    elif issubclass(b, Nullable) and b.__arg__ is a:
+        return a
+    raise ValueError('incompatible types')
+
+
+def variable_defs(cls, selection_set):
+    """Determine the types of the variables in a (validated) selection set
+
+    Parameters
+    ----------
+    cls: type
+        The class of the selection set, an ``Object`` or ``Interface``
+    selection_set: SelectionSet
+        The selection set
+
+    Returns
+    -------
+    FrozenDict[str, type]
+        The types of the variables, by name
+
+    Raises
+    ------
+    SelectionError
+        If a variable is used for arguments of incompatible types.
+        A variable used for both a non-null and a nullable argument
+        is defined as non-null.
+    """
+    found = {}
+    _collect_variables(cls, selection_set, found)
+    return FrozenDict(found) if found else FrozenDict.EMPTY
+
+
+def validate_variables(definitions, values):
+    """Validate variable values against their definitions
+
+    Parameters
+    ----------
+    definitions: ~typing.Mapping[str, type]
+        The types of the variables, by name
+    values: ~typing.Mapping[str, object]
+        The variable values
+
+    Returns
+    -------
+    ~typing.Mapping[str, object]
+        The validated values
+
+    Raises
+    ------
+    ValidationError
+        If the variables are not valid (e.g. missing, or of invalid type)
+    """
+    return _validate_args({
+        name: InputValue(name, '', type_)
+        for name, type_ in definitions.items()
+    }, values)
 
 
 T = t.TypeVar('T')
@@ -336,10 +697,229 @@ def load(cls, selection_set, response):
             field,
             response[field.alias or field.name],
         )
-        for field in selection_set
+        for field in _fields(selection_set)
     })
 
 
+def _fields(selection_set):
+    # type: (SelectionSet) -> t.Iterator[Field]
+    # fields in a selection set, with fragment spreads expanded
+    for selection in selection_set:
+        if isinstance(selection, FragmentSpread):
+            for field in _fields(selection.fragment.selection_set):
+                yield field
+        else:
+            yield selection
+
+
+def _load_nullable(loader, value):
+    return None if value is None else loader(value)
+
+
+def _load_list(loader, value):
+    return [loader(v) for v in value]
+
+
+def _load_unsupported(type_, value):
+    raise NotImplementedError()
+
+
+def _compile_field(type_, selection_set):
+    # type: (type, SelectionSet) -> t.Optional[t.Callable[[JSON], object]]
+    # ``None`` indicates the value can be used as-is
+    if issubclass(type_, Namespace):
+        return compile_loader(type_, selection_set)
+    elif issubclass(type_, Nullable):
+        inner = _compile_field(type_.__arg__, selection_set)
+        return None if inner is None else partial(_load_nullable, inner)
+    elif issubclass(type_, List):
+        inner = _compile_field(type_.__arg__, selection_set)
+        return list if inner is None else partial(_load_list, inner)
+    elif issubclass(type_, _PRIMITIVE_TYPES + (GenericScalar, )):
+        return None
+    elif issubclass(type_, Scalar):
+        return type_.__gql_load__
+    elif issubclass(type_, Enum):
+        return type_
+    else:
+        return partial(_load_unsupported, type_)
+
+
+def compile_loader(cls, selection_set):
+    """Create a specialized function which loads responses
+    for a selection set. Equivalent to ``partial(load, cls, selection_set)``,
+    but with the type of each field resolved once, up front.
+
+    Parameters
+    ----------
+    cls: Type[T]
+        The class to load against, an ``Object`` or ``Interface``
+    selection_set: SelectionSet
+        The selection set of the responses
+
+    Returns
+    -------
+    ~typing.Callable[[t.Dict[str, JSON]], T]
+        A function which loads a response into an instance of ``cls``
+    """
+    fields = [
+        (field.alias or field.name,
+         _compile_field(getattr(cls, field.name).type, field.selection_set))
+        for field in _fields(selection_set)
+    ]
+    plain = [key for key, loader in fields if loader is None]
+    loaded = [(key, loader) for key, loader in fields if loader is not None]
+
+    if (six.get_unbound_function(cls.__init__)
+            is six.get_unbound_function(Namespace.__init__)):
+        def make(data):
+            instance = cls.__new__(cls)
+            instance.__dict__ = data
+            return instance
+    else:
+        def make(data):
+            return cls(**data)
+
+    def load_response(response):
+        data = {key: response[key] for key in plain}
+        for key, loader in loaded:
+            data[key] = loader(response[key])
+        return make(data)
+
+    return load_response
+
+
+_LOADERS = LRUCache(maxsize=512)
+
+
+def _cached_loader(cls, selection_set):
+    return _LOADERS.get_or_compute((cls, selection_set), compile_loader,
+                                   cls, selection_set)
+
+
+def _count_selection_sets(cls, selection_set, counts):
+    # type: (type, SelectionSet, t.Dict[tuple, int]) -> None
+    # Repeated selection sets are counted, but only descended into once.
+    # The counts of nested selection sets are thus not inflated
+    # by repetitions of their parent.
+    for type_, nested in _nested_selection_sets(cls, selection_set):
+        key = (type_, nested)
+        if key in counts:
+            counts[key] += 1
+        else:
+            counts[key] = 1
+            _count_selection_sets(type_, nested, counts)
+
+
+def _nested_selection_sets(cls, selection_set):
+    # type: (type, SelectionSet) -> t.Iterator[t.Tuple[type, SelectionSet]]
+    for selection in selection_set:
+        if isinstance(selection, Field) and selection.selection_set:
+            yield (_unwrap_list_or_nullable(getattr(cls, selection.name).type),
+                   selection.selection_set)
+        elif isinstance(selection, InlineFragment):
+            yield selection.on, selection.selection_set
+
+
+def _worth_extracting(type_, selection_set, count):
+    # compare the request size before and after extraction.
+    # 4 is a generous estimate of the size of the fragment name.
+    size = len(gql_compact(selection_set))
+    spread_size = len('{...}') + 4
+    definition_size = len('fragment  on ') + 4 + len(type_.__name__)
+    return count * size > count * spread_size + definition_size + size
+
+
+def extract_fragments(query):
+    """Optimize a query by extracting repeated selection sets into
+    named fragments. This results in a smaller GraphQL document.
+    Responses to the optimized query can be loaded as before.
+
+    Parameters
+    ----------
+    query: Query
+        The query to optimize
+
+    Returns
+    -------
+    Query
+        An equivalent query, with repeated selection sets
+        replaced by fragment spreads
+
+    Example
+    -------
+
+    >>> user_info = _.login.name.email.bio.company.location.websiteUrl
+    >>> str(extract_fragments(schema.query[
+    ...     _
+    ...     .viewer[user_info]
+    ...     .user(login='octocat')[user_info]
+    ... ]))
+    query {
+      viewer {
+        ...F0
+      }
+      user(login: "octocat") {
+        ...F0
+      }
+    }
+    <BLANKLINE>
+    fragment F0 on User {
+      login
+      name
+      email
+      bio
+      company
+      location
+      websiteUrl
+    }
+
+    Note
+    ----
+    Selection sets are only extracted if this reduces
+    the size of the (compact) query.
+    """
+    counts = {}
+    _count_selection_sets(query.cls, query.selections, counts)
+    chosen = {key for key, count in counts.items()
+              if count > 1 and _worth_extracting(key[0], key[1], count)}
+    if not chosen:
+        return query
+
+    taken = {f.name for f in _fragments_of(query.selections)}
+    names = [name for name in map('F{}'.format,
+                                  range(len(taken) + len(chosen)))
+             if name not in taken]
+    fragments = {}
+
+    def rewrite(cls, selection_set):
+        return SelectionSet._make(
+            [rewrite_selection(cls, s) for s in selection_set])
+
+    def rewrite_selection(cls, selection):
+        if isinstance(selection, Field) and selection.selection_set:
+            return selection.replace(selection_set=rewrite_nested(
+                _unwrap_list_or_nullable(getattr(cls, selection.name).type),
+                selection.selection_set))
+        elif isinstance(selection, InlineFragment):
+            return selection.replace(selection_set=rewrite_nested(
+                selection.on, selection.selection_set))
+        return selection
+
+    def rewrite_nested(type_, selection_set):
+        key = (type_, selection_set)
+        if key not in chosen:
+            return rewrite(type_, selection_set)
+        try:
+            fragment = fragments[key]
+        except KeyError:
+            fragment = fragments[key] = FragmentDefinition(
+                names.pop(0), type_, rewrite(type_, selection_set))
+        return SelectionSet(FragmentSpread(fragment))
+
+    return query.replace(selections=rewrite(query.cls, query.selections))
+
+
 class ValidationError(Exception):
     """base class for validation errors"""
 
@@ -407,6 +987,28 @@ class SelectionsNotSupported(ValueObject, ValidationError):
         return 'selections not supported on this object'
 
 
+class InvalidFragmentType(ValueObject, ValidationError):
+    __fields__ = [
+        ('on', type, 'Type of the (invalid) fragment'),
+    ]
+
+    def __str__(self):
+        return 'fragment on "{}" does not apply here'.format(
+            self.on.__name__)
+
+
+class ConflictingVariableTypes(ValueObject, ValidationError):
+    __fields__ = [
+        ('name', str, 'Variable name'),
+        ('first', type, 'Type of the earlier use of the variable'),
+        ('second', type, 'Type of the conflicting use of the variable'),
+    ]
+
+    def __str__(self):
+        return 'variable "${}" used as both {} and {}'.format(
+            self.name, type_as_gql(self.first), type_as_gql(self.second))
+
+
 BUILTIN_SCALARS = {
     "Boolean": bool,
     "String":  str,
@@ -1,8 +1,8 @@
 """Common utilities and boilerplate"""
 import sys
+import threading
 import typing as t
-from collections import namedtuple
-from functools import wraps
+from collections import OrderedDict
 from itertools import chain, starmap
 from operator import attrgetter
 
@@ -31,18 +31,46 @@ def identity(obj):
 class FrozenDict(t.Mapping[T1, T2]):
     # see https://stackoverflow.com/questions/45864273
     if not (3, 7) > sys.version_info > (3, 4):  # pragma: no cover
-        __slots__ = '_inner'
+        __slots__ = '_inner', '_hash'
 
     def __init__(self, inner):
         self._inner = inner if isinstance(inner, dict) else dict(inner)
+        self._hash = None
 
     __len__ = property(attrgetter('_inner.__len__'))
     __iter__ = property(attrgetter('_inner.__iter__'))
     __getitem__ = property(attrgetter('_inner.__getitem__'))
     __repr__ = property(attrgetter('_inner.__repr__'))
+    __contains__ = property(attrgetter('_inner.__contains__'))
+    keys = property(attrgetter('_inner.keys'))
+    values = property(attrgetter('_inner.values'))
+    items = property(attrgetter('_inner.items'))
+    get = property(attrgetter('_inner.get'))
 
     def __hash__(self):
-        return hash(frozenset(self._inner.items()))
+        if self._hash is None:
+            self._hash = hash(frozenset(self._inner.items()))
+        return self._hash
+
+    # Values must also be of the same type. For example, ``1``, ``1.0``
+    # and ``True`` are equal, but represent different GraphQL values.
+    def __eq__(self, other):
+        if other is self:
+            return True
+        if not isinstance(other, t.Mapping):
+            return NotImplemented
+        other = dict(other.items())
+        return self._inner == other and all(
+            value.__class__ is other[key].__class__
+            for key, value in self._inner.items()
+        )
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return NotImplemented if equal is NotImplemented else not equal
+
+    def __reduce__(self):
+        return FrozenDict, (self._inner, )
 
     if PY2:  # pragma: no cover
         viewkeys = property(attrgetter('_inner.viewkeys'))
@@ -79,11 +107,75 @@ def init_last(items):
         raise Empty
 
 
-def _make_init_fn(ntuple):
-    @wraps(ntuple.__new__)
-    def __init__(self, *args, **kwargs):
-        self._values = ntuple(*args, **kwargs)
-    return __init__
+_MISSING = object()
+
+# Methods are generated per class (as namedtuple does),
+# so that field values are read and written directly in the slots.
+_METHODS_TEMPLATE = """\
+def __init__({params}):
+{init_body}
+    pass
+
+def replace({replace_params}):
+    new = _new(_cls)
+{replace_body}
+    return new
+
+def _astuple(self):
+    return _values(self)
+
+def __eq__(self, other):
+    if type(other) is not _cls:
+        return NotImplemented
+    return self is other or ({equal})
+
+def __ne__(self, other):
+    if type(other) is not _cls:
+        return NotImplemented
+    return self is not other and not ({equal})
+"""
+
+
+def _tuple_getter(names):
+    # attrgetter only returns a tuple for two or more names
+    if len(names) > 1:
+        return attrgetter(*names)
+    elif names:
+        getter = attrgetter(*names)
+        return lambda obj: (getter(obj), )
+    else:
+        return lambda obj: ()
+
+
+def _make_methods(cls, fieldnames, defaults):
+    slots = ['_' + name for name in fieldnames]
+    namespace = {'_new': cls.__new__, '_cls': cls, '_MISSING': _MISSING,
+                 '_values': _tuple_getter(slots)}
+    namespace.update(('_set_' + name, getattr(cls, slot).__set__)
+                     for name, slot in zip(fieldnames, slots))
+    namespace.update(('_default_' + name, default) for name, default in zip(
+        fieldnames[len(fieldnames) - len(defaults):], defaults))
+    code = _METHODS_TEMPLATE.format(
+        params=', '.join(['self'] + [
+            name + ('=_default_' + name
+                    if '_default_' + name in namespace else '')
+            for name in fieldnames]),
+        init_body='\n'.join(
+            '    _set_{0}(self, {0})'.format(name) for name in fieldnames),
+        replace_params=', '.join(
+            ['self'] + [name + '=_MISSING' for name in fieldnames]),
+        # compared field by field, like tuples: identical values are equal
+        equal=' and '.join(
+            '(self.{0} is other.{0} or self.{0} == other.{0})'.format(slot)
+            for slot in slots) or 'True',
+        replace_body='\n'.join(
+            '    _set_{0}(new, self._{0} if {0} is _MISSING else {0})'.format(
+                name)
+            for name in fieldnames),
+    )
+    six.exec_(code, namespace)
+    return {name: namespace[name] for name in [
+        '__init__', 'replace', '_astuple', '__eq__', '__ne__']}
 
 
 class _ValueObjectMeta(type(t.Generic)):
@@ -92,27 +184,28 @@ class _ValueObjectMeta(type(t.Generic)):
     # TODO: add parameters to __doc__
     def __new__(self, name, bases, dct):
         # skip the ``ValueObject`` class itself
-        if bases != (object, ):
-            fields = dct['__fields__']
-            fieldnames = [n for n, _, _ in dct['__fields__']]
-            assert 'replace' not in fieldnames
-            ntuple = namedtuple('_' + name, fieldnames)
-            ntuple.__new__.__defaults__ = dct.get('__defaults__', ())
-            dct.update({
-                '__namedtuple_cls__': ntuple,
-                '__slots__': '_values',
-                # For the signature to appear correctly in
-                # introspection and docs,
-                # we create the __init__ function for
-                # each ValueObject class individually
-                '__init__': _make_init_fn(ntuple)
-            })
-            dct.update(
-                (name, property(attrgetter('_values.' + name),
-                                doc=doc))
-                for name, _, doc in fields
-            )
-        return super(_ValueObjectMeta, self).__new__(self, name, bases, dct)
+        if bases == (object, ):
+            return super(_ValueObjectMeta, self).__new__(
+                self, name, bases, dct)
+        fields = dct['__fields__']
+        fieldnames = [n for n, _, _ in fields]
+        assert 'replace' not in fieldnames
+        # Field values are stored directly in (underscored) slots.
+        # Slots cannot be documented (before python 3.8),
+        # so the fields themselves are read-only properties.
+        # A class may define such a property itself.
+        slots = tuple('_' + n for n in fieldnames) + ('_hash', )
+        assert not set(slots).intersection(fieldnames)
+        dct['__slots__'] = slots
+        for n, _, doc in fields:
+            dct.setdefault(n, property(attrgetter('_' + n), doc=doc))
+        cls = super(_ValueObjectMeta, self).__new__(self, name, bases, dct)
+        methods = _make_methods(cls, fieldnames, dct.get('__defaults__', ()))
+        methods['__init__'].__doc__ = cls.__doc__
+        methods['replace'].__doc__ = ValueObject.replace.__doc__
+        for name, method in methods.items():
+            type.__setattr__(cls, name, method)
+        return cls
 
 
 @six.add_metaclass(_ValueObjectMeta)
@@ -124,7 +217,6 @@ class ValueObject(object):
     -------
 
     >>> class Foo(ValueObject, ...):
-    ...     __slots__ = '_values'  # optional
     ...     __fields__ = [
     ...         ('foo', int, 'the foo'),
     ...         ('bla', str, 'description for bla'),
@@ -153,31 +245,171 @@ class ValueObject(object):
         MyObject(a=5, b="new!")
 
         """
-        new = type(self).__new__(type(self))
-        new._values = self._values._replace(**kwargs)
-        return new
+        # a faster version is generated for each subclass
+        return type(self)(**dict(
+            zip([n for n, _, _ in self.__fields__], self._astuple()),
+            **kwargs))
 
-    def __eq__(self, other):
-        if type(self) is type(other):
-            return self._values == other._values
-        return NotImplemented
+    # Instances are immutable. The generated methods set the values
+    # through the slot descriptors directly.
+    # Other attributes are not blocked: python itself sets some
+    # (e.g. ``__traceback__``) on exceptions.
+    def __setattr__(self, name, value):
+        if name in type(self).__slots__:
+            raise AttributeError("can't set attribute")
+        object.__setattr__(self, name, value)
 
-    def __ne__(self, other):
-        if type(self) is type(other):
-            return self._values != other._values
-        return NotImplemented
+    def __reduce__(self):
+        return type(self), self._astuple()
+
+    # __eq__ and __ne__ are generated for each subclass
 
     def __repr__(self):
         try:
             return '{}({})'.format(
                 getattr(self.__class__, '__name__' if PY2 else '__qualname__'),
-                ', '.join(starmap('{}={!r}'.format,
-                                  zip(self._values._fields, self._values)))
+                ', '.join(starmap('{}={!r}'.format, zip(
+                    (n for n, _, _ in self.__fields__), self._astuple())))
             )
         except Exception:
             return object.__repr__(self)
 
-    __hash__ = property(attrgetter('_values.__hash__'))
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            hashed = hash(self._astuple())
+            object.__setattr__(self, '_hash', hashed)
+            return hashed
+
+
+CacheInfo = t.NamedTuple('CacheInfo', [
+    ('hits', int),
+    ('misses', int),
+    ('maxsize', int),
+    ('currsize', int),
+])
+
+
+class LRUCache(object):
+    """A bounded, thread-safe mapping which discards
+    the least recently used entries once full
+
+    Parameters
+    ----------
+    maxsize: int
+        The maximum number of entries to keep.
+        A size of zero effectively disables the cache.
+    """
+    __slots__ = '_maxsize', '_data', '_lock', 'hits', 'misses'
+
+    def __init__(self, maxsize=1024):
+        self._maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    @property
+    def maxsize(self):
+        """The maximum number of entries"""
+        return self._maxsize
+
+    def get(self, key, default=None):
+        """Retrieve an entry, marking it as recently used"""
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def get_or_compute(self, key, func, *args):
+        """Retrieve an entry, or compute and store it if missing.
+        Keys which can't be hashed (e.g. selections with unhashable
+        arguments) are not cached: the value is computed each time.
+
+        Parameters
+        ----------
+        key: ~typing.Hashable
+            The key of the entry
+        func: ~typing.Callable
+            Computes the value, called with ``*args``
+        *args
+            Arguments for ``func``
+
+        Returns
+        -------
+        object
+            The (cached or computed) value
+        """
+        try:
+            value = self.get(key, _MISSING)
+        except TypeError:  # unhashable
+            return func(*args)
+        if value is _MISSING:
+            value = func(*args)
+            self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        """Store an entry, evicting the oldest entries if needed"""
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            self._evict()
+
+    def pop(self, key, default=None):
+        """Remove an entry, returning its value"""
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def items(self):
+        """A list of the entries, from least to most recently used"""
+        with self._lock:
+            return list(self._data.items())
+
+    def resize(self, maxsize):
+        """Change the maximum size, evicting entries if needed
+
+        Parameters
+        ----------
+        maxsize: int
+            The new maximum size
+        """
+        with self._lock:
+            self._maxsize = maxsize
+            self._evict()
+
+    def _evict(self):
+        while len(self._data) > self._maxsize:
+            self._data.popitem(last=False)
+
+    def info(self):
+        """Statistics on the cache
+
+        Returns
+        -------
+        CacheInfo
+            The hits, misses, maximum size, and current size
+        """
+        with self._lock:
+            return CacheInfo(self.hits, self.misses,
+                             self._maxsize, len(self._data))
+
+    def clear(self):
+        """Remove all entries and reset the statistics"""
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
 
 
 class compose(object):
@@ -47,5 +47,5 @@ setup(
     ],
     keywords=['graphql', 'http', 'async'],
     python_requires='>=2.7',
-    packages=find_packages(exclude=('tests', 'docs')),
+    packages=find_packages(exclude=('tests', 'docs', 'benchmarks')),
 )
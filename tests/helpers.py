@@ -1,4 +1,10 @@
+import hashlib
+import json
+import re
+import threading
+
 import snug
+from six.moves import BaseHTTPServer
 
 
 class MockClient:
@@ -14,6 +20,53 @@ class MockClient:
 snug.send.register(MockClient, MockClient.send)
 
 
+class IntrospectionClient:
+    """answers introspection queries from a raw schema.
+    Supports revalidation with ETags, if an ``etag`` is set."""
+
+    def __init__(self, raw_schema, etag=None):
+        self.raw_schema = raw_schema
+        self.types = {conf['name']: conf for conf in raw_schema['types']}
+        self.etag = etag
+        self.requests = []
+        self.queries = []
+
+    def send(self, req):
+        self.requests.append(req)
+        query = json.loads(req.content.decode('ascii'))['query']
+        self.queries.append(query)
+        if self.etag and req.headers.get('If-None-Match') == self.etag:
+            return snug.Response(304, b'')
+        if '__type(' in query:
+            data = {alias: self.types.get(name) for alias, name in
+                    re.findall(r'(\w+): __type\(name: "(\w+)"\)', query)}
+        elif 'FullType' in query:
+            data = {'__schema': self.raw_schema}
+        else:
+            data = {'__schema': dict(
+                self.raw_schema,
+                types=[{'name': name} for name in self.types])}
+        return snug.Response(200, json.dumps({'data': data}).encode(),
+                             headers={'ETag': self.etag} if self.etag else {})
+
+
+snug.send.register(IntrospectionClient, IntrospectionClient.send)
+
+
+class FlakyIntrospectionClient(IntrospectionClient):
+    """an introspection client which fails while ``failing`` is set"""
+
+    failing = False
+
+    def send(self, req):
+        if self.failing:
+            return snug.Response(500, b'')
+        return IntrospectionClient.send(self, req)
+
+
+snug.send.register(FlakyIntrospectionClient, FlakyIntrospectionClient.send)
+
+
 class AlwaysEquals:
     """useful for testing correct __eq__, __ne__ implementations"""
 
@@ -32,3 +85,92 @@ class NeverEquals:
 
     def __ne__(self, other):
         return True
+
+
+class _PersistedQueryHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        body = json.loads(self.rfile.read(length).decode())
+        self.server.received.append(body)
+        content = (list(map(self._respond, body)) if isinstance(body, list)
+                   else self._respond(body))
+        encoded = json.dumps(content).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def _respond(self, operation):
+        digest = operation['extensions']['persistedQuery']['sha256Hash']
+        if 'query' in operation:
+            assert hashlib.sha256(
+                operation['query'].encode()).hexdigest() == digest
+            self.server.known[digest] = operation['query']
+        if digest in self.server.known:
+            return {'data': self.server.data}
+        else:
+            return {'errors': [{'message': 'PersistedQueryNotFound'}]}
+
+    def log_message(self, *args):
+        pass
+
+
+class PersistedQueryServer(object):
+    """local stand-in for a server supporting automatic persisted queries,
+    and batches of operations"""
+
+    def __init__(self, data):
+        self.httpd = BaseHTTPServer.HTTPServer(('127.0.0.1', 0),
+                                               _PersistedQueryHandler)
+        self.httpd.data = data
+        self.httpd.known = {}
+        self.httpd.received = self.received = []
+        self.url = 'http://127.0.0.1:{}/graphql'.format(
+            self.httpd.server_address[1])
+
+    def __enter__(self):
+        thread = threading.Thread(target=self.httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def _type_repr(type_):
+    # parametrized types are compared by name, so schemas
+    # with separately created classes can be compared
+    return getattr(type_, '__name__', None)
+
+
+def describe_schema(schema):
+    """structural summary of a schema's classes, for comparison"""
+    import quiz
+    summary = {}
+    for name, cls in schema.classes.items():
+        if isinstance(cls, quiz.types.HasFields):
+            details = [cls.__doc__, sorted(
+                c.__name__ for c in cls.__mro__[1:])]
+            for attr in sorted(dir(cls)):
+                field = getattr(cls, attr)
+                if isinstance(field, quiz.FieldDefinition):
+                    details.append((
+                        attr, field.desc, _type_repr(field.type),
+                        field.is_deprecated, field.deprecation_reason,
+                        sorted((a.name, a.desc, _type_repr(a.type))
+                               for a in field.args.values())))
+        elif issubclass(cls, quiz.Enum):
+            details = [cls.__doc__, [(m.name, m.value, m.__doc__)
+                                     for m in cls]]
+        elif issubclass(cls, quiz.Union):
+            details = [cls.__doc__, [a.__name__ for a in cls.__args__]]
+        else:
+            details = [cls.__doc__, [c.__name__ for c in cls.__mro__]]
+        summary[name] = details
+    return (summary, _type_repr(schema.query_type),
+            _type_repr(schema.mutation_type),
+            _type_repr(schema.subscription_type))
@@ -10,7 +10,7 @@ from quiz import SELECTOR as _
 from quiz import Field, InlineFragment, SelectionSet, gql
 from quiz.utils import FrozenDict as fdict
 
-from .example import Dog
+from .example import Command, Dog, DogQuery, Human
 from .helpers import AlwaysEquals, NeverEquals
 
 
@@ -97,8 +97,14 @@ class TestSelectionSet:
         assert hash(_.foo.bar) == hash(_.foo.bar)
         assert hash(_.bar.foo) != hash(_.foo.bar)
 
+    def test_hash_cached(self):
+        instance = _.foo.bar
+        assert hash(instance) == hash(instance) == hash(_.foo.bar)
+        assert hash(SelectionSet(Field('foo'))) == hash(_.foo)
+
     def test_equality(self):
         instance = _.foo.bar
+        assert instance == instance
         assert instance == _.foo.bar
         assert not instance == _.bar.foo
         assert instance == AlwaysEquals()
@@ -220,6 +226,106 @@ class TestSelectionSet:
         )
 
 
+class TestInterned:
+
+    @pytest.fixture(autouse=True)
+    def table(self, mocker):
+        table = quiz.utils.LRUCache()
+        mocker.patch('quiz.build.INTERNED', table)
+        return table
+
+    def test_shared(self):
+        first = quiz.interned(_.foo(a=1)[_.bar.qux].bla[_.bar.qux])
+        second = quiz.interned(_.foo(a=1)[_.bar.qux].bla[_.bar.qux])
+        assert first is second
+        assert first == _.foo(a=1)[_.bar.qux].bla[_.bar.qux]
+        foo, bla = first
+        assert foo.selection_set is bla.selection_set
+        assert foo.kwargs is list(quiz.interned(_.x(a=1)))[0].kwargs
+
+    def test_argument_types(self):
+        # equal, but different GraphQL values
+        one, = quiz.interned(_.foo(a=1))
+        true, = quiz.interned(_.foo(a=True))
+        assert type(one.kwargs['a']) is int
+        assert true.kwargs['a'] is True
+
+    def test_fragments_and_query(self):
+        fragment = quiz.FragmentDefinition('F', Dog, _.name)
+        selection_set = SelectionSet(
+            Field('dog', selection_set=SelectionSet(
+                quiz.FragmentSpread(fragment), Dog[_.name])),
+            quiz.Raw('raw'),
+        )
+        query = quiz.Query(DogQuery, selection_set)
+        shared = quiz.interned(query)
+        assert shared == query
+        assert shared is quiz.interned(quiz.Query(DogQuery, selection_set))
+        assert shared.selections is quiz.interned(selection_set)
+        spread, inline = list(shared.selections)[0].selection_set
+        assert spread.fragment.selection_set is inline.selection_set
+
+    def test_unhashable(self, table):
+        field = Field('foo', {'bar': 4})
+        assert quiz.interned(field) is field
+        assert len(table) == 0
+
+
+class TestSelectionSetBuilder:
+
+    def test_same_as_selection_set(self):
+        builder = quiz.SelectionSetBuilder()
+        builder.foo.bar(a=4)('my_alias').qux[_.bing].other
+        assert SelectionSet(*builder) == (
+            _.foo.bar(a=4)('my_alias').qux[_.bing].other)
+        assert len(builder) == 4
+
+    def test_initial(self):
+        builder = quiz.SelectionSetBuilder(Field('foo'))
+        assert SelectionSet(*builder.bar) == _.foo.bar
+        builder = quiz.SelectionSetBuilder(Field('foo'))
+        assert SelectionSet(*builder(a=1)[_.qux]) == _.foo(a=1)[_.qux]
+
+    def test_nested_builder(self):
+        nested = quiz.SelectionSetBuilder().bing.baz
+        builder = quiz.SelectionSetBuilder().foo[nested]
+        assert SelectionSet(*builder) == _.foo[_.bing.baz]
+
+    def test_inspection(self):
+        builder = quiz.SelectionSetBuilder().foo
+        assert not hasattr(builder, '_repr_html_')
+        assert not hasattr(builder, '_ipython_display_')
+        assert not hasattr(builder, '__deepcopy__')
+        assert not hasattr(quiz.SelectionSetBuilder.__new__(
+            quiz.SelectionSetBuilder), 'foo')
+        assert SelectionSet(*builder) == _.foo
+
+    def test_underscore_fields(self):
+        builder = getattr(quiz.SelectionSetBuilder()._id._count(a=1),
+                          '__typename')
+        assert SelectionSet(*builder) == SelectionSet(
+            Field('_id'), Field('_count', {'a': 1}), Field('__typename'))
+
+    def test_many_fields(self):
+        builder = quiz.SelectionSetBuilder()
+        for i in range(1000):
+            getattr(builder, 'field{}'.format(i))(arg=i)
+        selection_set = SelectionSet(*builder)
+        assert len(selection_set) == 1000
+        assert list(selection_set)[-1] == Field('field999', {'arg': 999})
+
+    def test_empty(self):
+        builder = quiz.SelectionSetBuilder()
+        with pytest.raises(quiz.utils.Empty):
+            builder(a=4)
+        with pytest.raises(quiz.utils.Empty):
+            builder[_.foo]
+
+    def test_repr(self):
+        builder = quiz.SelectionSetBuilder().foo
+        assert repr(builder) == '<SelectionSetBuilder> {\n  foo\n}'
+
+
 class TestArgumentAsGql:
 
     def test_string(self):
@@ -287,6 +393,338 @@ class TestQuery:
 
         assert quiz.gql(op) == str(op)
 
+    def test_gql_empty(self):
+        assert quiz.gql(quiz.Query(Dog, quiz.SelectionSet())) == 'query '
+
+    def test_variables(self):
+        op = quiz.Query(
+            Dog,
+            _.knows_command(command=quiz.Variable('cmd')),
+            variable_defs=fdict({'cmd': quiz.Nullable[int]}),
+        )
+        assert gql(op) == dedent('''
+        query ($cmd: Int) {
+          knows_command(command: $cmd)
+        }
+        ''').strip()
+        assert quiz.gql_compact(op) == (
+            'query($cmd:Int){knows_command(command:$cmd)}')
+
+    def test_defaults(self):
+        op = quiz.Query(Dog, _.name)
+        assert op.variable_defs == {}
+
+
+class TestFragments:
+
+    def test_definition(self):
+        fragment = quiz.FragmentDefinition('DogInfo', Dog, _.name.bark_volume)
+        assert gql(fragment) == dedent('''
+        fragment DogInfo on Dog {
+          name
+          bark_volume
+        }
+        ''').strip()
+        assert quiz.gql_compact(fragment) == (
+            'fragment DogInfo on Dog{name bark_volume}')
+        assert str(fragment) == gql(fragment)
+
+    def test_spread(self):
+        fragment = quiz.FragmentDefinition('DogInfo', Dog, _.name)
+        spread = quiz.FragmentSpread(fragment)
+        assert gql(spread) == '...DogInfo'
+        selection_set = SelectionSet(spread, Field('foo'), spread)
+        assert quiz.gql_compact(selection_set) == '{...DogInfo foo...DogInfo}'
+
+    def test_query(self):
+        owner = quiz.FragmentDefinition('OwnerInfo', Human, _.name)
+        dog = quiz.FragmentDefinition(
+            'DogInfo', Dog,
+            _.name.owner[SelectionSet(quiz.FragmentSpread(owner))])
+        query = quiz.Query(Dog, SelectionSet(
+            Field('dog', selection_set=SelectionSet(
+                quiz.FragmentSpread(dog))),
+            Field('other', selection_set=SelectionSet(
+                quiz.FragmentSpread(dog),
+                quiz.FragmentSpread(owner))),
+            quiz.Raw('raw'),
+        ))
+        assert gql(query) == dedent('''
+        query {
+          dog {
+            ...DogInfo
+          }
+          other {
+            ...DogInfo
+            ...OwnerInfo
+          }
+          raw
+        }
+
+        fragment DogInfo on Dog {
+          name
+          owner {
+            ...OwnerInfo
+          }
+        }
+
+        fragment OwnerInfo on Human {
+          name
+        }
+        ''').strip()
+        assert quiz.gql_compact(query) == (
+            'query{dog{...DogInfo}other{...DogInfo...OwnerInfo}raw}'
+            'fragment DogInfo on Dog{name owner{...OwnerInfo}}'
+            'fragment OwnerInfo on Human{name}')
+
+
+class TestMergeQueries:
+
+    def test_simple(self):
+        merged = quiz.merge_queries([
+            quiz.Query(DogQuery, _.dog[_.name]),
+            quiz.Query(DogQuery, _.dog[_.bark_volume]('other').dog[_.name]),
+        ])
+        assert merged == quiz.Query(DogQuery, SelectionSet(
+            Field('dog', selection_set=_.name, alias='q0_dog'),
+            Field('dog', selection_set=_.bark_volume, alias='q1_dog'),
+            Field('dog', selection_set=_.name, alias='q1_other'),
+        ))
+
+    def test_variables(self):
+        nullable_int = quiz.Nullable[int]
+        merged = quiz.merge_queries([
+            quiz.Query(
+                DogQuery,
+                _.dog[_.knows_command(command=quiz.Variable('cmd'))],
+                variable_defs=fdict({'cmd': Command}),
+            ),
+            quiz.Query(
+                DogQuery,
+                _.dog[
+                    _
+                    .knows_command(command=quiz.Variable('cmd'))
+                    .age(on_date=quiz.Variable('date'))
+                ],
+                variable_defs=fdict({'cmd': Command, 'date': nullable_int}),
+            ),
+        ])
+        assert quiz.gql_compact(merged.selections) == (
+            '{q0_dog:dog{knows_command(command:$q0_cmd)}'
+            'q1_dog:dog{knows_command(command:$q1_cmd)age(on_date:$q1_date)}}'
+        )
+        assert merged.variable_defs == {
+            'q0_cmd': Command,
+            'q1_cmd': Command,
+            'q1_date': nullable_int,
+        }
+
+    def test_fragments(self):
+        fragment = quiz.FragmentDefinition('F0', Dog, _.name)
+        inline = quiz.InlineFragment(Dog, SelectionSet(
+            quiz.FragmentSpread(fragment)))
+        merged = quiz.merge_queries([
+            quiz.Query(DogQuery, _.dog[SelectionSet(
+                quiz.FragmentSpread(fragment), inline, quiz.Raw('raw'))]),
+            quiz.Query(DogQuery, _.dog[SelectionSet(
+                quiz.FragmentSpread(fragment))]),
+        ])
+        assert quiz.gql_compact(merged) == (
+            'query{q0_dog:dog{...q0_F0...on Dog{...q0_F0}raw}'
+            'q1_dog:dog{...q1_F0}}'
+            'fragment q0_F0 on Dog{name}'
+            'fragment q1_F0 on Dog{name}')
+
+    def test_empty(self):
+        with pytest.raises(ValueError, match='no queries'):
+            quiz.merge_queries([])
+
+    def test_different_types(self):
+        with pytest.raises(ValueError, match='same type'):
+            quiz.merge_queries([
+                quiz.Query(DogQuery, _.dog[_.name]),
+                quiz.Query(Dog, _.name),
+            ])
+
+    @pytest.mark.parametrize('selection', [
+        quiz.Raw('foo'),
+        quiz.InlineFragment(DogQuery, _.dog[_.name]),
+    ])
+    def test_unsupported_root_selection(self, selection):
+        with pytest.raises(TypeError, match='only field selections'):
+            quiz.merge_queries([
+                quiz.Query(DogQuery, SelectionSet(selection)),
+            ])
+
+
+class TestVariable:
+
+    def test_gql(self):
+        assert quiz.argument_as_gql(quiz.Variable('foo')) == '$foo'
+
+
+class TestTypeAsGql:
+
+    @pytest.mark.parametrize('type_, expect', [
+        (int, 'Int!'),
+        (float, 'Float!'),
+        (bool, 'Boolean!'),
+        (str, 'String!'),
+        (six.text_type, 'String!'),
+        (Dog, 'Dog!'),
+        (quiz.Nullable[Dog], 'Dog'),
+        (quiz.List[int], '[Int!]!'),
+        (quiz.Nullable[quiz.List[quiz.Nullable[Dog]]], '[Dog]'),
+    ])
+    def test_type(self, type_, expect):
+        assert quiz.type_as_gql(type_) == expect
+
+
+class TestGQLCompact:
+
+    def test_simple(self):
+        assert quiz.gql_compact(_.foo.bar.qux) == '{foo bar qux}'
+
+    def test_empty(self):
+        assert quiz.gql_compact(_) == ''
+
+    def test_complex(self):
+        selection_set = (
+            _
+            .foo(a=4)
+            ('my_alias').bar[
+                _
+                .qux
+                .bing[
+                    _
+                    .baz
+                ]
+                .other
+            ]
+            .quux
+            .snafu
+            .fragmented
+        )
+        fragment = InlineFragment(Dog, _.name.bark_volume)
+        selection_set = SelectionSet(*(
+            tuple(selection_set)
+            + (fragment, Field('last'), fragment, quiz.Raw('raw { a }'),
+               Field('after_raw'))))
+        assert quiz.gql_compact(selection_set) == (
+            '{foo(a:4)my_alias:bar{qux bing{baz}other}quux snafu fragmented'
+            '...on Dog{name bark_volume}last...on Dog{name bark_volume}'
+            'raw { a } after_raw}'
+        )
+
+    def test_arguments(self):
+        assert quiz.gql_compact(Field('foo', fdict({'a': 'bla'}))) == (
+            'foo(a:"bla")')
+        assert quiz.gql_compact(_.foo(a=1, b=None)) in [
+            '{foo(a:1 b:null)}',
+            '{foo(b:null a:1)}',
+        ]
+
+    def test_query(self):
+        query = quiz.Query(Dog, _.name.owner[_.name])
+        assert quiz.gql_compact(query) == 'query{name owner{name}}'
+
+    def test_unhashable(self):
+        field = Field('foo', {'bar': 4},
+                      selection_set=SelectionSet(Field('qux', {'a': 1})))
+        assert quiz.gql_compact(field) == 'foo(bar:4){qux(a:1)}'
+
+    def test_cached(self, mocker):
+        cache = quiz.utils.LRUCache()
+        mocker.patch('quiz.build.RENDER_CACHE', cache)
+        assert quiz.gql_compact(_.bar) == '{bar}'
+        assert quiz.gql_compact(_.foo[_.bar]) == '{foo{bar}}'
+        assert quiz.gql_compact(_.foo[_.bar]) == '{foo{bar}}'
+        assert cache.info().hits == 2
+        # pretty and compact renders are cached separately
+        assert gql(_.bar) == '{\n  bar\n}'
+
+
+class TestRenderCache:
+
+    @pytest.fixture(autouse=True)
+    def cache(self, mocker):
+        cache = quiz.utils.LRUCache(maxsize=100)
+        mocker.patch('quiz.build.RENDER_CACHE', cache)
+        return cache
+
+    def test_repeated(self, cache):
+        selection_set = _.foo.bar[_.qux(a=4)]
+        assert gql(selection_set) == gql(_.foo.bar[_.qux(a=4)])
+        assert cache.info().hits == 1
+        assert len(cache) == 2  # including the nested selection set
+
+    def test_nested_stored(self, cache):
+        shared = _.login.url
+        first = gql(_.issues[_.author[shared]])
+        assert cache.info() == (0, 3, 100, 3)
+        assert shared in cache
+        second = gql(_.pulls[_.author[shared]])
+        assert cache.info() == (1, 4, 100, 4)
+        assert second == first.replace('issues', 'pulls')
+        assert gql(shared) == dedent('''
+        {
+          login
+          url
+        }
+        ''').strip()
+
+        assert quiz.gql_compact(_.issues[_.author[shared]]) == (
+            '{issues{author{login url}}}')
+        assert (quiz.gql_compact, shared) in cache
+        assert quiz.gql_compact(_.pulls[_.author[shared]]) == (
+            '{pulls{author{login url}}}')
+
+    def test_nested_multiline_raw(self, cache):
+        selection_set = _.foo[SelectionSet(quiz.Raw('a\n\n  \nb'))]
+        assert gql(selection_set) == gql(selection_set) == (
+            '{\n  foo {\n    a\n\n  \n    b\n  }\n}')
+
+    def test_shared_subselection(self, cache):
+        expect = gql(_.issues[_.author[_.login.url]])
+        cache.clear()
+        gql(_.login.url)
+        assert gql(_.issues[_.author[_.login.url]]) == expect
+        assert cache.info().hits == 1
+        assert expect == dedent('''
+        {
+          issues {
+            author {
+              login
+              url
+            }
+          }
+        }
+        ''').strip()
+
+    def test_argument_types(self, cache):
+        assert gql(_.foo(a=1)) != gql(_.foo(a=True))
+        assert gql(_.foo(a=1.0)) == dedent('''
+        {
+          foo(a: 1.0)
+        }
+        ''').strip()
+
+    def test_unhashable(self, cache):
+        field = Field('foo', {'bar': 4})
+        assert gql(field) == gql(field) == 'foo(bar: 4)'
+        nested = Field('foo', selection_set=SelectionSet(field))
+        assert gql(nested) == dedent('''
+        foo {
+          foo(bar: 4)
+        }
+        ''').strip()
+        assert len(cache) == 0
+
+    def test_disabled(self, cache):
+        cache.resize(0)
+        assert gql(_.foo) == gql(_.foo)
+        assert cache.info().hits == 0
+
 
 class TestEscape:
 
@@ -319,3 +757,23 @@ class TestRaw:
     def test_gql(self):
         raw = quiz.Raw('my raw graphql')
         assert gql(raw) == 'my raw graphql'
+
+    def test_nested(self):
+        selection_set = SelectionSet(
+            Field('foo', selection_set=SelectionSet(
+                quiz.Raw('bar\n\nqux {\n  bla\n}'),
+                quiz.Raw('other'),
+            )),
+        )
+        assert gql(selection_set) == dedent('''
+        {
+          foo {
+            bar
+
+            qux {
+              bla
+            }
+            other
+          }
+        }
+        ''').strip()
@@ -1,14 +1,17 @@
+import hashlib
 import json
 import sys
+from datetime import datetime
 
 import pytest
 import six
 import snug
 
 import quiz
+from quiz.utils import FrozenDict as fdict
 
-from .example import Dog, DogQuery
-from .helpers import MockClient
+from .example import Command, Dog, DogQuery, MyDateTime
+from .helpers import MockClient, PersistedQueryServer
 
 _ = quiz.SELECTOR
 
@@ -69,9 +72,81 @@ class TestExecute:
         assert request.url == 'https://my.url/api'
         assert request.method == 'POST'
         assert json.loads(request.content.decode()) == {
-            'query': quiz.gql(query)}
+            'query': 'query{dog{name bark_volume}}'}
         assert request.headers == {'Content-Type': 'application/json'}
 
+    def test_string_with_variables(self):
+        client = MockClient(snug.Response(200, b'{"data": {"foo": 4}}'))
+        result = quiz.execute('my query', url='https://my.url/api',
+                              variables={'foo': 4}, client=client)
+        assert result == {'foo': 4}
+        assert json.loads(client.request.content.decode()) == {
+            'query': 'my query', 'variables': {'foo': 4}}
+
+    def test_query_with_variables(self):
+        query = quiz.Query(
+            DogQuery,
+            _
+            .dog[
+                _
+                ('sits').knows_command(command=quiz.Variable('cmd'))
+                .age(on_date=quiz.Variable('date'))
+            ],
+            variable_defs=fdict({
+                'cmd': Command,
+                'date': quiz.Nullable[MyDateTime],
+                'numbers': quiz.Nullable[quiz.List[int]],
+            })
+        )
+        client = MockClient(snug.Response(200, json.dumps({
+            'data': {
+                'dog': {
+                    'sits': True,
+                    'age': 3,
+                }
+            }
+        }).encode()))
+        result = quiz.execute(query, url='https://my.url/api', variables={
+            'cmd': Command.SIT,
+            'date': MyDateTime(datetime(1970, 1, 2)),
+            'numbers': [1, 2],
+        }, client=client)
+        assert result == DogQuery(dog=Dog(sits=True, age=3))
+        assert json.loads(client.request.content.decode()) == {
+            'query': quiz.gql_compact(query),
+            'variables': {
+                'cmd': 'SIT',
+                'date': 86400,
+                'numbers': [1, 2],
+            }
+        }
+
+    def test_query_unhashable_arguments(self):
+        query = quiz.Query(
+            DogQuery,
+            _.dog[_.age(on_date=MyDateTime(datetime(1970, 1, 2)))],
+        )
+        client = MockClient(snug.Response(200, json.dumps({
+            'data': {'dog': {'age': 3}}
+        }).encode()))
+        for _attempt in range(2):
+            result = quiz.execute(query, url='https://my.url/api',
+                                  client=client)
+            assert result == DogQuery(dog=Dog(age=3))
+
+    def test_invalid_variables(self):
+        query = quiz.Query(
+            DogQuery,
+            _.dog[_.knows_command(command=quiz.Variable('cmd'))],
+            variable_defs=fdict({'cmd': Command}),
+        )
+        client = MockClient(snug.Response(200, b'{}'))
+        with pytest.raises(quiz.MissingArgument):
+            quiz.execute(query, url='https://my.url/api', client=client)
+        with pytest.raises(quiz.InvalidArgumentType):
+            quiz.execute(query, url='https://my.url/api', client=client,
+                         variables={'cmd': 'SIT'})
+
     def test_errors(self):
         client = MockClient(snug.Response(200, json.dumps({
             'data': {'foo': 4},
@@ -104,12 +179,269 @@ class TestExecute:
         )
 
 
+class TestExecutePersisted:
+
+    def test_local_server(self):
+        query = quiz.Query(DogQuery, _.dog[_.name.bark_volume])
+        data = {'dog': {'name': 'Fred', 'bark_volume': 8}}
+        with PersistedQueryServer(data) as server:
+            for _i in range(3):
+                result = quiz.execute(query, url=server.url, persisted=True)
+                assert result == DogQuery(
+                    dog=Dog(name='Fred', bark_volume=8))
+
+        digest = hashlib.sha256(
+            quiz.gql_compact(query).encode()).hexdigest()
+        extensions = {'persistedQuery': {'version': 1, 'sha256Hash': digest}}
+        assert server.received == [
+            {'extensions': extensions},
+            {'extensions': extensions, 'query': quiz.gql_compact(query)},
+            {'extensions': extensions},
+            {'extensions': extensions},
+        ]
+
+    def test_variables(self):
+        client = MockClient(snug.Response(200, b'{"data": {"foo": 4}}'))
+        result = quiz.execute('my query', url='https://my.url/api',
+                              variables={'foo': 4}, persisted=True,
+                              client=client)
+        assert result == {'foo': 4}
+        content = json.loads(client.request.content.decode())
+        assert content['variables'] == {'foo': 4}
+        assert 'query' not in content
+
+    @pytest.mark.parametrize('error', [
+        {'message': 'PersistedQueryNotSupported'},
+        {'message': 'foo', 'extensions': {
+            'code': 'PERSISTED_QUERY_NOT_FOUND'}},
+    ])
+    def test_fallback(self, error):
+        client = MockClient(snug.Response(
+            200, json.dumps({'errors': [error]}).encode()))
+        with pytest.raises(quiz.ErrorResponse):
+            quiz.execute('my query', url='https://my.url/api',
+                         persisted=True, client=client)
+        content = json.loads(client.request.content.decode())
+        assert content['query'] == 'my query'
+
+    def test_errors(self):
+        client = MockClient(snug.Response(200, json.dumps({
+            'errors': [{'message': 'foo'}, {'extensions': None}]
+        }).encode()))
+        with pytest.raises(quiz.ErrorResponse):
+            quiz.execute('my query', url='https://my.url/api',
+                         persisted=True, client=client)
+        assert 'query' not in json.loads(client.request.content.decode())
+
+
 def test_executor():
     executor = quiz.executor(url='https://my.url/graphql')
     assert executor.func is quiz.execute
     assert executor.keywords['url'] == 'https://my.url/graphql'
 
 
+class TestExecuteMerged:
+
+    def test_success(self):
+        queries = [
+            quiz.Query(DogQuery, _.dog[_.name]),
+            quiz.Query(
+                DogQuery,
+                _('dog').dog[_.knows_command(command=quiz.Variable('cmd'))],
+                variable_defs=fdict({'cmd': Command}),
+            ),
+        ]
+        client = MockClient(snug.Response(200, json.dumps({
+            'data': {
+                'q0_dog': {'name': 'Fred'},
+                'q1_dog': {'knows_command': True},
+            }
+        }).encode()))
+        results = quiz.execute_merged(
+            queries, url='https://my.url/api', client=client,
+            variables=[{}, {'cmd': Command.SIT}])
+        assert results == [
+            DogQuery(dog=Dog(name='Fred')),
+            DogQuery(dog=Dog(knows_command=True)),
+        ]
+        assert json.loads(client.request.content.decode()) == {
+            'query': quiz.gql_compact(quiz.merge_queries(queries)),
+            'variables': {'q1_cmd': 'SIT'},
+        }
+
+    def test_errors(self):
+        queries = [
+            quiz.Query(DogQuery, _.dog[_.name]),
+            quiz.Query(DogQuery, _('a').dog[_.name]('b').dog[_.name]),
+            quiz.Query(DogQuery, _.dog[_.bark_volume]),
+        ]
+        client = MockClient(snug.Response(200, json.dumps({
+            'data': {
+                'q0_dog': {'name': 'Fred'},
+                'q1_a': None,
+                'q1_b': {'name': 'Bob'},
+                'q2_dog': {'bark_volume': 3},
+            },
+            'errors': [
+                {'message': 'foo', 'path': ['q1_a', 'name']},
+                {'message': 'bar', 'path': ['q2_dog', 'bark_volume']},
+            ]
+        }).encode()))
+        results = quiz.execute_merged(queries, url='https://my.url/api',
+                                      client=client)
+        assert results == [
+            DogQuery(dog=Dog(name='Fred')),
+            quiz.ErrorResponse(
+                data={'a': None, 'b': {'name': 'Bob'}},
+                errors=[{'message': 'foo', 'path': ['a', 'name']}]),
+            quiz.ErrorResponse(
+                data={'dog': {'bark_volume': 3}},
+                errors=[{'message': 'bar', 'path': ['dog', 'bark_volume']}]),
+        ]
+
+    def test_errors_without_path(self):
+        queries = [
+            quiz.Query(DogQuery, _.dog[_.name]),
+            quiz.Query(DogQuery, _.dog[_.name]),
+        ]
+        client = MockClient(snug.Response(200, json.dumps({
+            'data': None,
+            'errors': [{'message': 'foo'}],
+        }).encode()))
+        results = quiz.execute_merged(queries, url='https://my.url/api',
+                                      client=client)
+        assert results == [
+            quiz.ErrorResponse(data={}, errors=[{'message': 'foo'}]),
+        ] * 2
+
+    def test_missing_data(self):
+        # the errors of one query may nullify the data of another
+        queries = [
+            quiz.Query(DogQuery, _.dog[_.name]),
+            quiz.Query(DogQuery, _.dog[_.name]),
+        ]
+        error = {'message': 'foo', 'path': ['q0_dog', 'name']}
+        client = MockClient(snug.Response(200, json.dumps({
+            'data': None,
+            'errors': [error],
+        }).encode()))
+        results = quiz.execute_merged(queries, url='https://my.url/api',
+                                      client=client)
+        assert results == [
+            quiz.ErrorResponse(data={}, errors=[
+                {'message': 'foo', 'path': ['dog', 'name']}]),
+            quiz.ErrorResponse(data={}, errors=[error]),
+        ]
+
+    def test_invalid_variables(self):
+        query = quiz.Query(
+            DogQuery,
+            _.dog[_.knows_command(command=quiz.Variable('cmd'))],
+            variable_defs=fdict({'cmd': Command}),
+        )
+        client = MockClient(snug.Response(200, b'{}'))
+        with pytest.raises(quiz.MissingArgument):
+            quiz.execute_merged([query], url='https://my.url/api',
+                                client=client)
+        with pytest.raises(ValueError, match='more variable'):
+            quiz.execute_merged([query], url='https://my.url/api',
+                                client=client, variables=[{}, {}])
+
+
+class TestExecuteBatch:
+
+    def test_success(self):
+        query = quiz.Query(
+            DogQuery,
+            _.dog[_.knows_command(command=quiz.Variable('cmd'))],
+            variable_defs=fdict({'cmd': Command}),
+        )
+        client = MockClient(snug.Response(200, json.dumps([
+            {'data': {'foo': 4}},
+            {'data': {'dog': {'knows_command': True}}},
+            {'data': {'bar': None}, 'errors': [{'message': 'bar'}]},
+        ]).encode()))
+        results = quiz.execute_batch(
+            ['my query', query, 'other query'],
+            url='https://my.url/api',
+            variables=[{}, {'cmd': Command.SIT}],
+            client=client)
+        assert results == [
+            {'foo': 4},
+            DogQuery(dog=Dog(knows_command=True)),
+            quiz.ErrorResponse(data={'bar': None},
+                               errors=[{'message': 'bar'}]),
+        ]
+        assert json.loads(client.request.content.decode()) == [
+            {'query': 'my query'},
+            {'query': quiz.gql_compact(query), 'variables': {'cmd': 'SIT'}},
+            {'query': 'other query'},
+        ]
+
+    def test_batch_rejected(self):
+        client = MockClient(snug.Response(200, json.dumps({
+            'errors': [{'message': 'batching not supported'}],
+        }).encode()))
+        with pytest.raises(quiz.ErrorResponse) as exc:
+            quiz.execute_batch(['a', 'b'], url='https://my.url/api',
+                               client=client)
+        assert exc.value == quiz.ErrorResponse(
+            data={}, errors=[{'message': 'batching not supported'}])
+
+    def test_missing_results(self):
+        client = MockClient(snug.Response(200, json.dumps([
+            {'data': {'foo': 4}},
+        ]).encode()))
+        with pytest.raises(quiz.ErrorResponse) as exc:
+            quiz.execute_batch(['a', 'b'], url='https://my.url/api',
+                               client=client)
+        assert exc.value == quiz.ErrorResponse(data={}, errors=[{
+            'message': 'expected 2 results in batch response, got 1'}])
+
+    def test_invalid(self):
+        query = quiz.Query(
+            DogQuery,
+            _.dog[_.knows_command(command=quiz.Variable('cmd'))],
+            variable_defs=fdict({'cmd': Command}),
+        )
+        client = MockClient(snug.Response(200, b'[]'))
+        with pytest.raises(quiz.MissingArgument):
+            quiz.execute_batch(['a', query], url='https://my.url/api',
+                               client=client)
+        with pytest.raises(ValueError, match='more variable'):
+            quiz.execute_batch(['a'], url='https://my.url/api',
+                               variables=[{}, {}], client=client)
+        with pytest.raises(ValueError, match='chunk size'):
+            quiz.execute_batch(['a'], url='https://my.url/api',
+                               chunk_size=0, client=client)
+        assert not hasattr(client, 'request')
+
+    def test_chunks_and_persisted(self):
+        query = quiz.Query(DogQuery, _.dog[_.name])
+        data = {'dog': {'name': 'Fred'}}
+        with PersistedQueryServer(data) as server:
+            results = quiz.execute_batch([query] * 5, url=server.url,
+                                         persisted=True, chunk_size=2)
+        assert results == [DogQuery(dog=Dog(name='Fred'))] * 5
+
+        digest = hashlib.sha256(
+            quiz.gql_compact(query).encode()).hexdigest()
+        hashed = {'extensions': {
+            'persistedQuery': {'version': 1, 'sha256Hash': digest}}}
+        full = dict(hashed, query=quiz.gql_compact(query))
+        assert server.received == [
+            [hashed, hashed],
+            [full, full],
+            [hashed, hashed],
+            [hashed],
+        ]
+
+    def test_empty(self):
+        with pytest.raises(ValueError, match='no operations'):
+            quiz.execute_batch([], url='https://my.url/api',
+                               client=MockClient(None))
+
+
 @py3
 class TestExecuteAsync:
 
@@ -160,9 +492,16 @@ class TestExecuteAsync:
         assert request.url == 'https://my.url/api'
         assert request.method == 'POST'
         assert json.loads(request.content.decode()) == {
-            'query': quiz.gql(query)}
+            'query': 'query{dog{name bark_volume}}'}
         assert request.headers == {'Content-Type': 'application/json'}
 
+    def test_persisted(self, event_loop):
+        client = MockClient(snug.Response(200, b'{"data": {"foo": 4}}'))
+        future = quiz.execute_async('my query', url='https://my.url/api',
+                                    persisted=True, client=client)
+        assert event_loop.run_until_complete(future) == {'foo': 4}
+        assert 'query' not in json.loads(client.request.content.decode())
+
     def test_errors(self, event_loop):
         client = MockClient(snug.Response(200, json.dumps({
             'data': {'foo': 4},
@@ -176,6 +515,35 @@ class TestExecuteAsync:
         assert exc.value == quiz.ErrorResponse({'foo': 4},
                                                [{'message': 'foo'}])
 
+    def test_merged(self, event_loop):
+        queries = [
+            quiz.Query(DogQuery, _.dog[_.name]),
+            quiz.Query(DogQuery, _.dog[_.bark_volume]),
+        ]
+        client = MockClient(snug.Response(200, json.dumps({
+            'data': {
+                'q0_dog': {'name': 'Fred'},
+                'q1_dog': {'bark_volume': 3},
+            }
+        }).encode()))
+        future = quiz.execute_merged_async(queries, url='https://my.url/api',
+                                           client=client)
+        assert event_loop.run_until_complete(future) == [
+            DogQuery(dog=Dog(name='Fred')),
+            DogQuery(dog=Dog(bark_volume=3)),
+        ]
+
+    def test_batch(self, event_loop):
+        client = MockClient(snug.Response(200, json.dumps([
+            {'data': {'foo': 4}},
+            {'data': {'bar': 5}},
+        ]).encode()))
+        future = quiz.execute_batch_async(['a', 'b'], persisted=True,
+                                          url='https://my.url/api',
+                                          client=client)
+        assert event_loop.run_until_complete(future) == [
+            {'foo': 4}, {'bar': 5}]
+
 
 @py3
 def test_async_executor():
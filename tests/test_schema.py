@@ -1,8 +1,10 @@
+import copy
 import enum
 import json
 import pickle
 import pydoc
 import sys
+import time
 import types
 
 import pytest
@@ -13,7 +15,16 @@ import quiz
 from quiz import SELECTOR as _
 from quiz import schema as s
 
-from .helpers import MockClient
+from .helpers import (FlakyIntrospectionClient, IntrospectionClient,
+                      MockClient, describe_schema)
+
+py3 = pytest.mark.skipif(sys.version_info < (3, ), reason='python 3+ only')
+
+
+if six.PY3:
+    import asyncio
+    snug.send_async.register(IntrospectionClient,
+                             asyncio.coroutine(IntrospectionClient.send))
 
 
 def trim_whitespace(txt):
@@ -258,6 +269,13 @@ class TestSchemaFromRaw:
         assert schema.subscription_type is None
         assert schema.raw == raw_schema
 
+    @pytest.mark.parametrize('lazy', [True, False])
+    def test_unknown_kind(self, raw_schema, lazy):
+        raw = dict(raw_schema, types=raw_schema['types'] + [
+            {'kind': 'FOO', 'name': 'Foo', 'description': None}])
+        with pytest.raises(NotImplementedError, match='FOO'):
+            quiz.Schema.from_raw(raw, lazy=lazy).Foo
+
 
 class TestSchema:
 
@@ -310,6 +328,39 @@ class TestSchema:
         with pytest.raises(quiz.SelectionError):
             schema.query[_.foo]
 
+    def test_query_fragment_spread(self, schema):
+        actor = quiz.FragmentDefinition('ActorInfo', schema.Actor, _.login)
+        user = quiz.FragmentDefinition('UserInfo', schema.User, _.name)
+        query = schema.query[_.viewer[quiz.SelectionSet(
+            quiz.FragmentSpread(actor), quiz.FragmentSpread(user))]]
+        assert 'fragment ActorInfo on Actor' in str(query)
+        with pytest.raises(quiz.SelectionError):
+            schema.query[_.license(key='MIT')[quiz.SelectionSet(
+                quiz.FragmentSpread(user))]]
+
+    def test_query_interned(self, schema):
+        selection_set = _.license(key='MIT')[_.name]
+        assert schema.query[selection_set] is schema.query[selection_set]
+
+    def test_query_variables(self, schema):
+        query = schema.query[
+            _
+            .license(key=quiz.Variable('key'))[
+                _
+                .name
+            ]
+        ]
+        assert query.variable_defs == {'key': str}
+        assert query == schema.query[
+            _
+            .license(key=quiz.Variable('key'))[
+                _
+                .name
+            ]
+        ]
+        assert quiz.gql_compact(query) == (
+            'query($key:String!){license(key:$key){name}}')
+
     def test_to_path(self, schema, tmpdir):
 
         path = str(tmpdir / 'myschema.json')
@@ -324,6 +375,301 @@ class TestSchema:
         assert loaded.classes.keys() == schema.classes.keys()
 
 
+class TestLazy:
+
+    def test_classes_created_when_used(self, raw_schema):
+        schema = quiz.Schema.from_raw(raw_schema, lazy=True, module='foo')
+        created = set(schema.classes._created)
+        assert 'Query' in created
+        assert 'Repository' in created  # referred to by a field of Query
+        assert 'Issue' not in created
+        assert '__pending_fields__' in vars(
+            schema.classes._created['Repository'])
+        assert '__pending_fields__' not in vars(schema.Repository)
+
+        query = schema.query[
+            _
+            .repository(owner='octocat', name='hello-world')[
+                _
+                .issues(first=1)[
+                    _.nodes[_.number]
+                ]
+            ]
+        ]
+        assert 'Issue' in schema.classes._created
+        assert schema.classes['Issue'].__module__ == 'foo'
+        response = {'repository': {'issues': {'nodes': [{'number': 4}]}}}
+        loaded = quiz.load(schema.Query, query.selections, response)
+        assert loaded.repository.issues.nodes[0].number == 4
+
+    def test_same_as_eager(self, raw_schema, schema):
+
+        class URI(quiz.Scalar):
+            pass
+
+        class Unused(quiz.Scalar):
+            pass
+
+        lazy = quiz.Schema.from_raw(raw_schema, lazy=True, module='mymodule',
+                                    scalars=[URI, Unused])
+        eager = quiz.Schema.from_raw(raw_schema, module='mymodule',
+                                     scalars=[URI, Unused])
+        assert len(lazy.classes) == len(eager.classes)
+        assert set(lazy.classes) == set(eager.classes)
+        assert lazy.Unused is Unused
+        assert lazy.URI is URI
+        assert describe_schema(lazy) == describe_schema(eager)
+        assert 'Repository' in dir(lazy)
+
+    def test_unknown(self, raw_schema):
+        schema = quiz.Schema.from_raw(raw_schema, lazy=True)
+        with pytest.raises(AttributeError):
+            schema.Foo
+
+    def test_from_path(self, raw_schema, tmpdir):
+        path = str(tmpdir / 'schema.json')
+        with open(path, 'w') as wfile:
+            json.dump(raw_schema, wfile)
+        schema = quiz.Schema.from_path(path, lazy=True)
+        assert 'Issue' not in schema.classes._created
+        assert schema.Issue
+
+
+class TestOnDemand:
+
+    def test_types_retrieved_when_used(self, raw_schema):
+        client = IntrospectionClient(raw_schema)
+        schema = quiz.Schema.from_url_on_demand(
+            'https://my.url/graphql', client=client, module='foo')
+        # the directory and the root types
+        assert len(client.queries) == 2
+        assert '__schema' in client.queries[0]
+        assert {conf['name'] for conf in schema.raw['types']} == {
+            'Query', 'Mutation'}
+        assert schema.raw['queryType'] == raw_schema['queryType']
+        assert schema.raw['mutationType'] == raw_schema['mutationType']
+        assert schema.raw['subscriptionType'] is None
+
+        query = schema.query[
+            _
+            .repository(owner='octocat', name='hello-world')[
+                _
+                .issues(first=1)[
+                    _.nodes[_.number]
+                ]
+            ]
+        ]
+        retrieved = [conf['name'] for conf in schema.raw['types']]
+        assert 'Repository' in retrieved
+        assert 'IssueConnection' in retrieved
+        assert schema.classes['Issue'].__module__ == 'foo'
+        response = {'repository': {'issues': {'nodes': [{'number': 4}]}}}
+        loaded = quiz.load(schema.Query, query.selections, response)
+        assert loaded.repository.issues.nodes[0].number == 4
+
+        # types are retrieved only once
+        retrieved = [conf['name'] for conf in schema.raw['types']]
+        assert len(retrieved) == len(set(retrieved))
+        assert len(retrieved) < len(raw_schema['types'])
+
+    def test_retry_after_failure(self, raw_schema):
+        client = FlakyIntrospectionClient(raw_schema)
+        schema = quiz.Schema.from_url_on_demand(
+            'https://my.url/graphql', client=client)
+
+        # fail while retrieving the types of the fields of ``Query``
+        client.failing = True
+        with pytest.raises(quiz.HTTPError):
+            schema.query[_.viewer[_.login]]
+
+        client.failing = False
+        assert schema.query[_.viewer[_.login]]
+
+    def test_same_as_eager(self, raw_schema):
+
+        class URI(quiz.Scalar):
+            pass
+
+        on_demand = quiz.Schema.from_url_on_demand(
+            'https://my.url/graphql', client=IntrospectionClient(raw_schema),
+            module='mymodule', scalars=[URI])
+        eager = quiz.Schema.from_raw(raw_schema, module='mymodule',
+                                     scalars=[URI])
+        assert set(on_demand.classes) == set(eager.classes)
+        assert describe_schema(on_demand) == describe_schema(eager)
+        assert on_demand.URI is URI
+
+    def test_batches(self, raw_schema):
+        client = IntrospectionClient(raw_schema)
+        schema = quiz.Schema.from_url_on_demand(
+            'https://my.url/graphql', client=client, batch_size=2)
+        assert all(query.count('__type(') <= 2
+                   for query in client.queries)
+        assert max(query.count('__type(') for query in client.queries) == 2
+        assert schema.Repository
+
+    def test_unknown(self, raw_schema):
+        client = IntrospectionClient(raw_schema)
+        schema = quiz.Schema.from_url_on_demand(
+            'https://my.url/graphql', client=client)
+        count = len(client.queries)
+        with pytest.raises(AttributeError):
+            schema.Foo
+        assert len(client.queries) == count
+
+    def test_slim(self, raw_schema):
+        client = IntrospectionClient(raw_schema)
+        quiz.Schema.from_url_on_demand(
+            'https://my.url/graphql', client=client, descriptions=False,
+            deprecated=False, default_values=False)
+        assert not any('description' in q for q in client.queries)
+        assert 'includeDeprecated: false' in client.queries[-1]
+
+    def test_fails(self):
+        client = MockClient(
+            snug.Response(200, json.dumps({'data': {'__schema': None},
+                                           'errors': 'foo'}).encode()))
+        with pytest.raises(quiz.ErrorResponse):
+            quiz.Schema.from_url_on_demand('https://my.url/graphql',
+                                           client=client)
+
+
+class TestSnapshot:
+
+    def test_roundtrip(self, schema):
+        data = schema.to_snapshot()
+        assert isinstance(data, bytes)
+        loaded = quiz.Schema.from_snapshot(data, module='mymodule')
+        # the raw schema is decoded only once needed
+        assert loaded._raw._decoded is None
+        assert loaded.query_type is loaded.Query
+        assert loaded.mutation_type is loaded.Mutation
+        assert loaded.subscription_type is None
+        assert loaded._raw._decoded is None
+        assert loaded.raw == schema.raw
+        assert loaded.raw is loaded.raw
+        assert loaded.module == 'mymodule'
+        assert describe_schema(loaded) == describe_schema(schema)
+        assert loaded.Repository.__module__ == 'mymodule'
+        assert loaded.query[_.viewer[_.login]] == quiz.Query(
+            loaded.Query, _.viewer[_.login])
+
+    def test_scalars(self, schema):
+
+        class URI(quiz.Scalar):
+            pass
+
+        loaded = quiz.Schema.from_snapshot(schema.to_snapshot(),
+                                           scalars=[URI])
+        assert loaded.URI is URI
+        assert loaded.Repository.url.type is URI
+        assert issubclass(loaded.DateTime, quiz.GenericScalar)
+        assert loaded.String is str
+        assert loaded.module is None
+
+    def test_digest(self, schema, raw_schema):
+        digest = quiz.schema_digest(raw_schema)
+        reordered = json.loads(json.dumps(raw_schema, sort_keys=True))
+        assert quiz.schema_digest(reordered) == digest
+        data = schema.to_snapshot()
+        assert quiz.Schema.from_snapshot(data, digest=digest)
+
+        with pytest.raises(quiz.SnapshotError, match='another schema'):
+            quiz.Schema.from_snapshot(data, digest='foo')
+
+    @pytest.mark.parametrize('corrupt', [
+        lambda d: d[:len(d) // 2],
+        lambda d: d[:-1] + b'x' if d[-1:] != b'x' else d[:-1] + b'y',
+    ])
+    def test_corrupted(self, schema, corrupt):
+        with pytest.raises(quiz.SnapshotError, match='corrupted'):
+            quiz.Schema.from_snapshot(corrupt(schema.to_snapshot()))
+
+    def test_not_a_snapshot(self, raw_schema):
+        with pytest.raises(quiz.SnapshotError, match='not a schema'):
+            quiz.Schema.from_snapshot(json.dumps(raw_schema).encode())
+
+    def test_other_version(self, schema, mocker):
+        data = schema.to_snapshot()
+        mocker.patch('quiz.schema.__version__', '0.0.1')
+        with pytest.raises(quiz.SnapshotError, match='another version'):
+            quiz.Schema.from_snapshot(data)
+
+
+class URI(quiz.Scalar):
+    """an importable custom scalar"""
+
+
+@pytest.fixture
+def load_module(tmpdir, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmpdir))
+    names = []
+
+    def load(schema, name):
+        schema.to_module(tmpdir / name + '.py')
+        names.append(name)
+        return quiz.Schema.from_module(name)
+
+    yield load
+    for name in names:
+        sys.modules.pop(name, None)
+
+
+class TestModule:
+
+    def test_roundtrip(self, raw_schema, load_module):
+        schema = quiz.Schema.from_raw(raw_schema, scalars=[URI])
+        loaded = load_module(schema, 'my_github_schema')
+        assert describe_schema(loaded) == describe_schema(schema)
+        # the raw schema is decoded only once needed
+        assert loaded._raw._decoded is None
+        assert loaded.raw == raw_schema
+        assert loaded.raw is loaded.raw
+        assert loaded.replace(module='foo').raw is loaded.raw
+        assert loaded.module == 'my_github_schema'
+        assert loaded.Repository.__module__ == 'my_github_schema'
+        assert loaded.URI is URI
+        assert loaded.String is str
+        assert loaded.query[_.viewer[_.login]] == quiz.Query(
+            loaded.Query, _.viewer[_.login])
+        instance = loaded.Repository(name='foo')
+        assert pickle.loads(pickle.dumps(instance)) == instance
+
+    def test_names_not_identifiers(self, load_module):
+
+        class Query(quiz.Object):
+            pass
+
+        Query.id = quiz.FieldDefinition(
+            'id', 'the ID', type=int, args=quiz.utils.FrozenDict({}),
+            is_deprecated=False, deprecation_reason=None)
+        setattr(Query, 'from', quiz.FieldDefinition(
+            'from', None, type=quiz.Nullable[quiz.List[URI]],
+            args=quiz.utils.FrozenDict({
+                'in': quiz.InputValue('in', 'input', type=quiz.List[int]),
+            }),
+            is_deprecated=True, deprecation_reason=u'\u2603'))
+        schema = quiz.Schema(
+            classes={'Query': Query, 'URI': URI, 'Int': int},
+            query_type=Query, mutation_type=None, subscription_type=None,
+            module=None, raw={})
+        loaded = load_module(schema, 'my_tiny_schema')
+        assert describe_schema(loaded) == describe_schema(schema)
+        assert getattr(loaded.Query, 'from').deprecation_reason == u'\u2603'
+
+    def test_does_not_exist(self):
+        with pytest.raises(ImportError):
+            quiz.Schema.from_module('quiz.does_not_exist')
+
+    def test_raw_equality(self):
+        text = s._JSONText('{"foo": [1, 2]}')
+        assert text == {'foo': [1, 2]}
+        assert {'foo': [1, 2]} == text
+        assert text == s._JSONText('{"foo": [1, 2]}')
+        assert text != s._JSONText('{"foo": []}')
+        assert not text != {'foo': [1, 2]}
+
+
 class TestSchemaFromUrl:
 
     def test_success(self, raw_schema):
@@ -347,6 +693,22 @@ class TestSchemaFromUrl:
             quiz.Schema.from_url('https://my.url/graphql',
                                  client=client)
 
+    def test_http_error(self):
+        client = MockClient(snug.Response(500, b'oops'))
+        with pytest.raises(quiz.HTTPError):
+            quiz.Schema.from_url('https://my.url/graphql', client=client)
+
+    @py3
+    def test_async(self, raw_schema, event_loop):
+        client = IntrospectionClient(raw_schema)
+        future = quiz.Schema.from_url_async(
+            'https://my.url/graphql', client=client, lazy=True)
+        result = event_loop.run_until_complete(future)
+        assert isinstance(result, quiz.Schema)
+        assert result.raw == raw_schema
+        assert 'Issue' not in result.classes._created
+        assert client.requests[0].url == 'https://my.url/graphql'
+
     @pytest.mark.live
     def test_live(self):
         schema = quiz.Schema.from_url(
@@ -354,6 +716,576 @@ class TestSchemaFromUrl:
         assert schema.Starship
 
 
+def with_query_description(raw_schema, description):
+    return dict(raw_schema, types=[
+        dict(conf, description=description) if conf['name'] == 'Query'
+        else conf
+        for conf in raw_schema['types']
+    ])
+
+
+class TestSchemaCache:
+
+    def test_creates_directory(self, tmpdir):
+        quiz.SchemaCache(tmpdir / 'foo' / 'bar')
+        assert (tmpdir / 'foo' / 'bar').isdir()
+
+    def test_fresh(self, raw_schema, tmpdir):
+        client = IntrospectionClient(raw_schema)
+        cache = quiz.SchemaCache(tmpdir, ttl=60)
+        schema = quiz.Schema.from_url('https://my.url/graphql',
+                                      client=client, cache=cache)
+        assert len(client.requests) == 1
+        assert schema.raw == raw_schema
+        assert quiz.Schema.from_url('https://my.url/graphql',
+                                    client=client, cache=cache) is schema
+        assert len(client.requests) == 1
+
+        # other processes use the stored result
+        other = quiz.Schema.from_url('https://my.url/graphql', client=client,
+                                     cache=quiz.SchemaCache(tmpdir, ttl=60))
+        assert len(client.requests) == 1
+        assert other.raw == raw_schema
+        assert describe_schema(other) == describe_schema(schema)
+
+    def test_options(self, raw_schema, tmpdir):
+        client = IntrospectionClient(raw_schema)
+        cache = quiz.SchemaCache(tmpdir, ttl=60)
+        schema = quiz.Schema.from_url('https://my.url/graphql',
+                                      client=client, cache=cache)
+        lazy = quiz.Schema.from_url('https://my.url/graphql', lazy=True,
+                                    client=client, cache=cache)
+        with_uri = quiz.Schema.from_url('https://my.url/graphql',
+                                        scalars=[URI], client=client,
+                                        cache=cache)
+        assert len(client.requests) == 1
+        assert len({id(schema), id(lazy), id(with_uri)}) == 3
+        assert with_uri.URI is URI
+        assert 'Issue' not in lazy.classes._created
+
+    def test_keyed_by_url_and_query(self, raw_schema, tmpdir):
+        client = IntrospectionClient(raw_schema)
+        cache = quiz.SchemaCache(tmpdir, ttl=60)
+        quiz.Schema.from_url('https://my.url/graphql',
+                             client=client, cache=cache)
+        quiz.Schema.from_url('https://other.url/graphql',
+                             client=client, cache=cache)
+        quiz.Schema.from_url('https://my.url/graphql',
+                             introspection=quiz.introspection_query(
+                                 descriptions=False),
+                             client=client, cache=cache)
+        assert len(client.requests) == 3
+        # the client returns the same raw schema to each query,
+        # which is stored only once.
+        assert len(tmpdir.listdir()) == 4
+
+    def test_revalidate_etag(self, raw_schema, tmpdir):
+        client = IntrospectionClient(raw_schema, etag='"v1"')
+        cache = quiz.SchemaCache(tmpdir, ttl=0)
+        schema = quiz.Schema.from_url('https://my.url/graphql',
+                                      client=client, cache=cache)
+        assert 'If-None-Match' not in client.requests[0].headers
+
+        assert quiz.Schema.from_url('https://my.url/graphql',
+                                    client=client, cache=cache) is schema
+        assert client.requests[1].headers['If-None-Match'] == '"v1"'
+
+        client.raw_schema = with_query_description(raw_schema, 'changed')
+        client.etag = '"v2"'
+        changed = quiz.Schema.from_url('https://my.url/graphql',
+                                       client=client, cache=cache)
+        assert changed.Query.__doc__ == 'changed'
+        assert quiz.Schema.from_url('https://my.url/graphql',
+                                    client=client, cache=cache) is changed
+        assert client.requests[3].headers['If-None-Match'] == '"v2"'
+
+    def test_revalidate_digest(self, raw_schema, tmpdir):
+        client = IntrospectionClient(raw_schema)
+        cache = quiz.SchemaCache(tmpdir, ttl=0)
+        schema = quiz.Schema.from_url('https://my.url/graphql',
+                                      client=client, cache=cache)
+        assert quiz.Schema.from_url('https://my.url/graphql',
+                                    client=client, cache=cache) is schema
+        assert len(client.requests) == 2
+        assert 'If-None-Match' not in client.requests[1].headers
+
+        client.raw_schema = with_query_description(raw_schema, 'changed')
+        changed = quiz.Schema.from_url('https://my.url/graphql',
+                                       client=client, cache=cache)
+        assert changed is not schema
+        assert changed.Query.__doc__ == 'changed'
+        # the schema is updated incrementally
+        assert changed.Repository is schema.Repository
+
+        # the changed result is stored
+        client = IntrospectionClient(raw_schema)
+        stored = quiz.Schema.from_url('https://my.url/graphql', client=client,
+                                      cache=quiz.SchemaCache(tmpdir))
+        assert stored.Query.__doc__ == 'changed'
+        assert not client.requests
+
+    def test_lazy_schema_rebuilt(self, raw_schema, tmpdir):
+        client = IntrospectionClient(raw_schema)
+        cache = quiz.SchemaCache(tmpdir, ttl=0)
+        schema = quiz.Schema.from_url('https://my.url/graphql', lazy=True,
+                                      client=client, cache=cache)
+        client.raw_schema = with_query_description(raw_schema, 'changed')
+        changed = quiz.Schema.from_url('https://my.url/graphql', lazy=True,
+                                       client=client, cache=cache)
+        assert changed.Query.__doc__ == 'changed'
+        assert changed.Repository is not schema.Repository
+
+    def test_stale(self, raw_schema, tmpdir, mocker):
+        client = IntrospectionClient(raw_schema)
+        cache = quiz.SchemaCache(tmpdir, ttl=60)
+        now = time.time()
+        mocker.patch('time.time', return_value=now)
+        quiz.Schema.from_url('https://my.url/graphql',
+                             client=client, cache=cache)
+        mocker.patch('time.time', return_value=now + 59)
+        quiz.Schema.from_url('https://my.url/graphql',
+                             client=client, cache=cache)
+        assert len(client.requests) == 1
+        mocker.patch('time.time', return_value=now + 61)
+        quiz.Schema.from_url('https://my.url/graphql',
+                             client=client, cache=cache)
+        assert len(client.requests) == 2
+
+    def test_invalid_files(self, raw_schema, tmpdir):
+        client = IntrospectionClient(raw_schema)
+        quiz.Schema.from_url('https://my.url/graphql', client=client,
+                             cache=quiz.SchemaCache(tmpdir))
+        raw_path, = tmpdir.listdir('schema-*')
+        meta_path, = set(tmpdir.listdir()) - {raw_path}
+        for path, content in [(meta_path, '{"foo": '),
+                              (meta_path, '{"foo": 4}'),
+                              (raw_path, '{"foo": ')]:
+            path.write(content)
+            count = len(client.requests)
+            quiz.Schema.from_url('https://my.url/graphql', client=client,
+                                 cache=quiz.SchemaCache(tmpdir))
+            assert len(client.requests) == count + 1
+
+    def test_removes_replaced_schemas(self, raw_schema, tmpdir):
+        client = IntrospectionClient(raw_schema)
+        cache = quiz.SchemaCache(tmpdir, ttl=0)
+        quiz.Schema.from_url('https://my.url/graphql',
+                             client=client, cache=cache)
+        quiz.Schema.from_url('https://other.url/graphql',
+                             client=client, cache=cache)
+        assert len(tmpdir.listdir('schema-*')) == 1
+
+        client.raw_schema = with_query_description(raw_schema, 'changed')
+        quiz.Schema.from_url('https://my.url/graphql',
+                             client=client, cache=cache)
+        quiz.Schema.from_url('https://other.url/graphql',
+                             client=client, cache=cache)
+        path, = tmpdir.listdir('schema-*')
+        assert json.loads(path.read()) == client.raw_schema
+
+    def test_error_not_stored(self, tmpdir):
+        client = MockClient(
+            snug.Response(200, json.dumps({'data': {'__schema': None},
+                                           'errors': 'foo'}).encode()))
+        cache = quiz.SchemaCache(tmpdir)
+        with pytest.raises(quiz.ErrorResponse):
+            quiz.Schema.from_url('https://my.url/graphql',
+                                 client=client, cache=cache)
+        assert not tmpdir.listdir()
+
+    @py3
+    def test_async(self, raw_schema, tmpdir, event_loop):
+        client = IntrospectionClient(raw_schema)
+        cache = quiz.SchemaCache(tmpdir)
+        schema = event_loop.run_until_complete(quiz.Schema.from_url_async(
+            'https://my.url/graphql', client=client, cache=cache))
+        assert schema.raw == raw_schema
+        assert event_loop.run_until_complete(quiz.Schema.from_url_async(
+            'https://my.url/graphql', client=client, cache=cache)) is schema
+        assert len(client.requests) == 1
+
+
+def changed_schema(raw_schema, change):
+    """a copy of a raw schema, changed in-place by a function
+    taking the raw types (by name) and the raw schema"""
+    raw = copy.deepcopy(raw_schema)
+    change({conf['name']: conf for conf in raw['types']}, raw)
+    return raw
+
+
+def add_field(conf, name, like):
+    conf['fields'].append(dict(
+        next(f for f in conf['fields'] if f['name'] == like), name=name))
+
+
+def remove_field(conf, name):
+    conf['fields'] = [f for f in conf['fields'] if f['name'] != name]
+
+
+class TestSchemaDiff:
+
+    def test_equal(self, raw_schema):
+        diff = quiz.schema_diff(raw_schema, copy.deepcopy(raw_schema))
+        assert not diff
+        assert diff == quiz.SchemaDiff(frozenset(), frozenset(),
+                                       quiz.utils.FrozenDict({}))
+
+    def test_changes(self, raw_schema):
+
+        def change(types, raw):
+            issue = types['Issue']
+            issue['description'] = 'changed'
+            add_field(issue, 'foo', like='number')
+            remove_field(issue, 'title')
+            next(f for f in issue['fields']
+                 if f['name'] == 'number')['description'] = 'changed'
+            types['IssueState']['enumValues'].append(
+                dict(types['IssueState']['enumValues'][0], name='NEW'))
+            raw['types'].remove(types['ProjectCardItem'])
+            raw['types'].append(dict(types['DateTime'], name='Foo'))
+
+        diff = quiz.schema_diff(raw_schema,
+                                changed_schema(raw_schema, change))
+        assert diff
+        assert diff.added == {'Foo'}
+        assert diff.removed == {'ProjectCardItem'}
+        assert set(diff.changed) == {'Issue', 'IssueState'}
+        assert diff.changed['Issue'] == quiz.TypeDiff(
+            added={'foo'},
+            removed={'title'},
+            changed={'number'},
+            properties={'description'},
+        )
+        assert diff.changed['IssueState'] == quiz.TypeDiff(
+            added={'NEW'},
+            removed=frozenset(),
+            changed=frozenset(),
+            properties=frozenset(),
+        )
+
+
+class TestUpdated:
+
+    def test_unchanged(self, raw_schema):
+        schema = quiz.Schema.from_raw(raw_schema, module='mymodule')
+        new_raw = copy.deepcopy(raw_schema)
+        updated = schema.updated(new_raw)
+        assert updated.module == 'mymodule'
+        assert set(updated.classes) == set(schema.classes)
+        assert updated.raw is new_raw
+        assert all(updated.classes[name] is cls
+                   for name, cls in schema.classes.items())
+
+    def test_changed_fields(self, raw_schema):
+        schema = quiz.Schema.from_raw(raw_schema)
+        query = schema.query[_.repository(owner='a', name='b')[
+            _.issue(number=1)[_.title]]]
+
+        def change(types, raw):
+            add_field(types['Issue'], 'foo', like='number')
+            remove_field(types['Issue'], 'title')
+            next(f for f in types['Issue']['fields']
+                 if f['name'] == 'number')['description'] = 'changed'
+
+        new_raw = changed_schema(raw_schema, change)
+        updated = schema.updated(new_raw)
+        assert updated.Issue is not schema.Issue
+        assert updated.Issue.foo.type is int
+        assert updated.Issue.number.desc == 'changed'
+        assert not hasattr(updated.Issue, 'title')
+        assert updated.Issue.__doc__ == schema.Issue.__doc__
+        assert describe_schema(updated) == describe_schema(
+            quiz.Schema.from_raw(new_raw))
+        # types referring to the changed type get new classes as well
+        assert updated.Repository is not schema.Repository
+        assert updated.Repository.issue.type == quiz.Nullable[updated.Issue]
+        # others are shared
+        assert updated.License is schema.License
+
+        assert updated.query[_.repository(owner='a', name='b')[
+            _.issue(number=1)[_.foo]]]
+        with pytest.raises(quiz.SelectionError):
+            updated.query[_.repository(owner='a', name='b')[
+                _.issue(number=1)[_.title]]]
+
+        # the previous schema is unchanged
+        assert describe_schema(schema) == describe_schema(
+            quiz.Schema.from_raw(raw_schema))
+        assert schema.Issue.title
+        assert not hasattr(schema.Issue, 'foo')
+        assert schema.query[query.selections] == query
+
+    def test_keeps_caches_of_unchanged_types(self, raw_schema):
+        schema = quiz.Schema.from_raw(raw_schema)
+        license_selection = _.name
+        query = schema.query[
+            _
+            .repository(owner='octocat', name='hello-world')[
+                _
+                .issues(first=1)[
+                    _.nodes[_.number]
+                ]
+            ]
+        ]
+        quiz.types._cached_loader(schema.Query, query.selections)
+        quiz.types._cached_loader(schema.License, license_selection)
+        schema.query[_.license(key='mit')[license_selection]]
+
+        updated = schema.updated(changed_schema(
+            raw_schema,
+            lambda types, raw: add_field(types['Repository'], 'foo',
+                                         like='name')))
+        assert updated.License is schema.License
+        assert updated.Query is not schema.Query
+        assert (updated.License, license_selection) in \
+            quiz.types.VALIDATION_CACHE
+        assert (updated.License, license_selection) in quiz.types._LOADERS
+        assert (updated.Query, query.selections) not in quiz.types._LOADERS
+        # the caches of the previous schema remain valid
+        assert (schema.Query, query.selections) in quiz.types._LOADERS
+        # queries are validated again, but not their unaffected parts
+        hits = quiz.types.VALIDATION_CACHE.hits
+        updated.query[_.license(key='mit')[license_selection]]
+        assert quiz.types.VALIDATION_CACHE.hits == hits + 1
+
+        assert updated.query[
+            _.repository(owner='octocat', name='hello-world')[_.foo]]
+
+    def test_new_classes(self, raw_schema):
+        schema = quiz.Schema.from_raw(raw_schema)
+
+        def change(types, raw):
+            types['IssueState']['enumValues'].append(
+                dict(types['IssueState']['enumValues'][0], name='NEW'))
+            types['Closable']['description'] = 'changed'
+
+        new_raw = changed_schema(raw_schema, change)
+        updated = schema.updated(new_raw)
+        assert describe_schema(updated) == describe_schema(
+            quiz.Schema.from_raw(new_raw))
+
+        assert updated.IssueState is not schema.IssueState
+        assert updated.IssueState.NEW
+        assert updated.Closable.__doc__ == 'changed'
+        # objects and unions based on new classes are created again
+        assert updated.Issue is not schema.Issue
+        assert issubclass(updated.Issue, updated.Closable)
+        assert updated.Issue.state.type is updated.IssueState
+        assert updated.Issue in updated.ProjectCardItem.__args__
+        # types with fields referring to new classes are created again
+        assert updated.IssueConnection is not schema.IssueConnection
+        assert updated.IssueConnection.nodes.type == quiz.Nullable[
+            quiz.List[quiz.Nullable[updated.Issue]]]
+        # other types remain unchanged
+        assert updated.License is schema.License
+        assert schema.Issue.state.type is schema.IssueState
+        assert schema.IssueConnection.nodes.type == quiz.Nullable[
+            quiz.List[quiz.Nullable[schema.Issue]]]
+
+    def test_added_and_removed_types(self, raw_schema):
+        schema = quiz.Schema.from_raw(raw_schema)
+
+        def change(types, raw):
+            raw['types'].append(dict(types['CodeOfConduct'], name='Foo'))
+            add_field(types['Query'], 'foo', like='codeOfConduct')
+            types['Query']['fields'][-1]['type'] = {
+                'kind': 'OBJECT', 'name': 'Foo', 'ofType': None}
+
+        new_raw = changed_schema(raw_schema, change)
+        updated = schema.updated(new_raw)
+        assert updated.Query is not schema.Query
+        assert updated.Query.foo.type == quiz.Nullable[updated.Foo]
+        assert updated.Foo.__name__ == 'Foo'
+        assert 'Foo' not in schema.classes
+        assert not hasattr(schema.Query, 'foo')
+
+        reverted = updated.updated(raw_schema)
+        assert 'Foo' not in reverted.classes
+        assert not hasattr(reverted.Query, 'foo')
+        assert updated.Query.foo
+        assert describe_schema(reverted) == describe_schema(
+            quiz.Schema.from_raw(raw_schema))
+
+    def test_scalars(self, raw_schema):
+        schema = quiz.Schema.from_raw(raw_schema, scalars=[URI])
+
+        def change(types, raw):
+            types['URI']['description'] = 'changed'
+            types['DateTime']['description'] = 'changed'
+            types['String']['description'] = 'changed'
+
+        updated = schema.updated(changed_schema(raw_schema, change))
+        assert updated.URI is URI
+        assert updated.String is str
+        assert updated.DateTime is not schema.DateTime
+        assert issubclass(updated.DateTime, quiz.GenericScalar)
+        assert updated.DateTime.__doc__ == 'changed'
+        assert updated.Repository.url.type is URI
+
+    def test_lazy(self, raw_schema):
+        schema = quiz.Schema.from_raw(raw_schema, lazy=True)
+        new_raw = changed_schema(
+            raw_schema,
+            lambda types, raw: add_field(types['Issue'], 'foo',
+                                         like='number'))
+        updated = schema.updated(new_raw)
+        assert updated.Issue.foo
+        assert not hasattr(schema.Issue, 'foo')
+        assert describe_schema(updated) == describe_schema(
+            quiz.Schema.from_raw(new_raw))
+
+
+class TestPrune:
+
+    def test_queries(self, raw_schema):
+        schema = quiz.Schema.from_raw(raw_schema)
+        query = schema.query[
+            _
+            .repository(owner='octocat', name='hello-world')[
+                _
+                .issues(first=1)[
+                    _.nodes[_.number.state]
+                ]
+            ]
+        ]
+        raw = quiz.prune_schema(raw_schema, queries=[query, query])
+        types = {conf['name']: conf for conf in raw['types']}
+
+        def fields(name):
+            return {f['name'] for f in types[name]['fields']}
+
+        assert fields('Query') == {'repository'}
+        assert fields('Repository') == {'issues'}
+        assert fields('IssueConnection') == {'nodes'}
+        assert fields('Issue') == {'number', 'state'}
+        # types of arguments are kept entirely, also if not given
+        assert types['IssueOrder'] == next(
+            conf for conf in raw_schema['types']
+            if conf['name'] == 'IssueOrder')
+        assert 'OrderDirection' in types
+        # interfaces are kept, for creating the classes
+        assert not fields('Closable')
+        assert {ref['name'] for ref in types['Closable']['possibleTypes']} \
+            <= set(types)
+        assert 'User' not in types
+        assert raw['mutationType'] is None
+        assert raw['subscriptionType'] is None
+        assert raw['directives'] == raw_schema['directives']
+
+        pruned = schema.pruned(queries=[query])
+        assert pruned.raw == raw
+        assert pruned.query[
+            _
+            .repository(owner='octocat', name='hello-world')[
+                _.issues(first=4)[_.nodes[_.number]]
+            ]
+        ]
+        with pytest.raises(quiz.SelectionError):
+            pruned.query[_.repository(owner='a', name='b')[_.name]]
+        assert issubclass(pruned.Issue, pruned.Closable)
+        result = quiz.load(pruned.Query, query.selections, {
+            'repository': {'issues': {'nodes': [
+                {'number': 4, 'state': 'OPEN'}]}},
+        })
+        assert result.repository.issues.nodes[0].state is \
+            pruned.IssueState.OPEN
+
+    def test_unions(self, raw_schema):
+        schema = quiz.Schema.from_raw(raw_schema)
+        # (selections on unions are not validated yet)
+        selections = _.content[quiz.SelectionSet(schema.Issue[_.number])]
+        raw = quiz.prune_schema(raw_schema, queries=[
+            quiz.Query(schema.ProjectCard, selections)])
+        types = {conf['name']: conf for conf in raw['types']}
+        # all members of the union are kept, for creating its class
+        assert types['ProjectCardItem'] == next(
+            conf for conf in raw_schema['types']
+            if conf['name'] == 'ProjectCardItem')
+        assert [f['name'] for f in types['Issue']['fields']] == ['number']
+        assert types['PullRequest']['fields'] == []
+        assert [f['name'] for f in types['ProjectCard']['fields']] == [
+            'content']
+
+    def test_roots(self, raw_schema):
+        schema = quiz.Schema.from_raw(raw_schema, scalars=[URI])
+        pruned = schema.pruned(roots=['Mutation', schema.License], queries=[
+            schema.query[_.license(key='mit')[_.name]]])
+        full = {conf['name']: conf for conf in raw_schema['types']}
+        types = {conf['name']: conf for conf in pruned.raw['types']}
+        assert types['License'] == full['License']
+        assert types['LicenseRule'] == full['LicenseRule']
+        assert types['Mutation'] == full['Mutation']
+        assert pruned.raw['mutationType'] == {'name': 'Mutation'}
+        assert pruned.mutation_type is pruned.Mutation
+        assert [f['name'] for f in types['Query']['fields']] == ['license']
+        assert len(types) < len(full)
+        assert pruned.URI is URI
+        assert pruned.License.url.type == quiz.Nullable[URI]
+
+    def test_to_path(self, raw_schema, tmpdir):
+        schema = quiz.Schema.from_raw(raw_schema, module='mymodule')
+        pruned = schema.pruned(queries=[
+            schema.query[_.licenses[_.name.body]]])
+        pruned.to_path(str(tmpdir / 'pruned.json'))
+        loaded = quiz.Schema.from_path(str(tmpdir / 'pruned.json'),
+                                       module='mymodule')
+        assert loaded.module == pruned.module == 'mymodule'
+        assert describe_schema(loaded) == describe_schema(pruned)
+        assert loaded.query[_.licenses[_.name]]
+
+
+def without_keys(raw, keys):
+    if isinstance(raw, list):
+        return [without_keys(r, keys) for r in raw]
+    elif isinstance(raw, dict):
+        return {k: without_keys(v, keys)
+                for k, v in raw.items() if k not in keys}
+    return raw
+
+
+class TestIntrospectionQuery:
+
+    def test_default(self):
+        assert quiz.introspection_query() == quiz.INTROSPECTION_QUERY
+        assert 'description' in quiz.INTROSPECTION_QUERY
+        assert 'includeDeprecated: true' in quiz.INTROSPECTION_QUERY
+        assert 'defaultValue' in quiz.INTROSPECTION_QUERY
+
+    def test_slim(self):
+        query = quiz.introspection_query(
+            descriptions=False, deprecated=False, default_values=False)
+        assert 'description' not in query
+        assert 'includeDeprecated: false' in query
+        assert 'isDeprecated' not in query
+        assert 'deprecationReason' not in query
+        assert 'defaultValue' not in query
+        assert 'fragment TypeRef on __Type' in query
+
+    @pytest.mark.parametrize('lazy', [True, False])
+    def test_schema_from_slim_result(self, raw_schema, lazy):
+        raw = without_keys(raw_schema, {
+            'description', 'isDeprecated', 'deprecationReason',
+            'defaultValue'})
+        schema = quiz.Schema.from_raw(raw, lazy=lazy)
+        assert schema.Repository.__doc__ is None
+        assert schema.Repository.name == quiz.FieldDefinition(
+            'name', None, type=str, args=quiz.utils.FrozenDict({}),
+            is_deprecated=False, deprecation_reason=None)
+        assert schema.IssueState.OPEN.__doc__ is None
+        loaded = quiz.Schema.from_snapshot(schema.to_snapshot())
+        assert loaded.Repository.name == schema.Repository.name
+
+    def test_from_url(self, raw_schema):
+        client = MockClient(
+            snug.Response(
+                200,
+                json.dumps({'data': {'__schema': raw_schema}}).encode()))
+        query = quiz.introspection_query(descriptions=False)
+        quiz.Schema.from_url('https://my.url/graphql', client=client,
+                             introspection=query)
+        assert json.loads(client.request.content.decode())['query'] == query
+
+
 class TestSchemaFromPath:
 
     def test_defaults(self, raw_schema, tmpdir):
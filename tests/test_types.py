@@ -1,7 +1,12 @@
+import gc
+import os
+import threading
+import time
 from datetime import datetime
 from textwrap import dedent
 
 import pytest
+import six
 
 import quiz
 from quiz import SELECTOR as _
@@ -9,7 +14,7 @@ from quiz.build import SelectionSet, gql
 from quiz.utils import FrozenDict as fdict
 
 from .example import (Color, Command, Dog, DogQuery, Hobby, Human, MyDateTime,
-                      Sentient)
+                      Sentient, mkfield)
 from .helpers import AlwaysEquals, NeverEquals
 
 
@@ -36,6 +41,16 @@ class TestOptional:
         assert isinstance(None, MyOptional)
         assert not isinstance(5.4, MyOptional)
 
+    def test_interned(self):
+        assert quiz.Nullable[int] is quiz.Nullable[int]
+        assert quiz.Nullable[int] is not quiz.Nullable[str]
+        assert quiz.Nullable[int].__name__ == 'int or None'
+        assert quiz.Nullable[int].__arg__ is int
+
+
+class Unicode(quiz.Union):
+    __args__ = (six.text_type, )
+
 
 class TestList:
 
@@ -50,6 +65,34 @@ class TestList:
         assert not isinstance([3, 'bla'], MyList)
         assert not isinstance((1, 2), MyList)
 
+    def test_interned(self):
+        assert quiz.List[int] is quiz.List[int]
+        assert quiz.List[quiz.Nullable[int]] is quiz.List[quiz.Nullable[int]]
+        assert quiz.List[int] is not quiz.List[quiz.Nullable[int]]
+        assert quiz.List[int].__name__ == '[int]'
+
+    @pytest.mark.parametrize('type_, valid, invalid', [
+        (int, [1, True, 3], [1, 'foo']),
+        (quiz.Nullable[float], [1., None], [1., 2]),
+        (quiz.GenericScalar, [1, u'foo', 4.5], [1, None]),
+        (quiz.List[int], [[1], []], [[1], ['foo']]),
+        (quiz.Nullable[Unicode], [Unicode(), None], [3]),
+    ])
+    def test_isinstancecheck_items(self, type_, valid, invalid):
+        assert isinstance(valid, quiz.List[type_])
+        assert isinstance([], quiz.List[type_])
+        assert not isinstance(invalid, quiz.List[type_])
+        assert not isinstance(tuple(valid), quiz.List[type_])
+
+    def test_unused_are_discarded(self):
+
+        class Foo(object):
+            pass
+
+        quiz.List[Foo]
+        gc.collect()
+        assert Foo not in quiz.types._LISTS
+
 
 class TestGenericScalar:
 
@@ -194,6 +237,12 @@ def test_missing_argument_str(name):
     assert str(exc) == 'argument "{}" missing (required)'.format(name)
 
 
+def test_conflicting_variable_types_str():
+    exc = quiz.ConflictingVariableTypes(
+        'foo', int, quiz.Nullable[quiz.List[int]])
+    assert str(exc) == 'variable "$foo" used as both Int! and [Int!]'
+
+
 def test_selections_not_supported_str():
     exc = quiz.SelectionsNotSupported()
     assert str(exc) == 'selections not supported on this object'
@@ -304,11 +353,402 @@ class TestValidate:
             quiz.SelectionsNotSupported()
         )
 
+    def test_fragment_spread(self):
+        dog_info = quiz.FragmentDefinition('DogInfo', Dog, _.name.owner[
+            _.name])
+        sentient_info = quiz.FragmentDefinition('SentientInfo', Sentient,
+                                                _.name)
+        selection_set = _.dog[SelectionSet(
+            quiz.FragmentSpread(dog_info),
+            quiz.FragmentSpread(sentient_info),
+        )].dog[_.best_friend[SelectionSet(quiz.FragmentSpread(dog_info))]]
+        assert quiz.validate(DogQuery, selection_set) == selection_set
+
+    def test_fragment_spread_invalid_type(self):
+        human_info = quiz.FragmentDefinition('HumanInfo', Human, _.name)
+        with pytest.raises(quiz.SelectionError) as exc:
+            quiz.validate(DogQuery, _.dog[SelectionSet(
+                quiz.FragmentSpread(human_info))])
+        assert exc.value == quiz.SelectionError(
+            DogQuery,
+            'dog',
+            quiz.SelectionError(
+                Dog,
+                '...HumanInfo',
+                quiz.InvalidFragmentType(Human)
+            )
+        )
+        assert 'fragment on "Human" does not apply here' in str(exc.value)
+
+    def test_fragment_spread_invalid_selection(self):
+        dog_info = quiz.FragmentDefinition('DogInfo', Dog, _.name.foo)
+        with pytest.raises(quiz.SelectionError) as exc:
+            quiz.validate(Dog, SelectionSet(quiz.FragmentSpread(dog_info)))
+        assert exc.value == quiz.SelectionError(
+            Dog,
+            '...DogInfo',
+            quiz.SelectionError(Dog, 'foo', quiz.NoSuchField())
+        )
+
+    def test_variables(self):
+        selection_set = (
+            _
+            .knows_command(command=quiz.Variable('cmd'))
+            .is_housetrained(at_other_homes=quiz.Variable('foo'))
+        )
+        assert quiz.validate(Dog, selection_set) == selection_set
+
     # TODO: check object types always have selection sets
 
     # TODO: list input type
 
 
+class TestFieldTable:
+
+    def test_fields_added_later(self):
+
+        class Foo(quiz.Object):
+            a = mkfield('a', type=int)
+
+        assert quiz.validate(Foo, _.a) == _.a
+        with pytest.raises(quiz.SelectionError):
+            quiz.validate(Foo, _.b)
+
+        Foo.b = mkfield('b', type=int)
+        assert quiz.validate(Foo, _.b) == _.b
+
+        del Foo.b
+        with pytest.raises(quiz.SelectionError):
+            quiz.validate(Foo, _.b)
+
+    def test_inherited_fields(self):
+
+        @six.add_metaclass(quiz.Interface)
+        class Base(quiz.types.Namespace):
+            a = mkfield('a', type=int)
+
+        class Foo(Base, quiz.Object):
+            b = mkfield('b', type=int)
+
+        assert quiz.validate(Foo, _.a.b) == _.a.b
+        Base.c = mkfield('c', type=int)
+        assert quiz.validate(Foo, _.c) == _.c
+
+    def test_other_classes_unaffected(self):
+
+        class Foo(quiz.Object):
+            a = mkfield('a', type=int)
+
+        class Bar(quiz.Object):
+            a = mkfield('a', type=int)
+
+        table = quiz.types._field_table(Foo)
+        Bar.b = mkfield('b', type=int)
+        assert quiz.types._field_table(Foo) is table
+
+    def test_not_a_field(self):
+
+        class Foo(quiz.Object):
+            def foo(self):
+                pass
+
+        with pytest.raises(quiz.SelectionError) as exc:
+            quiz.validate(Foo, _.foo)
+        assert exc.value == quiz.SelectionError(Foo, 'foo', quiz.NoSuchField())
+
+    def test_list_arguments(self):
+
+        class Foo(quiz.Object):
+            a = mkfield('a', type=int, args=fdict({
+                'x': quiz.InputValue(
+                    'x', '', quiz.Nullable[quiz.List[quiz.Nullable[int]]]),
+            }))
+
+        for valid in [None, [], [1, None, 3]]:
+            quiz.validate(Foo, _.a(x=valid))
+        for invalid in [1, (1, 2), [1, 'foo']]:
+            with pytest.raises(quiz.SelectionError):
+                quiz.validate(Foo, _.a(x=invalid))
+
+    def test_scalar_arguments(self):
+
+        class Foo(quiz.Object):
+            a = mkfield('a', type=int, args=fdict({
+                'x': quiz.InputValue('x', '', quiz.GenericScalar),
+            }))
+
+        quiz.validate(Foo, _.a(x=4))
+        with pytest.raises(quiz.SelectionError):
+            quiz.validate(Foo, _.a(x=None))
+
+    def test_precomputed_in_schema(self):
+        schema = quiz.Schema.from_path(
+            os.path.join(os.path.dirname(__file__), 'example_schema.json'))
+        assert '__field_table__' in vars(schema.Repository)
+
+
+class TestPendingFields:
+
+    def make_class(self, add_fields):
+
+        class Foo(quiz.Object):
+            pass
+
+        type.__setattr__(Foo, '__pending_fields__', add_fields)
+        return Foo
+
+    def test_added_on_attribute_access(self):
+        calls = []
+
+        def add_fields(cls):
+            calls.append(cls)
+            cls.a = mkfield('a', type=int)
+
+        Foo = self.make_class(add_fields)
+        assert Foo.a.name == 'a'
+        assert Foo.a.name == 'a'
+        assert calls == [Foo]
+        assert not hasattr(Foo, 'b')
+        assert calls == [Foo]
+
+    def test_retried_after_failure(self):
+        calls = []
+
+        def add_fields(cls):
+            calls.append(cls)
+            cls.a = mkfield('a', type=int)
+            if len(calls) == 1:
+                raise ValueError('failed to add fields')
+            cls.b = mkfield('b', type=int)
+
+        Foo = self.make_class(add_fields)
+        with pytest.raises(ValueError, match='failed'):
+            Foo.a
+        # partly added fields are removed
+        assert 'a' not in vars(Foo)
+        assert quiz.validate(Foo, _.a.b) == _.a.b
+        assert calls == [Foo, Foo]
+
+    def test_added_on_validation(self):
+
+        def add_fields(cls):
+            cls.a = mkfield('a', type=int)
+
+        Foo = self.make_class(add_fields)
+        assert quiz.validate(Foo, _.a) == _.a
+
+    def test_reentrant(self):
+
+        def add_fields(cls):
+            assert not hasattr(cls, 'a')
+            cls.a = mkfield('a', type=int)
+
+        Foo = self.make_class(add_fields)
+        assert Foo.a.name == 'a'
+
+    def test_added_in_other_thread(self):
+        results = []
+
+        def add_fields(cls):
+            cls.a = mkfield('a', type=int)
+
+        Foo = self.make_class(add_fields)
+        with quiz.types._PENDING_FIELDS_LOCK:
+            thread = threading.Thread(
+                target=lambda: results.append(Foo.a.name))
+            thread.start()
+            time.sleep(0.05)  # let the thread wait for the lock
+            quiz.types._add_pending_fields(Foo)
+        thread.join()
+        assert results == ['a']
+
+
+class TestValidationCache:
+
+    @pytest.fixture(autouse=True)
+    def cache(self, mocker):
+        cache = quiz.utils.LRUCache(maxsize=100)
+        mocker.patch('quiz.types.VALIDATION_CACHE', cache)
+        return cache
+
+    def test_repeated(self, cache):
+        selection_set = _.dog[_.name.owner[_.name]]
+        for _i in range(3):
+            assert quiz.validate(DogQuery, selection_set) is selection_set
+        assert cache.info().hits == 2
+        assert len(cache) == 3  # including the nested selection sets
+
+    def test_nested_reuse(self, cache):
+        quiz.validate(Dog, _.owner[_.name])
+        cache.clear()
+        quiz.validate(DogQuery, _.dog[_.owner[_.name]])
+        quiz.validate(Dog, _.name.owner[_.name])
+        assert cache.info().hits == 1
+
+    def test_changed_fields(self, cache):
+
+        class Owner(quiz.Object):
+            name = mkfield('name', type=int)
+
+        class Pet(quiz.Object):
+            owner = mkfield('owner', type=Owner)
+
+        class Other(quiz.Object):
+            pass
+
+        for _i in range(2):
+            quiz.validate(Pet, _.owner[_.name])
+        assert cache.info().hits == 1
+        # changes to unrelated classes don't affect cached results
+        Other.foo = mkfield('foo', type=int)
+        quiz.validate(Pet, _.owner[_.name])
+        assert cache.info().hits == 2
+        # nested classes are taken into account
+        del Owner.name
+        with pytest.raises(quiz.SelectionError):
+            quiz.validate(Pet, _.owner[_.name])
+        # outdated results are replaced once valid again
+        Owner.name = mkfield('name', type=int)
+        quiz.validate(Pet, _.owner[_.name])
+        hits = cache.info().hits
+        quiz.validate(Pet, _.owner[_.name])
+        assert cache.info().hits == hits + 1
+
+    def test_invalid_not_cached(self, cache):
+        for _i in range(2):
+            with pytest.raises(quiz.SelectionError):
+                quiz.validate(Dog, _.foo)
+        assert len(cache) == 0
+
+    def test_argument_types(self, cache):
+        quiz.validate(Dog, _.is_housetrained(at_other_homes=True))
+        with pytest.raises(quiz.SelectionError):
+            quiz.validate(Dog, _.is_housetrained(at_other_homes=1))
+
+    def test_unhashable(self, cache):
+        selection_set = SelectionSet(
+            quiz.Field('is_housetrained', {'at_other_homes': True}))
+        for _i in range(2):
+            assert quiz.validate(Dog, selection_set) is selection_set
+        assert len(cache) == 0
+
+    def test_disabled(self, cache):
+        cache.resize(0)
+        for _i in range(2):
+            quiz.validate(Dog, _.name)
+        assert cache.info() == (0, 2, 0, 0)
+
+
+class TestVariableDefs:
+
+    def test_none(self):
+        assert quiz.variable_defs(Dog, _.name.knows_command(
+            command=Command.SIT)) == fdict.EMPTY
+
+    def test_simple(self):
+        defs = quiz.variable_defs(DogQuery, (
+            _
+            .dog[
+                _
+                .knows_command(command=quiz.Variable('cmd'))
+                ('other').knows_command(command=quiz.Variable('cmd'))
+                .is_housetrained(at_other_homes=quiz.Variable('at_homes'))
+                .owner[
+                    _
+                    .name
+                ]
+                .age(on_date=quiz.Variable('date'))
+            ]
+        ))
+        assert dict(defs) == {
+            'cmd': Command,
+            'at_homes': Dog.is_housetrained.args['at_other_homes'].type,
+            'date': Dog.age.args['on_date'].type,
+        }
+
+    def test_fragment(self):
+        defs = quiz.variable_defs(Dog, SelectionSet(
+            Dog[_.knows_command(command=quiz.Variable('cmd'))]
+        ))
+        assert dict(defs) == {'cmd': Command}
+
+    def test_equal_parametrized_types(self):
+
+        class Foo(quiz.Object):
+            a = mkfield('a', type=int, args=fdict({
+                'x': quiz.InputValue('x', '', quiz.Nullable[quiz.List[int]])
+            }))
+            b = mkfield('b', type=int, args=fdict({
+                'y': quiz.InputValue('y', '', quiz.Nullable[quiz.List[int]])
+            }))
+
+        defs = quiz.variable_defs(Foo, (
+            _
+            .a(x=quiz.Variable('foo'))
+            .b(y=quiz.Variable('foo'))
+        ))
+        assert list(defs) == ['foo']
+
+    def test_conflict(self):
+        with pytest.raises(quiz.SelectionError) as exc:
+            quiz.variable_defs(DogQuery, (
+                _
+                .dog[
+                    _
+                    .knows_command(command=quiz.Variable('foo'))
+                    .is_housetrained(at_other_homes=quiz.Variable('foo'))
+                ]
+            ))
+        assert exc.value == quiz.SelectionError(
+            DogQuery,
+            'dog',
+            quiz.SelectionError(
+                Dog,
+                'is_housetrained',
+                quiz.ConflictingVariableTypes(
+                    'foo',
+                    Command,
+                    Dog.is_housetrained.args['at_other_homes'].type,
+                )
+            )
+        )
+
+    @pytest.mark.parametrize('order', [1, -1])
+    def test_non_null_and_nullable(self, order):
+
+        class Foo(quiz.Object):
+            a = mkfield('a', type=int, args=fdict({
+                'x': quiz.InputValue('x', '', quiz.List[int])
+            }))
+            b = mkfield('b', type=int, args=fdict({
+                'y': quiz.InputValue('y', '', quiz.Nullable[quiz.List[int]])
+            }))
+
+        fields = list(_.a(x=quiz.Variable('foo')).b(y=quiz.Variable('foo')))
+        defs = quiz.variable_defs(Foo, SelectionSet(*fields[::order]))
+        assert dict(defs) == {'foo': quiz.List[int]}
+
+
+class TestValidateVariables:
+
+    def test_valid(self):
+        defs = {'cmd': Command, 'foo': quiz.Nullable[int]}
+        assert quiz.validate_variables(defs, {'cmd': Command.SIT}) == {
+            'cmd': Command.SIT}
+
+    def test_missing(self):
+        with pytest.raises(quiz.MissingArgument):
+            quiz.validate_variables({'cmd': Command}, {})
+
+    def test_invalid_type(self):
+        with pytest.raises(quiz.InvalidArgumentType):
+            quiz.validate_variables({'cmd': Command}, {'cmd': 'SIT'})
+
+    def test_unknown(self):
+        with pytest.raises(quiz.NoSuchArgument):
+            quiz.validate_variables({}, {'cmd': Command.SIT})
+
+
 class TestLoadField:
 
     def test_custom_scalar(self):
@@ -508,6 +948,218 @@ class TestLoad:
         )
 
 
+class TestCompileLoader:
+
+    def test_empty(self):
+        loader = quiz.compile_loader(DogQuery, quiz.SelectionSet())
+        assert isinstance(loader({}), DogQuery)
+
+    def test_equivalent_to_load(self):
+        selection = (
+            _
+            .dog[
+                _
+                .name
+                .color
+                ('knows_sit').knows_command(command=Command.SIT)
+                .owner[
+                    _
+                    .name
+                    .hobbies[
+                        _
+                        .name
+                        ('coolness').cool_factor
+                    ]
+                ]
+                .best_friend[
+                    _
+                    .name
+                ]
+                .birthday
+                .data
+            ]
+        )
+        response = {
+            'dog': {
+                'name': u'Rufus',
+                'color': u'GOLDEN',
+                'knows_sit': True,
+                'owner': {
+                    'name': u'Fred',
+                    'hobbies': [
+                        {
+                            'name': u'stamp collecting',
+                            'coolness': 2,
+                        },
+                        None,
+                    ]
+                },
+                'best_friend': None,
+                'birthday': 1540731645,
+                'data': 4,
+            }
+        }
+        loader = quiz.compile_loader(DogQuery, selection)
+        loaded = loader(response)
+        assert loaded == quiz.load(DogQuery, selection, response)
+        assert loaded == DogQuery(
+            dog=Dog(
+                name='Rufus',
+                color=Color.GOLDEN,
+                knows_sit=True,
+                owner=Human(
+                    name='Fred',
+                    hobbies=[
+                        Hobby(name='stamp collecting', coolness=2),
+                        None,
+                    ]
+                ),
+                best_friend=None,
+                birthday=MyDateTime(datetime.fromtimestamp(1540731645)),
+                data=4,
+            )
+        )
+        assert loader(response) == loaded
+
+    def test_primitive_list(self):
+
+        class Foo(quiz.Object):
+            tags = mkfield('tags', type=quiz.List[quiz.Nullable[int]])
+
+        loader = quiz.compile_loader(Foo, _.tags)
+        tags = [1, None, 3]
+        loaded = loader({'tags': tags})
+        assert loaded == Foo(tags=[1, None, 3])
+        assert loaded.tags is not tags
+
+    def test_custom_init(self):
+
+        class Foo(quiz.Object):
+            name = mkfield('name', type=six.text_type)
+
+            def __init__(self, **kwargs):
+                kwargs['name'] = kwargs['name'].upper()
+                super(Foo, self).__init__(**kwargs)
+
+        loaded = quiz.compile_loader(Foo, _.name)({'name': u'bla'})
+        assert loaded == Foo(name=u'bla')
+        assert loaded.name == 'BLA'
+
+    def test_unsupported_type(self):
+        loader = quiz.compile_loader(Human, _.best_friend[_.name])
+        assert loader({'best_friend': None}) == Human(best_friend=None)
+        with pytest.raises(NotImplementedError):
+            loader({'best_friend': {'name': 'Bob'}})
+
+
+class TestExtractFragments:
+
+    def test_nothing_to_extract(self):
+        query = quiz.Query(DogQuery, _.dog[_.name.owner[_.name]])
+        assert quiz.extract_fragments(query) is query
+
+    def test_small_selection_not_worth_it(self):
+        query = quiz.Query(
+            DogQuery, _('a').dog[_.name]('b').dog[_.name])
+        assert quiz.extract_fragments(query) is query
+
+    def test_extract(self):
+        dog_info = _.name.bark_volume.color.birthday.data
+        query = quiz.Query(DogQuery, (
+            _
+            ('a').dog[dog_info]
+            ('b').dog[dog_info]
+            ('c').dog[dog_info]
+        ))
+        optimized = quiz.extract_fragments(query)
+        assert quiz.gql_compact(optimized) == (
+            'query{a:dog{...F0}b:dog{...F0}c:dog{...F0}}'
+            'fragment F0 on Dog{name bark_volume color birthday data}')
+        assert quiz.validate(DogQuery, optimized.selections)
+        assert len(quiz.gql_compact(optimized)) < len(
+            quiz.gql_compact(query))
+
+        response = {
+            key: {
+                'name': u'Rufus',
+                'bark_volume': 3,
+                'color': u'BROWN',
+                'birthday': 1540731645,
+                'data': 4,
+            }
+            for key in 'abc'
+        }
+        expect = quiz.load(DogQuery, query.selections, response)
+        assert quiz.load(DogQuery, optimized.selections, response) == expect
+        assert quiz.compile_loader(DogQuery, optimized.selections)(
+            response) == expect
+
+    def test_nested(self):
+        owner_info = _.name.hobbies[_.name.cool_factor]
+        dog_info = _.name.bark_volume.owner[owner_info]
+        query = quiz.Query(DogQuery, (
+            _
+            ('a').dog[dog_info]
+            ('b').dog[
+                _
+                .name
+                .owner[owner_info]
+            ]
+            ('c').dog[dog_info]
+            ('d').dog[_.owner[owner_info]]
+        ))
+        optimized = quiz.extract_fragments(query)
+        assert quiz.gql_compact(optimized) == (
+            'query{a:dog{...F0}b:dog{name owner{...F1}}c:dog{...F0}'
+            'd:dog{owner{...F1}}}'
+            'fragment F0 on Dog{name bark_volume owner{...F1}}'
+            'fragment F1 on Human{name hobbies{name cool_factor}}')
+
+    def test_inline_fragment(self):
+        info = _.name.bark_volume.color.birthday.data.is_housetrained
+        query = quiz.Query(DogQuery, (
+            _
+            ('a').dog[
+                _
+                .best_friend[SelectionSet(Dog[info])]
+            ]
+            ('b').dog[info]
+        ))
+        optimized = quiz.extract_fragments(query)
+        assert quiz.gql_compact(optimized) == (
+            'query{a:dog{best_friend{...on Dog{...F0}}}b:dog{...F0}}'
+            'fragment F0 on Dog{name bark_volume color birthday data '
+            'is_housetrained}')
+
+    def test_variables(self):
+        dog_info = _.name.bark_volume.knows_command(
+            command=quiz.Variable('cmd'))
+        query = quiz.Query(
+            DogQuery,
+            _('a').dog[dog_info]('b').dog[dog_info],
+            variable_defs=fdict({'cmd': Command}),
+        )
+        optimized = quiz.extract_fragments(query)
+        assert optimized.variable_defs == query.variable_defs
+        assert quiz.variable_defs(
+            DogQuery, optimized.selections) == query.variable_defs
+
+    def test_existing_fragment_names(self):
+        existing = quiz.FragmentDefinition('F0', Human, _.name)
+        dog_info = (
+            _
+            .name.bark_volume.color.birthday
+            .owner[SelectionSet(quiz.FragmentSpread(existing))]
+        )
+        query = quiz.Query(DogQuery, _('a').dog[dog_info]('b').dog[dog_info])
+        optimized = quiz.extract_fragments(query)
+        assert quiz.gql_compact(optimized) == (
+            'query{a:dog{...F1}b:dog{...F1}}'
+            'fragment F1 on Dog{name bark_volume color birthday '
+            'owner{...F0}}'
+            'fragment F0 on Human{name}')
+
+
 class TestFieldDefinition:
 
     def test_doc(self):
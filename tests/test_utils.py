@@ -1,7 +1,12 @@
+import contextlib
+import copy
 import inspect
+import pickle
 
 import pytest
+import six
 
+import quiz
 from quiz import utils
 from quiz.compat import PY3
 
@@ -28,6 +33,48 @@ class TestMergeMappings:
         }
 
 
+class TestFrozenDict:
+
+    def test_equality(self):
+        instance = utils.FrozenDict({'foo': 1, 'bar': 'bla'})
+        assert instance == utils.FrozenDict({'foo': 1, 'bar': 'bla'})
+        assert instance == {'foo': 1, 'bar': 'bla'}
+        assert not instance == utils.FrozenDict({'foo': 1})
+        assert not instance == utils.FrozenDict({'foo': 2, 'bar': 'bla'})
+        assert not instance == [('foo', 1), ('bar', 'bla')]
+        assert instance == AlwaysEquals()
+        assert not instance == NeverEquals()
+
+        assert instance != utils.FrozenDict({'foo': 1})
+        assert not instance != {'foo': 1, 'bar': 'bla'}
+        assert instance != NeverEquals()
+        assert not instance != AlwaysEquals()
+
+    @pytest.mark.parametrize('value, other', [
+        (1, True),
+        (1, 1.0),
+        (0, False),
+    ])
+    def test_equality_distinguishes_types(self, value, other):
+        instance = utils.FrozenDict({'foo': value})
+        assert instance != utils.FrozenDict({'foo': other})
+        assert instance != {'foo': other}
+        assert hash(instance) == hash(utils.FrozenDict({'foo': value}))
+
+    def test_hash_cached(self, mocker):
+        inner = {'foo': 1}
+        instance = utils.FrozenDict(inner)
+        expect = hash(instance)
+        mocker.patch.object(instance, '_inner', {'bar': 2})
+        assert hash(instance) == expect
+
+    def test_unhashable(self):
+        instance = utils.FrozenDict({'foo': []})
+        for _ in range(2):
+            with pytest.raises(TypeError):
+                hash(instance)
+
+
 class TestInitList:
 
     def test_simple(self):
@@ -79,8 +126,7 @@ class TestValueObject:
 
         if PY3:
             Foo.__qualname__ = 'my_module.Foo'
-            assert inspect.signature(Foo) == inspect.signature(
-                Foo.__namedtuple_cls__)
+            assert list(inspect.signature(Foo).parameters) == ['foo', 'bla']
 
         instance = Foo(4, bla='foo')
 
@@ -115,10 +161,13 @@ class TestValueObject:
             assert repr(instance) == 'Foo(foo=4, bla=\'foo\')'
 
         assert Foo.bla.__doc__ == 'description for bla'
+        with pytest.raises(AttributeError, match="can't set"):
+            instance._foo = 6
+        with pytest.raises(AttributeError, match="can't set"):
+            instance._hash = 6
 
         # repr should never fail, even if everything is wrong
-        del instance._values
-        repr(instance)
+        repr(Foo.__new__(Foo))
 
     def test_defaults(self):
 
@@ -132,3 +181,199 @@ class TestValueObject:
 
         assert Foo(4) == Foo(4, '', 1.0)
         assert Foo(4, 'bla', 1.1) == Foo(4, 'bla', 1.1)
+        assert Foo(4).replace(qux=2.0) == Foo(4, '', 2.0)
+
+    def test_no_fields(self):
+
+        class Foo(utils.ValueObject, Exception):
+            __fields__ = []
+
+        assert Foo() == Foo()
+        assert not Foo() != Foo()
+        assert hash(Foo()) == hash(())
+        assert Foo().replace() == Foo()
+        assert repr(Foo()).endswith('Foo()')
+
+    def test_compared_like_tuples(self):
+
+        class Foo(utils.ValueObject):
+            __fields__ = [
+                ('foo', float, 'the foo'),
+                ('bla', object, 'the bla'),
+            ]
+
+        nan = float('nan')
+        # identical values are equal, like in tuples
+        assert Foo(nan, 1) == Foo(nan, 1)
+        assert not Foo(nan, 1) != Foo(nan, 1)
+        assert Foo(1.0, nan) != Foo(1.0, float('nan'))
+        assert Foo(1.0, AlwaysEquals()) == Foo(1.0, NeverEquals())
+        assert not Foo(1.0, AlwaysEquals()) != Foo(1.0, NeverEquals())
+
+    def test_replace_unknown_field(self):
+
+        class Foo(utils.ValueObject):
+            __fields__ = [
+                ('foo', int, 'the foo'),
+            ]
+
+        with pytest.raises(TypeError):
+            Foo(1).replace(bla=2)
+
+    def test_generic_replace(self):
+
+        class Foo(utils.ValueObject):
+            __fields__ = [
+                ('foo', int, 'the foo'),
+                ('bla', str, 'the bla'),
+            ]
+
+        assert utils.ValueObject.replace(Foo(1, 'a'), bla='b') == Foo(1, 'b')
+        with pytest.raises(TypeError):
+            utils.ValueObject.replace(Foo(1, 'a'), qux=2)
+
+    @pytest.mark.parametrize('instance', [
+        quiz.Field('foo', utils.FrozenDict({'a': 1}), alias='bar',
+                   selection_set=quiz.SELECTOR.bla),
+        quiz.Raw('foo'),
+        quiz.FieldDefinition('foo', 'my field', type=int,
+                             args=utils.FrozenDict.EMPTY,
+                             is_deprecated=False, deprecation_reason=None),
+        quiz.ErrorResponse(data={'foo': 4}, errors=[{'message': 'foo'}]),
+    ])
+    def test_copy_and_pickle(self, instance):
+        for copied in [copy.copy(instance), copy.deepcopy(instance),
+                       pickle.loads(pickle.dumps(instance)),
+                       pickle.loads(pickle.dumps(instance, protocol=0))]:
+            assert type(copied) is type(instance)
+            assert copied == instance
+            assert copied is not instance
+
+    def test_exception(self):
+
+        @contextlib.contextmanager
+        def context():
+            yield
+
+        error = quiz.ErrorResponse(data={}, errors=[{'message': 'foo'}])
+        with pytest.raises(quiz.ErrorResponse) as exc:
+            with context():
+                raise error
+        assert exc.value is error
+        if PY3:
+            # as done by contextlib on python 3.11+
+            error.__traceback__ = None
+            error.__context__ = error.__cause__ = ValueError()
+            error.__suppress_context__ = True
+
+        cause = ValueError('foo')
+        with pytest.raises(quiz.NoSuchField) as exc:
+            try:
+                raise cause
+            except ValueError as e:
+                six.raise_from(quiz.NoSuchField(), e)
+        if PY3:
+            assert exc.value.__cause__ is cause
+
+    def test_hash_cached(self):
+
+        class Foo(utils.ValueObject):
+            __fields__ = [
+                ('foo', list, 'the foo'),
+            ]
+
+        instance = Foo((1, 2))
+        assert hash(instance) == hash(((1, 2), ))
+        assert instance._hash == hash(instance)
+
+        unhashable = Foo([1, 2])
+        for _ in range(2):
+            with pytest.raises(TypeError):
+                hash(unhashable)
+
+
+class TestLRUCache:
+
+    def test_get_put(self):
+        cache = utils.LRUCache(maxsize=2)
+        assert cache.get('foo') is None
+        assert cache.get('foo', 5) == 5
+        cache.put('foo', 1)
+        assert cache.get('foo') == 1
+        assert 'foo' in cache
+        assert len(cache) == 1
+
+    def test_get_or_compute(self):
+        cache = utils.LRUCache(maxsize=2)
+        calls = []
+
+        def compute(*args):
+            calls.append(args)
+            return len(calls)
+
+        assert cache.get_or_compute('foo', compute, 1, 2) == 1
+        assert cache.get_or_compute('foo', compute, 1, 2) == 1
+        assert calls == [(1, 2)]
+        assert cache.info() == (1, 1, 2, 1)
+
+        # unhashable keys are not cached
+        assert cache.get_or_compute(['foo'], compute) == 2
+        assert cache.get_or_compute(['foo'], compute) == 3
+        assert len(cache) == 1
+
+        def fail():
+            raise TypeError('in computation')
+
+        with pytest.raises(TypeError, match='in computation'):
+            cache.get_or_compute('bar', fail)
+        assert 'bar' not in cache
+
+    def test_evicts_least_recently_used(self):
+        cache = utils.LRUCache(maxsize=2)
+        cache.put('foo', 1)
+        cache.put('bar', 2)
+        cache.get('foo')
+        cache.put('qux', 3)
+        assert 'bar' not in cache
+        assert cache.get('foo') == 1
+        assert cache.get('qux') == 3
+
+        cache.put('foo', 4)
+        assert len(cache) == 2
+        assert cache.get('foo') == 4
+
+    def test_items_pop(self):
+        cache = utils.LRUCache()
+        cache.put('foo', 1)
+        cache.put('bar', 2)
+        cache.get('foo')
+        assert cache.items() == [('bar', 2), ('foo', 1)]
+        assert cache.pop('foo') == 1
+        assert cache.pop('foo') is None
+        assert cache.items() == [('bar', 2)]
+
+    def test_clear(self):
+        cache = utils.LRUCache()
+        cache.put('foo', 1)
+        cache.get('foo')
+        cache.clear()
+        assert len(cache) == 0
+        assert cache.info() == (0, 0, 1024, 0)
+
+    def test_info(self):
+        cache = utils.LRUCache(maxsize=10)
+        cache.put('foo', 1)
+        cache.get('foo')
+        cache.get('bar')
+        cache.get('foo')
+        assert cache.info() == utils.CacheInfo(
+            hits=2, misses=1, maxsize=10, currsize=1)
+
+    def test_resize(self):
+        cache = utils.LRUCache(maxsize=3)
+        for i in range(3):
+            cache.put(i, i)
+        cache.resize(1)
+        assert cache.maxsize == 1
+        assert len(cache) == 1
+        assert 2 in cache